@@ -1,12 +1,25 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import io
+import os
+import tempfile
+import uuid
 from datetime import datetime
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+from inventario_core import (
+    CACHE_INVENTARIOS, COLUMNAS_OPCIONALES, FORMATOS_INVENTARIO, CacheInventarios, IndiceInventario,
+    leer_inventario, preparar_inventario
+)
+from conteo_columnar import COLUMNAS_CONTEO, FORMATOS_EXPORTACION, POLITICAS_DUPLICADO, ConteoColumnar
+from estado_compartido import EstadoCompartido
+from reportes import (
+    ENCABEZADOS_COBERTURA, ENCABEZADOS_PENDIENTES, GestorReportes, escribir_reporte_reconciliacion,
+    vistas_conciliacion
+)
+
 # Configuración de la página
 st.set_page_config(
     page_title="📦 Visor de Inventario Pro",
@@ -204,12 +217,46 @@ statusObserver.observe(document.body, { childList: true, subtree: true });
 </script>
 """, unsafe_allow_html=True)
 
+def nuevo_conteo():
+    """Conteo físico vacío en almacenamiento columnar"""
+    return ConteoColumnar({**COLUMNAS_CONTEO, 'timestamp': 'datetime64[us]'})
+
+# Bitácora en disco: el conteo de cada sesión sobrevive a un refresco del navegador
+DATA_DIR = os.environ.get('INVENTARIO_DATA_DIR', 'data')
+# Pendientes que se muestran en pantalla; el reporte Excel los trae todos
+MAX_PENDIENTES_VISTA = 1000
+
+@st.cache_resource
+def bitacora_conteo():
+    """Bitácora del conteo compartida por todas las sesiones del servidor"""
+    return EstadoCompartido(os.path.join(DATA_DIR, 'conteo_streamlit.db'))
+
+@st.cache_resource
+def gestor_reportes():
+    """Pool de procesos para los reportes Excel, compartido por todas las sesiones del servidor"""
+    return GestorReportes(os.path.join(DATA_DIR, 'reportes'))
+
+def restaurar_conteo():
+    """Reconstruye el conteo de la sesión reproduciendo su bitácora; el ID de sesión vive en la URL"""
+    sesion = st.query_params.get('sesion')
+    if not sesion:
+        sesion = uuid.uuid4().hex
+        st.query_params['sesion'] = sesion
+    
+    bitacora = bitacora_conteo()
+    conteo = nuevo_conteo()
+    for _, tipo, datos in bitacora.eventos_desde(0, canal=sesion):
+        conteo.aplicar_evento(tipo, datos)
+    conteo.bitacora = lambda tipo, datos: bitacora.registrar(tipo, datos, canal=sesion)
+    return conteo
+
 # Inicializar estado de la sesión
 def init_session_state():
     """Inicializar estado de sesión"""
     defaults = {
         'inventario_sistema': None,
-        'conteo_fisico': [],
+        'indice_inventario': None,
+        'conteo_fisico': None,
         'archivo_cargado': False,
         'campo_counter': 0,
         'mostrar_duplicado': False,
@@ -217,6 +264,8 @@ def init_session_state():
         'temp_data': None,
         'editando': False,
         'registro_seleccionado': None,
+        'politica_duplicados': 'preguntar',
+        'reporte_pendiente': None,
         'session_stats': {
             'start_time': datetime.now(),
             'total_processed': 0,
@@ -226,6 +275,9 @@ def init_session_state():
     for key, default_value in defaults.items():
         if key not in st.session_state:
             st.session_state[key] = default_value
+    
+    if st.session_state.conteo_fisico is None:
+        st.session_state.conteo_fisico = restaurar_conteo()
 
 init_session_state()
 
@@ -233,32 +285,35 @@ init_session_state()
 def cargar_inventario(archivo):
     """Carga y valida el archivo de inventario"""
     try:
+        # Un archivo idéntico ya procesado (misma huella SHA-256) se sirve desde la caché
+        contenido = archivo.getvalue()
+        huella = CacheInventarios.huella(contenido)
+        en_cache = CACHE_INVENTARIOS.obtener(huella)
+        if en_cache is not None:
+            st.info("⚡ Este archivo ya fue procesado: cargado desde la caché")
+            return en_cache
+        
         with st.spinner("Cargando y validando archivo..."):
-            df = pd.read_excel(archivo, dtype=str, engine='openpyxl')
-            df = df.dropna(how='all')
-            df.columns = [str(c).strip() for c in df.columns]
+            # Lectura en streaming de las columnas necesarias, con progreso
+            barra = st.progress(0.0, text="Leyendo archivo...")
+            df = leer_inventario(
+                contenido, archivo.name,
+                progreso=lambda leidas, total: barra.progress(
+                    min(leidas / total, 1.0) if total else 1.0, text=f"Leyendo archivo... {leidas:,} filas"
+                )
+            )
+            barra.empty()
             
-            required_cols = ['Id de pallet', 'Inventario físico']
-            missing_cols = [col for col in required_cols if col not in df.columns]
+            # Limpiar, normalizar y validar columnas
+            df, missing_cols, columnas_creadas = preparar_inventario(df)
             
             if missing_cols:
                 st.error(f"Columnas requeridas faltantes: {', '.join(missing_cols)}")
                 st.info("Columnas disponibles: " + ", ".join(df.columns))
-                return None
-            
-            optional_cols = {
-                'Almacén': 'Almacén General',
-                'Código de artículo': 'N/A',
-                'Nombre del producto': 'Producto sin nombre'
-            }
-            
-            for col, default_val in optional_cols.items():
-                if col not in df.columns:
-                    df[col] = default_val
-                    st.info(f"Columna '{col}' creada con valor por defecto: '{default_val}'")
+                return None, None
             
-            df['Inventario físico'] = pd.to_numeric(df['Inventario físico'], errors='coerce').fillna(0).astype(int)
-            df['Id de pallet'] = df['Id de pallet'].astype(str).str.strip()
+            for col in columnas_creadas:
+                st.info(f"Columna '{col}' creada con valor por defecto: '{COLUMNAS_OPCIONALES[col]}'")
             
             total_records = len(df)
             duplicates = df['Id de pallet'].duplicated().sum()
@@ -275,32 +330,22 @@ def cargar_inventario(archivo):
             if duplicates > 0:
                 st.warning(f"⚠️ Se detectaron {duplicates} IDs duplicados.")
             
-            return df
+            indice = IndiceInventario(df)
+            CACHE_INVENTARIOS.guardar(huella, df, indice)
+            return df, indice
             
     except Exception as e:
         st.error(f"Error al cargar el archivo: {str(e)}")
-        return None
+        return None, None
 
-def buscar_info_pallet(id_pallet, df_inventario):
-    """Busca información del pallet en el inventario del sistema"""
-    if df_inventario is None or id_pallet == "":
+def buscar_info_pallet(id_pallet, indice_inventario):
+    """Busca información del pallet en el índice del inventario del sistema"""
+    if indice_inventario is None or id_pallet == "":
         return None, None, None, None
     
-    mask = df_inventario['Id de pallet'].astype(str).str.strip() == str(id_pallet).strip()
-    match = df_inventario[mask]
-    
-    if not match.empty:
-        almacen = str(match.iloc[0].get('Almacén', 'N/A')).strip()
-        inv_sistema = match.iloc[0].get('Inventario físico', 0)
-        codigo = str(match.iloc[0].get('Código de artículo', 'N/A')).strip()
-        nombre = str(match.iloc[0].get('Nombre del producto', 'N/A')).strip()
-        
-        try:
-            inv_sistema = int(inv_sistema) if inv_sistema is not None else 0
-        except:
-            inv_sistema = 0
-            
-        return almacen, codigo, nombre, inv_sistema
+    info = indice_inventario.buscar(id_pallet)
+    if info['found']:
+        return info['almacen'], info['codigo'], info['nombre'], info['inv_sistema']
     else:
         return None, None, None, None
 
@@ -309,18 +354,14 @@ def calcular_estadisticas():
     if not st.session_state.conteo_fisico:
         return 0, 0, 0, 0, 0
     
-    total = len(st.session_state.conteo_fisico)
-    exactos = len([item for item in st.session_state.conteo_fisico if item['diferencia'] == 0])
-    sobrantes = len([item for item in st.session_state.conteo_fisico if item['diferencia'] > 0])
-    faltantes = len([item for item in st.session_state.conteo_fisico if item['diferencia'] < 0])
-    no_encontrados = len([item for item in st.session_state.conteo_fisico if item['inv_sistema'] is None])
-    
-    return total, exactos, sobrantes, faltantes, no_encontrados
+    # Acumulador mantenido por el conteo en cada alta/edición/baja: O(1)
+    acumulado = st.session_state.conteo_fisico.estadisticas
+    return acumulado.total, acumulado.exactos, acumulado.sobrantes, acumulado.faltantes, acumulado.no_encontrados
 
-def procesar_pallet(numero_tablilla, id_pallet, cantidad_contada):
-    """Función para procesar y agregar un pallet al conteo"""
+def procesar_pallet(numero_tablilla, id_pallet, cantidad_contada, politica='ambos'):
+    """Función para procesar y agregar un pallet al conteo según la política de duplicados"""
     # Buscar información del pallet
-    almacen, codigo, nombre, inv_sistema = buscar_info_pallet(id_pallet, st.session_state.inventario_sistema)
+    almacen, codigo, nombre, inv_sistema = buscar_info_pallet(id_pallet, st.session_state.indice_inventario)
     
     # Calcular diferencia
     diferencia = cantidad_contada - (inv_sistema if inv_sistema is not None else 0)
@@ -339,7 +380,16 @@ def procesar_pallet(numero_tablilla, id_pallet, cantidad_contada):
     }
     
     # Agregar al conteo
-    st.session_state.conteo_fisico.append(nuevo_item)
+    accion, posicion = st.session_state.conteo_fisico.agregar(nuevo_item, politica)
+    if accion == 'rechazado':
+        st.warning(f"⚠️ {id_pallet}: ya fue contado, duplicado rechazado")
+        return accion
+    if accion == 'sumado':
+        registro = st.session_state.conteo_fisico[posicion]
+        cantidad_contada, diferencia = registro['cantidad_contada'], registro['diferencia']
+        st.info(f"➕ {id_pallet}: sumado al registro anterior, total {cantidad_contada}")
+    elif accion == 'reemplazado':
+        st.info(f"🔄 {id_pallet}: reemplaza al registro anterior")
     
     # Feedback visual
     if inv_sistema is not None:
@@ -351,6 +401,7 @@ def procesar_pallet(numero_tablilla, id_pallet, cantidad_contada):
             st.error(f"🔽 {id_pallet}: Faltante de {abs(diferencia)} unidades - {nombre[:30]}")
     else:
         st.info(f"❓ {id_pallet}: No encontrado en sistema - {cantidad_contada} unidades")
+    return accion
 
 def limpiar_campos():
     """Función para limpiar los campos de entrada usando keys dinámicas"""
@@ -359,97 +410,82 @@ def limpiar_campos():
     st.session_state.campo_counter += 1
 
 def generar_reporte_excel():
-    """Genera reporte profesional en formato Excel"""
-    if not st.session_state.conteo_fisico:
+    """Encola el reporte Excel en el pool de procesos y devuelve su Future
+    
+    Las hojas salen de las categorías de conciliación que el conteo mantiene en
+    cada escaneo, sin cruzar con el inventario. La clave lleva la versión del
+    conteo: sin escaneos nuevos se reutiliza el reporte ya generado.
+    """
+    conteo = st.session_state.conteo_fisico
+    if not conteo:
         return None
     
-    try:
-        df_conteo = pd.DataFrame(st.session_state.conteo_fisico)
-        
-        # Merge con inventario del sistema
-        df_sistema = st.session_state.inventario_sistema.copy()
-        df_sistema['Id de pallet'] = df_sistema['Id de pallet'].astype(str).str.strip()
-        df_conteo['id_pallet'] = df_conteo['id_pallet'].astype(str).str.strip()
-        
-        # LEFT JOIN desde conteo
-        df_completo = pd.merge(df_conteo, df_sistema, left_on='id_pallet', right_on='Id de pallet', 
-                              how='left', indicator=True, suffixes=('_conteo', '_sistema'))
-        
-        # Separar en categorías
-        no_encontrados = df_completo[df_completo['_merge'] == 'left_only'].copy()
-        encontrados = df_completo[df_completo['_merge'] == 'both'].copy()
-        
-        if not encontrados.empty:
-            encontrados['diferencia_calc'] = encontrados['cantidad_contada'] - encontrados['inv_sistema']
-            diferencias = encontrados[encontrados['diferencia_calc'] != 0].copy()
-            exactos = encontrados[encontrados['diferencia_calc'] == 0].copy()
-        else:
-            diferencias = pd.DataFrame()
-            exactos = pd.DataFrame()
-        
-        # Crear archivo Excel en memoria
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Hoja de resumen ejecutivo
-            total, exactos_count, sobrantes, faltantes, no_encontrados_count = calcular_estadisticas()
-            
-            resumen_data = {
-                'Métrica': [
-                    'Fecha del Reporte',
-                    'Total Pallets Digitados',
-                    'Pallets Encontrados en Sistema',
-                    'Pallets con Cantidad Exacta',
-                    'Pallets con Diferencias',
-                    'Pallets NO Encontrados en Sistema',
-                    'Precisión del Inventario (%)',
-                    'Total Sobrantes',
-                    'Total Faltantes'
-                ],
-                'Valor': [
-                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    len(df_conteo),
-                    len(encontrados),
-                    len(exactos),
-                    len(diferencias),
-                    len(no_encontrados),
-                    round((len(exactos) / len(encontrados) * 100) if len(encontrados) > 0 else 0, 2),
-                    sobrantes,
-                    faltantes
-                ]
-            }
-            df_resumen = pd.DataFrame(resumen_data)
-            df_resumen.to_excel(writer, sheet_name='Resumen Ejecutivo', index=False)
-            
-            # Hoja de discrepancias
-            if not diferencias.empty:
-                cols_diferencias = ['numero_tablilla', 'id_pallet', 'almacen', 'codigo_articulo', 
-                                   'nombre_producto', 'cantidad_contada', 'inv_sistema', 'diferencia_calc']
-                diferencias_export = diferencias[cols_diferencias].copy()
-                diferencias_export.columns = ['Tablilla', 'ID Pallet', 'Almacén', 'Código', 
-                                             'Producto', 'Contado', 'Sistema', 'Diferencia']
-                diferencias_export.to_excel(writer, sheet_name='Discrepancias', index=False)
-            
-            # Hoja de exactos
-            if not exactos.empty:
-                cols_exactos = ['numero_tablilla', 'id_pallet', 'almacen', 'codigo_articulo', 
-                               'nombre_producto', 'cantidad_contada']
-                exactos_export = exactos[cols_exactos].copy()
-                exactos_export.columns = ['Tablilla', 'ID Pallet', 'Almacén', 'Código', 'Producto', 'Cantidad']
-                exactos_export.to_excel(writer, sheet_name='Cantidades Exactas', index=False)
-            
-            # Hoja de no encontrados
-            if not no_encontrados.empty:
-                cols_no_encontrados = ['numero_tablilla', 'id_pallet', 'almacen', 'cantidad_contada']
-                no_encontrados_export = no_encontrados[cols_no_encontrados].copy()
-                no_encontrados_export.columns = ['Tablilla', 'ID Pallet', 'Almacén', 'Cantidad']
-                no_encontrados_export.to_excel(writer, sheet_name='No Encontrados', index=False)
-        
-        output.seek(0)
-        return output.getvalue()
-        
-    except Exception as e:
-        st.error(f"Error generando reporte: {str(e)}")
+    gestor = gestor_reportes()
+    indice = st.session_state.indice_inventario
+    inventario = indice.identificador if indice is not None else '0'
+    clave = f"reconciliacion-{conteo.clave_version}-{inventario}.xlsx"
+    futuro = gestor.buscar(clave)
+    if futuro is None:
+        _, _, sobrantes, faltantes, _ = calcular_estadisticas()
+        cobertura = cobertura_inventario()
+        pendientes = cobertura.vista_pendientes() if cobertura else None
+        almacenes = cobertura.cobertura_por_almacen() if cobertura else None
+        futuro = gestor.solicitar(clave, escribir_reporte_reconciliacion, vistas_conciliacion(conteo),
+                                  sobrantes, faltantes, pendientes, almacenes, grupo=conteo.identificador)
+    return futuro
+
+def leer_reporte(futuro):
+    """Bytes del reporte si ya terminó (o la excepción con que falló); None si sigue en curso"""
+    if not futuro.done():
+        return None
+    with open(futuro.result(), 'rb') as archivo:
+        return archivo.read()
+
+def exportar_datos(formato):
+    """Exportación del conteo en un archivo temporal, abierta para la descarga
+    
+    Cada tanda de exportar() se escribe directo a disco: el archivo completo
+    nunca se arma en memoria como un solo bloque de bytes.
+    """
+    archivo = tempfile.TemporaryFile()
+    for trozo in st.session_state.conteo_fisico.exportar(formato):
+        archivo.write(trozo)
+    archivo.seek(0)
+    return archivo
+
+def cobertura_inventario():
+    """Cobertura del inventario por el conteo de la sesión; None sin inventario cargado"""
+    if st.session_state.conteo_fisico is None:
         return None
+    return st.session_state.conteo_fisico.cobertura_de(st.session_state.indice_inventario)
+
+def mostrar_pendientes():
+    """Pallets del sistema que todavía no se contaron, con la cobertura por almacén"""
+    cobertura = cobertura_inventario()
+    if cobertura is None:
+        return
+    
+    st.subheader("📋 Pendientes de Contar")
+    resumen = cobertura.resumen()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Pallets en Sistema", f"{resumen['total']:,}")
+    with col2:
+        st.metric("Contados", f"{resumen['contados']:,}", f"{resumen['cobertura']}% de cobertura")
+    with col3:
+        st.metric("Pendientes", f"{resumen['pendientes']:,}")
+    
+    almacenes = cobertura.cobertura_por_almacen()
+    st.dataframe(almacenes.set_axis(ENCABEZADOS_COBERTURA, axis=1), use_container_width=True, hide_index=True)
+    
+    almacen = st.selectbox("Almacén", options=['Todos', *almacenes['almacen']], key='almacen_pendientes')
+    posiciones = cobertura.pendientes(None if almacen == 'Todos' else almacen)
+    if len(posiciones) > MAX_PENDIENTES_VISTA:
+        st.caption(f"{len(posiciones):,} pallets pendientes; se muestran los primeros {MAX_PENDIENTES_VISTA:,}")
+    st.dataframe(
+        cobertura.vista_pendientes(posiciones[:MAX_PENDIENTES_VISTA]).set_axis(ENCABEZADOS_PENDIENTES, axis=1),
+        use_container_width=True, hide_index=True
+    )
 
 # Dashboard ejecutivo
 def create_executive_dashboard():
@@ -511,7 +547,7 @@ def create_executive_dashboard():
     with col3:
         # Análisis por almacén
         if st.session_state.conteo_fisico:
-            df = pd.DataFrame(st.session_state.conteo_fisico)
+            df = st.session_state.conteo_fisico.a_dataframe()
             if 'almacen' in df.columns:
                 almacen_counts = df['almacen'].value_counts()
                 
@@ -547,15 +583,16 @@ def main():
         st.header("📁 Cargar Inventario")
         
         uploaded_file = st.file_uploader(
-            "Selecciona el archivo Excel de inventario",
-            type=['xlsx'],
+            "Selecciona el archivo de inventario (Excel, CSV o Parquet)",
+            type=FORMATOS_INVENTARIO,
             help="El archivo debe contener las columnas: 'Id de pallet' e 'Inventario físico'"
         )
         
         if uploaded_file is not None and not st.session_state.archivo_cargado:
-            inventario_df = cargar_inventario(uploaded_file)
+            inventario_df, indice = cargar_inventario(uploaded_file)
             if inventario_df is not None:
                 st.session_state.inventario_sistema = inventario_df
+                st.session_state.indice_inventario = indice
                 st.session_state.archivo_cargado = True
                 st.success(f"✅ Inventario cargado: {len(inventario_df)} registros")
                 st.rerun()
@@ -565,10 +602,20 @@ def main():
             
             if st.button("🔄 Cargar nuevo archivo"):
                 st.session_state.inventario_sistema = None
+                st.session_state.indice_inventario = None
                 st.session_state.archivo_cargado = False
-                st.session_state.conteo_fisico = []
+                st.session_state.conteo_fisico.limpiar()
                 st.rerun()
         
+        # Qué hacer con un pallet que ya fue contado en esta sesión
+        opciones_politica = {'preguntar': 'Preguntar', **POLITICAS_DUPLICADO}
+        st.session_state.politica_duplicados = st.selectbox(
+            "🔁 Pallets duplicados",
+            options=list(opciones_politica),
+            index=list(opciones_politica).index(st.session_state.politica_duplicados),
+            format_func=opciones_politica.get
+        )
+        
         # Información de sesión
         if st.session_state.session_stats['total_processed'] > 0:
             st.divider()
@@ -650,7 +697,7 @@ def main():
             
             # Mostrar información detectada INMEDIATAMENTE cuando cambia el ID
             if id_pallet:
-                almacen, codigo, nombre, inv_sistema = buscar_info_pallet(id_pallet, st.session_state.inventario_sistema)
+                almacen, codigo, nombre, inv_sistema = buscar_info_pallet(id_pallet, st.session_state.indice_inventario)
                 if almacen is not None:
                     st.markdown(f"""
                     <div class="pallet-info-detected">
@@ -658,9 +705,13 @@ def main():
                     </div>
                     """, unsafe_allow_html=True)
                 else:
-                    st.markdown("""
+                    similares = st.session_state.indice_inventario.similares(id_pallet)
+                    sugerencia = ""
+                    if similares:
+                        sugerencia = "<br><small>¿Quisiste decir: " + ", ".join(s['id_pallet'] for s in similares) + "?</small>"
+                    st.markdown(f"""
                     <div class="pallet-not-found">
-                        <strong>⚠️ Pallet no encontrado en el sistema</strong>
+                        <strong>⚠️ Pallet no encontrado en el sistema</strong>{sugerencia}
                     </div>
                     """, unsafe_allow_html=True)
         
@@ -676,10 +727,9 @@ def main():
         # Botón para agregar
         if st.button("➕ Agregar al Conteo", use_container_width=True, type="primary"):
             if numero_tablilla and id_pallet:
-                # Verificar duplicados
-                ids_existentes = [item['id_pallet'] for item in st.session_state.conteo_fisico]
-                
-                if id_pallet in ids_existentes:
+                # Verificar duplicados con el índice por ID del conteo (O(1))
+                if (st.session_state.politica_duplicados == 'preguntar'
+                        and st.session_state.conteo_fisico.contiene(id_pallet)):
                     # Mostrar modal de duplicado
                     st.session_state.mostrar_duplicado = True
                     st.session_state.pallet_duplicado = id_pallet
@@ -690,8 +740,10 @@ def main():
                     }
                     st.rerun()
                 else:
-                    # Procesar normalmente
-                    procesar_pallet(numero_tablilla, id_pallet, cantidad_contada)
+                    # Procesar según la política elegida
+                    politica = st.session_state.politica_duplicados
+                    procesar_pallet(numero_tablilla, id_pallet, cantidad_contada,
+                                    'ambos' if politica == 'preguntar' else politica)
                     st.session_state.session_stats['total_processed'] += 1
                     limpiar_campos()
                     st.rerun()
@@ -711,16 +763,12 @@ def main():
             
             with col_dup1:
                 if st.button("🔄 Reemplazar anterior", use_container_width=True):
-                    # Remover el existente
-                    st.session_state.conteo_fisico = [
-                        item for item in st.session_state.conteo_fisico 
-                        if item['id_pallet'] != st.session_state.pallet_duplicado
-                    ]
-                    # Procesar el nuevo
+                    # Reemplazar el existente en su misma posición
                     procesar_pallet(
                         st.session_state.temp_data['numero_tablilla'],
                         st.session_state.temp_data['id_pallet'],
-                        st.session_state.temp_data['cantidad_contada']
+                        st.session_state.temp_data['cantidad_contada'],
+                        'reemplazar'
                     )
                     st.session_state.mostrar_duplicado = False
                     limpiar_campos()
@@ -748,7 +796,7 @@ def main():
             st.subheader("📋 Resultados del Conteo")
             
             # Convertir a DataFrame para mostrar
-            df_display = pd.DataFrame(st.session_state.conteo_fisico)
+            df_display = st.session_state.conteo_fisico.a_dataframe()
             
             # Agregar índice para selección
             df_display.reset_index(inplace=True)
@@ -783,18 +831,17 @@ def main():
                 if st.button("🗑️ Eliminar Seleccionado"):
                     if 'registro_seleccionado' in st.session_state and st.session_state.registro_seleccionado is not None:
                         # Eliminar el registro
-                        st.session_state.conteo_fisico.pop(st.session_state.registro_seleccionado)
+                        st.session_state.conteo_fisico.eliminar(st.session_state.registro_seleccionado)
                         st.session_state.registro_seleccionado = None
                         st.success("Registro eliminado")
                         st.rerun()
                     else:
                         st.warning("Selecciona un registro primero")
             
-            # Filtrar datos si hay búsqueda
+            # Filtrar datos si hay búsqueda (índice de trigramas del conteo; row_id es la posición)
             df_filtrado = df_display.copy()
             if filtro_busqueda:
-                mask = df_filtrado.astype(str).apply(lambda x: x.str.contains(filtro_busqueda, case=False, na=False)).any(axis=1)
-                df_filtrado = df_filtrado[mask]
+                df_filtrado = df_filtrado.iloc[st.session_state.conteo_fisico.filtrar(filtro_busqueda)]
             
             # Selector de registro
             if len(df_filtrado) > 0:
@@ -836,13 +883,13 @@ def main():
                     with col_btn1:
                         if st.button("💾 Guardar Cambios", use_container_width=True):
                             # Buscar información actualizada del pallet
-                            almacen, codigo, nombre, inv_sistema = buscar_info_pallet(nuevo_id_pallet, st.session_state.inventario_sistema)
+                            almacen, codigo, nombre, inv_sistema = buscar_info_pallet(nuevo_id_pallet, st.session_state.indice_inventario)
                             
                             # Calcular nueva diferencia
                             diferencia = nueva_cantidad - (inv_sistema if inv_sistema is not None else 0)
                             
                             # Actualizar registro
-                            st.session_state.conteo_fisico[st.session_state.registro_seleccionado].update({
+                            st.session_state.conteo_fisico.actualizar(st.session_state.registro_seleccionado, {
                                 'numero_tablilla': nueva_tablilla,
                                 'id_pallet': nuevo_id_pallet,
                                 'codigo_articulo': codigo if codigo != 'N/A' else '',
@@ -884,12 +931,21 @@ def main():
             
             with col1:
                 if st.button("🗑️ Limpiar Todo"):
-                    st.session_state.conteo_fisico = []
+                    st.session_state.conteo_fisico.limpiar()
                     st.rerun()
             
             with col2:
                 if st.button("📊 Generar Excel"):
-                    excel_file = generar_reporte_excel()
+                    st.session_state.reporte_pendiente = generar_reporte_excel()
+                
+                # El reporte se arma en otro proceso; la página sigue respondiendo mientras tanto
+                if st.session_state.reporte_pendiente:
+                    try:
+                        excel_file = leer_reporte(st.session_state.reporte_pendiente)
+                    except Exception as e:
+                        st.error(f"Error generando reporte: {str(e)}")
+                        st.session_state.reporte_pendiente = None
+                        excel_file = None
                     if excel_file:
                         st.download_button(
                             label="⬇️ Descargar Excel",
@@ -898,10 +954,37 @@ def main():
                             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                         )
                         st.success("¡Reporte generado!")
+                    elif st.session_state.reporte_pendiente:
+                        st.info("⏳ Generando reporte en segundo plano...")
+                        if st.button("🔄 Revisar reporte"):
+                            st.rerun()
             
             with col3:
                 if st.button("📈 Actualizar Dashboard"):
                     st.rerun()
+            
+            # Datos para BI: CSV, Parquet o JSON Lines generados por tandas desde el conteo
+            col_formato, col_exportar = st.columns([1, 2])
+            
+            with col_formato:
+                formato_datos = st.selectbox(
+                    "Formato de datos",
+                    options=list(FORMATOS_EXPORTACION),
+                    format_func=lambda formato: FORMATOS_EXPORTACION[formato][0]
+                )
+            
+            with col_exportar:
+                if st.button("📦 Exportar datos"):
+                    nombre_formato, mime = FORMATOS_EXPORTACION[formato_datos]
+                    st.download_button(
+                        label=f"⬇️ Descargar {nombre_formato}",
+                        data=exportar_datos(formato_datos),
+                        file_name=f"Reporte_Inventario_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato_datos}",
+                        mime=mime
+                    )
+
+        # Pallets del sistema que todavía no se contaron
+        mostrar_pendientes()
 
 # Ejecutar aplicación
 if __name__ == "__main__":
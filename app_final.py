@@ -1,12 +1,22 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import io
+import os
+import tempfile
+import uuid
 from datetime import datetime
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+from inventario_core import (
+    CACHE_INVENTARIOS, COLUMNAS_OPCIONALES, FORMATOS_INVENTARIO, CacheInventarios, IndiceInventario,
+    leer_inventario, preparar_inventario
+)
+from conteo_columnar import COLUMNAS_CONTEO, FORMATOS_EXPORTACION, POLITICAS_DUPLICADO, ConteoColumnar
+from estado_compartido import EstadoCompartido
+from reportes import ENCABEZADOS_COBERTURA, ENCABEZADOS_PENDIENTES, GestorReportes, escribir_reporte_analisis
+
 # Configuración de la página
 st.set_page_config(
     page_title="📦 Visor de Inventario Pro",
@@ -196,15 +206,56 @@ observer.observe(document.body, {
 </script>
 """, unsafe_allow_html=True)
 
+def nuevo_conteo():
+    """Conteo físico vacío en almacenamiento columnar"""
+    return ConteoColumnar({
+        **COLUMNAS_CONTEO,
+        'timestamp': 'datetime64[us]',
+        'found_in_system': bool,
+        'processing_time': float
+    })
+
+# Bitácora en disco: el conteo de cada sesión sobrevive a un refresco del navegador
+DATA_DIR = os.environ.get('INVENTARIO_DATA_DIR', 'data')
+# Pendientes que se muestran en pantalla; el reporte Excel los trae todos
+MAX_PENDIENTES_VISTA = 1000
+
+@st.cache_resource
+def bitacora_conteo():
+    """Bitácora del conteo compartida por todas las sesiones del servidor"""
+    return EstadoCompartido(os.path.join(DATA_DIR, 'conteo_streamlit.db'))
+
+@st.cache_resource
+def gestor_reportes():
+    """Pool de procesos para los reportes Excel, compartido por todas las sesiones del servidor"""
+    return GestorReportes(os.path.join(DATA_DIR, 'reportes'))
+
+def restaurar_conteo():
+    """Reconstruye el conteo de la sesión reproduciendo su bitácora; el ID de sesión vive en la URL"""
+    sesion = st.query_params.get('sesion')
+    if not sesion:
+        sesion = uuid.uuid4().hex
+        st.query_params['sesion'] = sesion
+    
+    bitacora = bitacora_conteo()
+    conteo = nuevo_conteo()
+    for _, tipo, datos in bitacora.eventos_desde(0, canal=sesion):
+        conteo.aplicar_evento(tipo, datos)
+    conteo.bitacora = lambda tipo, datos: bitacora.registrar(tipo, datos, canal=sesion)
+    return conteo
+
 # Inicializar estado de la sesión con mejoras
 def init_session_state():
     """Inicializar estado de sesión con configuración optimizada"""
     defaults = {
         'inventario_sistema': None,
-        'conteo_fisico': [],
+        'indice_inventario': None,
+        'conteo_fisico': None,
         'archivo_cargado': False,
         'campo_counter': 0,
         'last_added_id': None,
+        'politica_duplicados': 'ambos',
+        'reporte_pendiente': None,
         'session_stats': {
             'start_time': datetime.now(),
             'total_processed': 0,
@@ -214,6 +265,9 @@ def init_session_state():
     for key, default_value in defaults.items():
         if key not in st.session_state:
             st.session_state[key] = default_value
+    
+    if st.session_state.conteo_fisico is None:
+        st.session_state.conteo_fisico = restaurar_conteo()
 
 init_session_state()
 
@@ -221,38 +275,35 @@ init_session_state()
 def cargar_inventario(archivo):
     """Carga y valida el archivo de inventario con mejor manejo de errores"""
     try:
+        # Un archivo idéntico ya procesado (misma huella SHA-256) se sirve desde la caché
+        contenido = archivo.getvalue()
+        huella = CacheInventarios.huella(contenido)
+        en_cache = CACHE_INVENTARIOS.obtener(huella)
+        if en_cache is not None:
+            st.info("⚡ Este archivo ya fue procesado: cargado desde la caché")
+            return en_cache
+        
         with st.spinner("Cargando y validando archivo..."):
-            # Leer archivo Excel con mejor manejo
-            df = pd.read_excel(archivo, dtype=str, engine='openpyxl')
-            
-            # Limpiar y normalizar
-            df = df.dropna(how='all')  # Eliminar filas completamente vacías
-            df.columns = [str(c).strip() for c in df.columns]
+            # Lectura en streaming de las columnas necesarias, con progreso
+            barra = st.progress(0.0, text="Leyendo archivo...")
+            df = leer_inventario(
+                contenido, archivo.name,
+                progreso=lambda leidas, total: barra.progress(
+                    min(leidas / total, 1.0) if total else 1.0, text=f"Leyendo archivo... {leidas:,} filas"
+                )
+            )
+            barra.empty()
             
-            # Validar columnas requeridas
-            required_cols = ['Id de pallet', 'Inventario físico']
-            missing_cols = [col for col in required_cols if col not in df.columns]
+            # Limpiar, normalizar y validar columnas
+            df, missing_cols, columnas_creadas = preparar_inventario(df)
             
             if missing_cols:
                 st.error(f"Columnas requeridas faltantes: {', '.join(missing_cols)}")
                 st.info("Columnas disponibles: " + ", ".join(df.columns))
-                return None
+                return None, None
             
-            # Crear columnas opcionales si no existen
-            optional_cols = {
-                'Almacén': 'Almacén General',
-                'Código de artículo': 'N/A',
-                'Nombre del producto': 'Producto sin nombre'
-            }
-            
-            for col, default_val in optional_cols.items():
-                if col not in df.columns:
-                    df[col] = default_val
-                    st.info(f"Columna '{col}' creada con valor por defecto: '{default_val}'")
-            
-            # Procesar y limpiar datos
-            df['Inventario físico'] = pd.to_numeric(df['Inventario físico'], errors='coerce').fillna(0).astype(int)
-            df['Id de pallet'] = df['Id de pallet'].astype(str).str.strip()
+            for col in columnas_creadas:
+                st.info(f"Columna '{col}' creada con valor por defecto: '{COLUMNAS_OPCIONALES[col]}'")
             
             # Estadísticas del archivo
             total_records = len(df)
@@ -271,38 +322,23 @@ def cargar_inventario(archivo):
             if duplicates > 0:
                 st.warning(f"⚠️ Se detectaron {duplicates} IDs duplicados. Considera limpiar el archivo.")
             
-            return df
+            indice = IndiceInventario(df)
+            CACHE_INVENTARIOS.guardar(huella, df, indice)
+            return df, indice
             
     except Exception as e:
         st.error(f"Error al cargar el archivo: {str(e)}")
-        st.error("Verifica que el archivo sea un Excel válido (.xlsx) y contenga las columnas requeridas.")
-        return None
+        st.error("Verifica que el archivo sea un Excel (.xlsx), CSV o Parquet válido y contenga las columnas requeridas.")
+        return None, None
 
-def buscar_info_pallet_optimized(id_pallet, df_inventario):
-    """Versión optimizada de búsqueda de información del pallet"""
-    if df_inventario is None or not id_pallet:
+def buscar_info_pallet_optimized(id_pallet, indice_inventario):
+    """Búsqueda O(1) de información del pallet usando el índice del inventario"""
+    if indice_inventario is None or not id_pallet:
         return None, None, None, None, False
     
-    # Normalizar ID para búsqueda
-    id_pallet_clean = str(id_pallet).strip().upper()
-    
-    # Crear máscara de búsqueda más robusta
-    mask = df_inventario['Id de pallet'].astype(str).str.strip().str.upper() == id_pallet_clean
-    matches = df_inventario[mask]
-    
-    if not matches.empty:
-        match = matches.iloc[0]  # Tomar el primer match
-        
-        almacen = str(match.get('Almacén', 'N/A')).strip()
-        codigo = str(match.get('Código de artículo', 'N/A')).strip()
-        nombre = str(match.get('Nombre del producto', 'N/A')).strip()
-        
-        try:
-            inv_sistema = int(float(match.get('Inventario físico', 0)))
-        except (ValueError, TypeError):
-            inv_sistema = 0
-        
-        return almacen, codigo, nombre, inv_sistema, True
+    info = indice_inventario.buscar(id_pallet)
+    if info['found']:
+        return info['almacen'], info['codigo'], info['nombre'], info['inv_sistema'], True
     
     return None, None, None, None, False
 
@@ -315,19 +351,20 @@ def calcular_estadisticas_avanzadas():
             'total_variance': 0, 'avg_difference': 0
         }
     
-    df = pd.DataFrame(st.session_state.conteo_fisico)
+    # Acumulador mantenido por el conteo en cada alta/edición/baja: O(1)
+    acumulado = st.session_state.conteo_fisico.estadisticas
     
-    total = len(df)
-    exactos = len(df[df['diferencia'] == 0])
-    sobrantes = len(df[df['diferencia'] > 0])
-    faltantes = len(df[df['diferencia'] < 0])
-    no_encontrados = len(df[df['inv_sistema'].isna()])
+    total = acumulado.total
+    exactos = acumulado.exactos
+    sobrantes = acumulado.sobrantes
+    faltantes = acumulado.faltantes
+    no_encontrados = acumulado.no_encontrados
     
     # Métricas avanzadas
-    precision = (exactos / total * 100) if total > 0 else 0
+    precision = acumulado.precision
     efficiency = (total / (total + no_encontrados) * 100) if (total + no_encontrados) > 0 else 100
-    total_variance = df['diferencia'].var() if len(df) > 1 else 0
-    avg_difference = df['diferencia'].mean() if len(df) > 0 else 0
+    total_variance = acumulado.varianza
+    avg_difference = acumulado.media
     
     return {
         'total': total, 'exactos': exactos, 'sobrantes': sobrantes, 
@@ -337,12 +374,12 @@ def calcular_estadisticas_avanzadas():
     }
 
 def procesar_pallet_optimized(numero_tablilla, id_pallet, cantidad_contada):
-    """Procesamiento optimizado de pallets con mejor feedback"""
+    """Procesamiento optimizado de pallets con mejor feedback; False si se rechaza por duplicado"""
     start_time = datetime.now()
     
     # Buscar información
     almacen, codigo, nombre, inv_sistema, found = buscar_info_pallet_optimized(
-        id_pallet, st.session_state.inventario_sistema
+        id_pallet, st.session_state.indice_inventario
     )
     
     # Calcular diferencia
@@ -363,8 +400,17 @@ def procesar_pallet_optimized(numero_tablilla, id_pallet, cantidad_contada):
         'processing_time': (datetime.now() - start_time).total_seconds()
     }
     
-    # Agregar al conteo
-    st.session_state.conteo_fisico.append(nuevo_item)
+    # Agregar al conteo según la política de duplicados de la sesión
+    accion, posicion = st.session_state.conteo_fisico.agregar(nuevo_item, st.session_state.politica_duplicados)
+    if accion == 'rechazado':
+        st.warning(f"⚠️ {id_pallet}: ya fue contado, duplicado rechazado")
+        return False
+    if accion == 'sumado':
+        registro = st.session_state.conteo_fisico[posicion]
+        cantidad_contada, diferencia = registro['cantidad_contada'], registro['diferencia']
+        st.info(f"➕ {id_pallet}: sumado al registro anterior, total {cantidad_contada}")
+    elif accion == 'reemplazado':
+        st.info(f"🔄 {id_pallet}: reemplaza al registro anterior")
     st.session_state.last_added_id = id_pallet
     
     # Actualizar estadísticas de sesión
@@ -446,7 +492,7 @@ def create_executive_dashboard():
     
     with col3:
         # Distribución en sunburst
-        df = pd.DataFrame(st.session_state.conteo_fisico)
+        df = st.session_state.conteo_fisico.a_dataframe()
         
         if not df.empty and 'almacen' in df.columns:
             # Crear datos para sunburst
@@ -489,68 +535,83 @@ def create_executive_dashboard():
     
     st.markdown('</div>', unsafe_allow_html=True)
 
-def generar_reporte_excel():
-    """Genera reporte Excel mejorado con análisis ejecutivo"""
-    if not st.session_state.conteo_fisico:
+def exportar_datos(formato):
+    """Exportación del conteo en un archivo temporal, abierta para la descarga
+    
+    Cada tanda de exportar() se escribe directo a disco: el archivo completo
+    nunca se arma en memoria como un solo bloque de bytes.
+    """
+    archivo = tempfile.TemporaryFile()
+    for trozo in st.session_state.conteo_fisico.exportar(formato):
+        archivo.write(trozo)
+    archivo.seek(0)
+    return archivo
+
+def cobertura_inventario():
+    """Cobertura del inventario por el conteo de la sesión; None sin inventario cargado"""
+    if st.session_state.conteo_fisico is None:
         return None
+    return st.session_state.conteo_fisico.cobertura_de(st.session_state.indice_inventario)
+
+def mostrar_pendientes():
+    """Pallets del sistema que todavía no se contaron, con la cobertura por almacén"""
+    cobertura = cobertura_inventario()
+    if cobertura is None:
+        return
     
-    df_conteo = pd.DataFrame(st.session_state.conteo_fisico)
-    
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        workbook = writer.book
-        
-        # Formatos profesionales mejorados
-        title_format = workbook.add_format({
-            'bold': True, 'font_size': 18, 'font_color': '#2c3e50',
-            'align': 'center', 'bg_color': '#ecf0f1', 'border': 1
-        })
-        
-        header_format = workbook.add_format({
-            'bold': True, 'bg_color': '#3498db', 'font_color': 'white',
-            'border': 1, 'align': 'center', 'font_size': 12
-        })
-        
-        # Hoja de resumen ejecutivo mejorado
-        stats = calcular_estadisticas_avanzadas()
-        
-        resumen_data = {
-            'KPI': [
-                'Fecha del Análisis', 'Hora de Inicio', 'Duración de Sesión (min)',
-                'Total Pallets Procesados', 'Pallets con Cantidad Exacta',
-                'Pallets con Sobrantes', 'Pallets con Faltantes',
-                'Pallets NO Encontrados', 'Precisión del Inventario (%)',
-                'Eficiencia de Conteo (%)', 'Varianza Total', 'Diferencia Promedio'
-            ],
-            'Valor': [
-                datetime.now().strftime("%Y-%m-%d"),
-                st.session_state.session_stats['start_time'].strftime("%H:%M:%S"),
-                round((datetime.now() - st.session_state.session_stats['start_time']).total_seconds() / 60, 1),
-                stats['total'], stats['exactos'], stats['sobrantes'],
-                stats['faltantes'], stats['no_encontrados'],
-                round(stats['precision'], 2), round(stats['efficiency'], 2),
-                round(stats['total_variance'], 2), round(stats['avg_difference'], 2)
-            ]
-        }
-        
-        df_resumen = pd.DataFrame(resumen_data)
-        df_resumen.to_excel(writer, sheet_name='Resumen Ejecutivo', index=False, startrow=2)
-        
-        ws_resumen = writer.sheets['Resumen Ejecutivo']
-        ws_resumen.write('A1', 'ANÁLISIS EJECUTIVO DE INVENTARIO FÍSICO', title_format)
-        ws_resumen.set_column('A:A', 35)
-        ws_resumen.set_column('B:B', 20)
-        
-        # Hoja de datos completos
-        df_conteo.to_excel(writer, sheet_name='Datos Completos', index=False)
-        ws_datos = writer.sheets['Datos Completos']
-        
-        # Aplicar formato a headers
-        for col_num, value in enumerate(df_conteo.columns.values):
-            ws_datos.write(0, col_num, value, header_format)
+    st.subheader("📋 Pendientes de Contar")
+    resumen = cobertura.resumen()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Pallets en Sistema", f"{resumen['total']:,}")
+    with col2:
+        st.metric("Contados", f"{resumen['contados']:,}", f"{resumen['cobertura']}% de cobertura")
+    with col3:
+        st.metric("Pendientes", f"{resumen['pendientes']:,}")
+    
+    almacenes = cobertura.cobertura_por_almacen()
+    st.dataframe(almacenes.set_axis(ENCABEZADOS_COBERTURA, axis=1), use_container_width=True, hide_index=True)
+    
+    almacen = st.selectbox("Almacén", options=['Todos', *almacenes['almacen']], key='almacen_pendientes')
+    posiciones = cobertura.pendientes(None if almacen == 'Todos' else almacen)
+    if len(posiciones) > MAX_PENDIENTES_VISTA:
+        st.caption(f"{len(posiciones):,} pallets pendientes; se muestran los primeros {MAX_PENDIENTES_VISTA:,}")
+    st.dataframe(
+        cobertura.vista_pendientes(posiciones[:MAX_PENDIENTES_VISTA]).set_axis(ENCABEZADOS_PENDIENTES, axis=1),
+        use_container_width=True, hide_index=True
+    )
+
+def generar_reporte_excel():
+    """Encola el reporte Excel con análisis ejecutivo y devuelve su Future
+    
+    El conteo viaja como copia: el pool lo serializa más tarde en otro hilo y
+    los escaneos siguientes no deben alterarlo. Sin escaneos nuevos se
+    reutiliza el reporte de la misma versión del conteo.
+    """
+    conteo = st.session_state.conteo_fisico
+    if not conteo:
+        return None
     
-    output.seek(0)
-    return output
+    gestor = gestor_reportes()
+    indice = st.session_state.indice_inventario
+    inventario = indice.identificador if indice is not None else '0'
+    clave = f"analisis-{conteo.clave_version}-{inventario}.xlsx"
+    futuro = gestor.buscar(clave)
+    if futuro is None:
+        cobertura = cobertura_inventario()
+        pendientes = cobertura.vista_pendientes() if cobertura else None
+        almacenes = cobertura.cobertura_por_almacen() if cobertura else None
+        futuro = gestor.solicitar(clave, escribir_reporte_analisis, conteo.a_dataframe().copy(),
+                                  calcular_estadisticas_avanzadas(), st.session_state.session_stats['start_time'],
+                                  pendientes, almacenes, grupo=conteo.identificador)
+    return futuro
+
+def leer_reporte(futuro):
+    """Bytes del reporte si ya terminó (o la excepción con que falló); None si sigue en curso"""
+    if not futuro.done():
+        return None
+    with open(futuro.result(), 'rb') as archivo:
+        return archivo.read()
 
 # Función principal mejorada
 def main():
@@ -580,17 +641,26 @@ def main():
         
         st.divider()
         
+        # Qué hacer con un pallet que ya fue contado en esta sesión
+        st.session_state.politica_duplicados = st.selectbox(
+            "🔁 Pallets duplicados",
+            options=list(POLITICAS_DUPLICADO),
+            index=list(POLITICAS_DUPLICADO).index(st.session_state.politica_duplicados),
+            format_func=POLITICAS_DUPLICADO.get
+        )
+        
         # Carga de archivo
         uploaded_file = st.file_uploader(
-            "Selecciona archivo Excel de inventario",
-            type=['xlsx'],
+            "Selecciona archivo de inventario (Excel, CSV o Parquet)",
+            type=FORMATOS_INVENTARIO,
             help="Debe contener: 'Id de pallet' e 'Inventario físico'"
         )
         
         if uploaded_file and not st.session_state.archivo_cargado:
-            inventario_df = cargar_inventario(uploaded_file)
+            inventario_df, indice = cargar_inventario(uploaded_file)
             if inventario_df is not None:
                 st.session_state.inventario_sistema = inventario_df
+                st.session_state.indice_inventario = indice
                 st.session_state.archivo_cargado = True
                 st.success(f"✅ Inventario cargado: {len(inventario_df):,} registros")
                 st.rerun()
@@ -599,8 +669,9 @@ def main():
             st.success(f"📊 Inventario activo: {len(st.session_state.inventario_sistema):,} pallets")
             
             if st.button("🔄 Cargar nuevo archivo"):
-                # Reset completo del estado
-                for key in ['inventario_sistema', 'conteo_fisico', 'archivo_cargado', 'last_added_id']:
+                # Reset completo del estado (también en la bitácora)
+                st.session_state.conteo_fisico.limpiar()
+                for key in ['inventario_sistema', 'indice_inventario', 'conteo_fisico', 'archivo_cargado', 'last_added_id']:
                     if key in st.session_state:
                         del st.session_state[key]
                 st.rerun()
@@ -707,13 +778,18 @@ def main():
             # Detección en tiempo real
             if id_pallet:
                 almacen, codigo, nombre, inv_sistema, found = buscar_info_pallet_optimized(
-                    id_pallet, st.session_state.inventario_sistema
+                    id_pallet, st.session_state.indice_inventario
                 )
                 
                 if found:
                     st.success(f"✅ **{almacen}** | {codigo} | {nombre[:40]}{'...' if len(nombre) > 40 else ''} | Sistema: **{inv_sistema}**")
                 else:
-                    st.warning("⚠️ Pallet no encontrado en el sistema")
+                    similares = st.session_state.indice_inventario.similares(id_pallet)
+                    if similares:
+                        st.warning("⚠️ Pallet no encontrado en el sistema. ¿Quisiste decir: " +
+                                   ", ".join(f"**{s['id_pallet']}**" for s in similares) + "?")
+                    else:
+                        st.warning("⚠️ Pallet no encontrado en el sistema")
             
             st.markdown('</div>', unsafe_allow_html=True)
             
@@ -730,7 +806,7 @@ def main():
         if st.session_state.conteo_fisico:
             st.subheader("📋 Resultados del Conteo")
             
-            df_display = pd.DataFrame(st.session_state.conteo_fisico)
+            df_display = st.session_state.conteo_fisico.a_dataframe()
             
             # Controles de filtro
             col_search, col_filter = st.columns([2, 1])
@@ -748,10 +824,8 @@ def main():
             df_filtered = df_display.copy()
             
             if search_term:
-                mask = df_filtered.astype(str).apply(
-                    lambda x: x.str.contains(search_term, case=False, na=False)
-                ).any(axis=1)
-                df_filtered = df_filtered[mask]
+                # Índice de trigramas del conteo: devuelve las posiciones que coinciden
+                df_filtered = df_filtered.iloc[st.session_state.conteo_fisico.filtrar(search_term)]
             
             if filter_option != "Todos":
                 if filter_option == "Exactos":
@@ -802,29 +876,66 @@ def main():
                 
                 with col1:
                     if st.button("🗑️ Limpiar Todo", use_container_width=True):
-                        st.session_state.conteo_fisico = []
+                        st.session_state.conteo_fisico.limpiar()
                         st.session_state.campo_counter += 1
                         st.rerun()
                 
                 with col2:
                     # Generar reporte Excel
-                    excel_file = generar_reporte_excel()
-                    if excel_file:
-                        st.download_button(
-                            label="📊 Descargar Excel",
-                            data=excel_file,
-                            file_name=f"Inventario_Pro_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                            use_container_width=True
-                        )
+                    if st.button("📊 Generar Excel", use_container_width=True):
+                        st.session_state.reporte_pendiente = generar_reporte_excel()
+                    
+                    # El reporte se arma en otro proceso; la página sigue respondiendo mientras tanto
+                    if st.session_state.reporte_pendiente:
+                        try:
+                            excel_file = leer_reporte(st.session_state.reporte_pendiente)
+                        except Exception as e:
+                            st.error(f"Error generando reporte: {str(e)}")
+                            st.session_state.reporte_pendiente = None
+                            excel_file = None
+                        if excel_file:
+                            st.download_button(
+                                label="⬇️ Descargar Excel",
+                                data=excel_file,
+                                file_name=f"Inventario_Pro_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                use_container_width=True
+                            )
+                        elif st.session_state.reporte_pendiente:
+                            st.caption("⏳ Generando reporte en segundo plano...")
+                            if st.button("🔄 Revisar reporte", use_container_width=True):
+                                st.rerun()
                 
                 with col3:
                     if st.button("📈 Actualizar Dashboard", use_container_width=True):
                         st.rerun()
+                
+                # Datos para BI: CSV, Parquet o JSON Lines generados por tandas desde el conteo
+                col_formato, col_exportar = st.columns([1, 2])
+                
+                with col_formato:
+                    formato_datos = st.selectbox(
+                        "Formato de datos",
+                        options=list(FORMATOS_EXPORTACION),
+                        format_func=lambda formato: FORMATOS_EXPORTACION[formato][0]
+                    )
+                
+                with col_exportar:
+                    if st.button("📦 Exportar datos"):
+                        nombre_formato, mime = FORMATOS_EXPORTACION[formato_datos]
+                        st.download_button(
+                            label=f"⬇️ Descargar {nombre_formato}",
+                            data=exportar_datos(formato_datos),
+                            file_name=f"Inventario_Pro_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato_datos}",
+                            mime=mime
+                        )
             
             else:
                 st.info("No se encontraron resultados con los filtros aplicados")
 
+        # Pallets del sistema que todavía no se contaron
+        mostrar_pendientes()
+
 # Ejecutar aplicación
 if __name__ == "__main__":
     main()
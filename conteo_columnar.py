@@ -0,0 +1,698 @@
+"""Almacenamiento columnar del conteo físico
+
+Cada campo del registro vive en su propio arreglo NumPy tipado que crece por
+duplicación: agregar un pallet es O(1) amortizado y las vistas para pandas no
+copian datos. Reemplaza a la lista de diccionarios que usaban las apps.
+
+Mantiene además un índice ID de pallet normalizado -> posiciones para detectar
+duplicados en O(1) y aplicar la política de duplicados elegida en la sesión, y
+un índice de trigramas para buscar texto en los registros, y la categoría de
+conciliación contra el sistema de cada registro (exacto, discrepancia, no
+encontrado), actualizada en cada cambio para que los reportes no tengan que
+cruzar el conteo con el inventario. Con `cobertura_de` lleva también qué
+pallets del inventario ya se contaron (los pendientes son el resto).
+
+Si se le asigna una `bitacora` (callable(tipo, datos)), cada cambio se registra
+ahí antes de aplicarse en memoria; `aplicar_evento` reproduce esos eventos
+para reconstruir el conteo después de un reinicio.
+
+`exportar` genera CSV, JSON Lines o Parquet por tandas directo desde las
+columnas, para descargas en streaming.
+"""
+import bisect
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from inventario_core import CoberturaInventario, normalizar_id
+
+# Entero que puede faltar (inv_sistema de un pallet no encontrado): se guarda
+# como float64 con NaN, igual que lo dejaba pandas al armar el DataFrame
+ENTERO_NULO = 'entero_nulo'
+
+COLUMNAS_CONTEO = {
+    'numero_tablilla': object,
+    'id_pallet': object,
+    'codigo_articulo': object,
+    'nombre_producto': object,
+    'almacen': object,
+    'cantidad_contada': np.int64,
+    'inv_sistema': ENTERO_NULO,
+    'diferencia': np.int64,
+    'timestamp': object
+}
+
+
+# Qué hacer al escanear un pallet que ya está en el conteo
+POLITICAS_DUPLICADO = {
+    'ambos': 'Conservar ambos',
+    'rechazar': 'Rechazar',
+    'reemplazar': 'Reemplazar anterior',
+    'sumar': 'Sumar cantidades'
+}
+
+
+# Formatos de exportación de datos: extensión -> (nombre, tipo MIME)
+FORMATOS_EXPORTACION = {
+    'csv': ('CSV', 'text/csv'),
+    'parquet': ('Parquet', 'application/vnd.apache.parquet'),
+    'jsonl': ('JSON Lines', 'application/x-ndjson')
+}
+FILAS_POR_TANDA_EXPORTACION = 50000
+
+
+# Categoría de conciliación de un registro contra el inventario del sistema
+CATEGORIAS_CONCILIACION = ('exacto', 'discrepancia', 'no_encontrado')
+
+
+def _dtype(tipo):
+    return np.dtype(np.float64 if tipo == ENTERO_NULO else tipo)
+
+
+def _nulo(tipo):
+    dtype = _dtype(tipo)
+    if dtype.kind == 'f':
+        return np.nan
+    if dtype.kind == 'M':
+        return np.datetime64('NaT')
+    if dtype.kind == 'O':
+        return None
+    return dtype.type(0)
+
+
+class EstadisticasConteo:
+    """Acumulador O(1) de las estadísticas del conteo; admite altas, bajas y ediciones
+
+    La diferencia es entera, así que en lugar de la recurrencia de Welford en
+    punto flotante se llevan la suma y la suma de cuadrados como enteros
+    exactos: quitar registros no acumula error y la media y la varianza salen
+    iguales a las que calcula pandas sobre la columna completa.
+    """
+
+    def __init__(self):
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.total = 0
+        self.exactos = 0
+        self.sobrantes = 0
+        self.faltantes = 0
+        self.no_encontrados = 0
+        self.suma = 0
+        self.suma_cuadrados = 0
+
+    def _sumar(self, diferencias, no_encontrados, signo):
+        diferencias = np.asarray(diferencias, dtype=np.int64)
+        self.total += signo * len(diferencias)
+        self.exactos += signo * int((diferencias == 0).sum())
+        self.sobrantes += signo * int((diferencias > 0).sum())
+        self.faltantes += signo * int((diferencias < 0).sum())
+        self.no_encontrados += signo * int(np.count_nonzero(no_encontrados))
+        self.suma += signo * sum(int(d) for d in diferencias)
+        self.suma_cuadrados += signo * sum(int(d) * int(d) for d in diferencias)
+
+    def agregar(self, diferencia, no_encontrado):
+        self._sumar([diferencia], [no_encontrado], 1)
+
+    def quitar(self, diferencias, no_encontrados):
+        """Descuenta uno o varios registros (arreglos paralelos)"""
+        self._sumar(np.atleast_1d(diferencias), np.atleast_1d(no_encontrados), -1)
+
+    @property
+    def media(self):
+        return self.suma / self.total if self.total else 0
+
+    @property
+    def varianza(self):
+        """Varianza muestral (ddof=1) de la diferencia, como Series.var()"""
+        if self.total < 2:
+            return 0
+        return (self.total * self.suma_cuadrados - self.suma * self.suma) / (self.total * (self.total - 1))
+
+    @property
+    def precision(self):
+        return (self.exactos / self.total * 100) if self.total > 0 else 0
+
+
+class _SalidaPorTrozos:
+    """Destino de escritura para pyarrow que junta los bytes hasta que se retiran"""
+
+    closed = False
+
+    def __init__(self):
+        self._trozos = []
+        self._posicion = 0
+
+    def write(self, datos):
+        datos = bytes(datos)
+        self._trozos.append(datos)
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        datos = b''.join(self._trozos)
+        self._trozos = []
+        return datos
+
+
+class IndiceTrigramas:
+    """Índice invertido de trigramas sobre los campos de texto de los registros
+
+    Cada registro se indexa por una clave estable (no por su posición, que se
+    corre al eliminar), así altas, ediciones y bajas solo tocan los trigramas de
+    ese registro. Las listas de claves por trigrama quedan ordenadas porque las
+    claves crecen. Una búsqueda recorre la lista del trigrama menos frecuente de
+    la consulta y confirma la subcadena sobre el texto del candidato.
+    """
+
+    # Separa los campos para que no haya coincidencias que crucen de uno a otro
+    SEPARADOR = '\x1f'
+    FILAS_POR_BLOQUE = 8192
+
+    def __init__(self):
+        self._listas = {}
+        self._textos = {}
+
+    def __len__(self):
+        return len(self._textos)
+
+    @classmethod
+    def _texto(cls, valores):
+        return cls.SEPARADOR + cls.SEPARADOR.join(
+            '' if v is None else str(v).lower() for v in valores
+        ) + cls.SEPARADOR
+
+    @staticmethod
+    def _trigramas(texto):
+        # Mismo código de 63 bits por trigrama que IndiceDifuso
+        codigos = [ord(c) for c in texto]
+        return {(codigos[i] << 42) | (codigos[i + 1] << 21) | codigos[i + 2] for i in range(len(codigos) - 2)}
+
+    @classmethod
+    def construir(cls, claves, columnas):
+        """Arma el índice de una vez para registros existentes (claves crecientes, columnas de texto)"""
+        indice = cls()
+        textos = pd.Series(cls.SEPARADOR, index=range(len(claves)), dtype=object)
+        for valores in columnas:
+            textos = textos + pd.Series(valores, dtype=object).fillna('').astype(str).str.lower().to_numpy() + cls.SEPARADOR
+        textos = textos.tolist()
+        claves = np.asarray(claves, dtype=np.int64)
+        indice._textos = dict(zip(claves.tolist(), textos))
+
+        # Trigramas de todos los textos con operaciones vectorizadas, por bloques para acotar memoria
+        todos_gramas, todas_filas = [], []
+        for inicio in range(0, len(textos), cls.FILAS_POR_BLOQUE):
+            bloque = np.array(textos[inicio:inicio + cls.FILAS_POR_BLOQUE], dtype=str)
+            ancho = bloque.dtype.itemsize // 4
+            matriz = bloque.view(np.uint32).reshape(len(bloque), ancho).astype(np.int64)
+            gramas = (matriz[:, :-2] << 42) | (matriz[:, 1:-1] << 21) | matriz[:, 2:]
+            gramas[matriz[:, 2:] == 0] = -1
+            # Ordenar cada fila deja juntos los trigramas repetidos de un mismo texto
+            gramas.sort(axis=1)
+            unicos = gramas >= 0
+            unicos[:, 1:] &= gramas[:, 1:] != gramas[:, :-1]
+            todos_gramas.append(gramas[unicos])
+            todas_filas.append(np.nonzero(unicos)[0] + inicio)
+        if not todos_gramas:
+            return indice
+
+        gramas = np.concatenate(todos_gramas)
+        filas = np.concatenate(todas_filas)
+        # Estable: dentro de cada trigrama las filas (y sus claves) siguen en orden
+        orden = np.argsort(gramas, kind='stable')
+        gramas, claves_ordenadas = gramas[orden], claves[filas[orden]]
+        unicos, inicios = np.unique(gramas, return_index=True)
+        for grama, lista in zip(unicos.tolist(), np.split(claves_ordenadas, inicios[1:])):
+            indice._listas[grama] = lista.tolist()
+        return indice
+
+    def agregar(self, clave, valores):
+        texto = self._texto(valores)
+        self._textos[clave] = texto
+        for grama in self._trigramas(texto):
+            lista = self._listas.setdefault(grama, [])
+            if lista and lista[-1] > clave:
+                bisect.insort(lista, clave)
+            else:
+                lista.append(clave)
+
+    def quitar(self, clave):
+        texto = self._textos.pop(clave, None)
+        if texto is None:
+            return
+        for grama in self._trigramas(texto):
+            lista = self._listas[grama]
+            del lista[bisect.bisect_left(lista, clave)]
+            if not lista:
+                del self._listas[grama]
+
+    def actualizar(self, clave, valores):
+        if self._textos.get(clave) != self._texto(valores):
+            self.quitar(clave)
+            self.agregar(clave, valores)
+
+    def buscar(self, texto):
+        """Claves de los registros que contienen `texto` (sin distinguir mayúsculas)"""
+        consulta = str(texto).lower()
+        if len(consulta) < 3:
+            # Muy corta para trigramas: se revisan los textos directamente
+            return [clave for clave, valor in self._textos.items() if consulta in valor]
+
+        listas = [self._listas.get(grama) for grama in self._trigramas(consulta)]
+        if not all(listas):
+            return []
+        candidatos = min(listas, key=len)
+        textos = self._textos
+        return [clave for clave in candidatos if consulta in textos[clave]]
+
+
+def exportar_columnas(columnas, tipos, formato, filas_por_tanda=FILAS_POR_TANDA_EXPORTACION):
+    """Generador de trozos de bytes en CSV, JSON Lines o Parquet a partir de columnas del conteo
+
+    Cada tanda se convierte por separado, así la memoria no depende del tamaño
+    del conteo. `tipos` son los tipos de columna de ConteoColumnar.
+    """
+    if formato not in FORMATOS_EXPORTACION:
+        raise ValueError(f"Formato no válido: {formato}. Opciones: {list(FORMATOS_EXPORTACION)}")
+    total = len(next(iter(columnas.values()))) if columnas else 0
+    tandas = (
+        _tanda_exportacion(columnas, tipos, inicio, inicio + filas_por_tanda)
+        for inicio in range(0, max(total, 1), filas_por_tanda)
+    )
+    if formato == 'csv':
+        return (
+            df.to_csv(index=False, header=i == 0).encode('utf-8')
+            for i, df in enumerate(tandas)
+        )
+    if formato == 'jsonl':
+        return (
+            (df.to_json(orient='records', lines=True, force_ascii=False).rstrip('\n') + '\n').encode('utf-8')
+            for df in tandas if len(df)
+        )
+
+    # Se verifica antes de empezar a generar para que el error llegue al llamador
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Para exportar a Parquet instala pyarrow (pip install pyarrow)")
+    return _generar_parquet(tandas, _esquema_arrow(tipos, pa), pa, pq)
+
+
+def _tanda_exportacion(columnas, tipos, inicio, fin):
+    datos = {}
+    for nombre, tipo in tipos.items():
+        valores = columnas[nombre][inicio:fin]
+        if tipo == ENTERO_NULO:
+            datos[nombre] = pd.array(valores, dtype='Int64')
+        elif valores.dtype.kind == 'O':
+            datos[nombre] = pd.Series([None if v is None else str(v) for v in valores], dtype=object)
+        else:
+            datos[nombre] = valores
+    return pd.DataFrame(datos)
+
+
+def _esquema_arrow(tipos, pa):
+    campos = []
+    for nombre, tipo in tipos.items():
+        dtype = _dtype(tipo)
+        if tipo == ENTERO_NULO:
+            campos.append(pa.field(nombre, pa.int64()))
+        elif dtype.kind == 'O':
+            campos.append(pa.field(nombre, pa.string()))
+        else:
+            campos.append(pa.field(nombre, pa.from_numpy_dtype(dtype)))
+    return pa.schema(campos)
+
+
+def _generar_parquet(tandas, esquema, pa, pq):
+    # Un row group por tanda; los bytes se entregan apenas se escribe cada uno
+    salida = _SalidaPorTrozos()
+    escritor = pq.ParquetWriter(salida, esquema)
+    try:
+        for df in tandas:
+            if len(df):
+                escritor.write_table(pa.Table.from_pandas(df, schema=esquema, preserve_index=False))
+            trozo = salida.retirar()
+            if trozo:
+                yield trozo
+    finally:
+        escritor.close()
+    yield salida.retirar()
+
+
+class ConteoColumnar:
+    """Registros de conteo en columnas tipadas con vistas sin copia para pandas"""
+
+    CAPACIDAD_INICIAL = 1024
+    # Campos de texto en los que busca `filtrar`
+    COLUMNAS_BUSQUEDA = ('id_pallet', 'numero_tablilla', 'codigo_articulo', 'nombre_producto', 'almacen')
+    # Campos del primer escaneo que 'sumar' conserva: solo cambian la cantidad y lo que sale del inventario
+    COLUMNAS_IDENTIDAD = ('id_pallet', 'numero_tablilla', 'timestamp')
+
+    def __init__(self, columnas=None, bitacora=None):
+        self.columnas = dict(columnas or COLUMNAS_CONTEO)
+        self.bitacora = bitacora
+        self.estadisticas = EstadisticasConteo()
+        # Identificador único del conteo en memoria y contador de cambios: juntos
+        # identifican un estado del conteo (p. ej. para cachear reportes)
+        self.identificador = uuid.uuid4().hex
+        self.version = 0
+        self._por_id = {}
+        # El índice de texto se arma en la primera búsqueda y desde ahí se mantiene
+        self._indice_texto = None
+        # Cobertura del inventario: se arma al pedirla y se mantiene mientras no cambie el inventario
+        self._cobertura = None
+        self._siguiente_clave = 0
+        self._n = 0
+        self._datos = {}
+        self._claves = np.empty(0, dtype=np.int64)
+        self._categorias = np.empty(0, dtype=np.int8)
+        self._por_categoria = np.zeros(len(CATEGORIAS_CONCILIACION), dtype=np.int64)
+        self._reservar(self.CAPACIDAD_INICIAL)
+
+    def _reservar(self, capacidad):
+        for nombre, tipo in self.columnas.items():
+            nuevo = np.full(capacidad, _nulo(tipo), dtype=_dtype(tipo))
+            if nombre in self._datos:
+                nuevo[:self._n] = self._datos[nombre][:self._n]
+            self._datos[nombre] = nuevo
+        # Clave estable de cada registro, creciente con la posición
+        claves = np.zeros(capacidad, dtype=np.int64)
+        claves[:self._n] = self._claves[:self._n]
+        self._claves = claves
+        categorias = np.zeros(capacidad, dtype=np.int8)
+        categorias[:self._n] = self._categorias[:self._n]
+        self._categorias = categorias
+
+    @property
+    def clave_version(self):
+        """Cambia con cada alta, edición, baja o limpieza; no se repite entre conteos"""
+        return f"{self.identificador}-{self.version}"
+
+    @property
+    def capacidad(self):
+        return len(next(iter(self._datos.values())))
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self.registro(i)
+
+    def __getitem__(self, i):
+        return self.registro(i)
+
+    def _asignar(self, nombre, i, valor):
+        self._datos[nombre][i] = _nulo(self.columnas[nombre]) if valor is None else valor
+
+    def _registrar(self, tipo, datos):
+        if self.bitacora is not None:
+            self.bitacora(tipo, datos)
+
+    def aplicar_evento(self, tipo, datos):
+        """Reproduce un evento de la bitácora sin volver a registrarlo"""
+        if tipo == 'alta':
+            return self._agregar_con_politica(datos, datos.get('politica', 'ambos'))
+        elif tipo == 'actualizar':
+            self._actualizar(datos['posicion'], datos['cambios'])
+        elif tipo == 'eliminar':
+            mascara = np.zeros(self._n, dtype=bool)
+            mascara[datos['posiciones']] = True
+            self._eliminar_donde(mascara)
+        elif tipo == 'limpiar':
+            self._limpiar()
+
+    def agregar(self, registro, politica='ambos'):
+        """Agrega un registro (dict) aplicando la política de duplicados
+
+        Devuelve (accion, posicion) con accion en 'agregado', 'rechazado',
+        'reemplazado' o 'sumado'. Los campos que falten quedan nulos.
+        """
+        if politica not in POLITICAS_DUPLICADO:
+            raise ValueError(f"Política de duplicados no válida: {politica}")
+        datos = {nombre: registro.get(nombre) for nombre in self.columnas}
+        datos['politica'] = politica
+        self._registrar('alta', datos)
+        return self._agregar_con_politica(registro, politica)
+
+    def _agregar_con_politica(self, registro, politica):
+        existentes = self._por_id.get(normalizar_id(registro.get('id_pallet')))
+        if not existentes or politica == 'ambos':
+            return 'agregado', self._agregar(registro)
+
+        posicion = existentes[-1]
+        if politica == 'rechazar':
+            return 'rechazado', posicion
+        if politica == 'sumar':
+            cantidad = int(self._datos['cantidad_contada'][posicion]) + int(registro.get('cantidad_contada') or 0)
+            inv_sistema = registro.get('inv_sistema')
+            cambios = {nombre: valor for nombre, valor in registro.items() if nombre not in self.COLUMNAS_IDENTIDAD}
+            cambios.update(cantidad_contada=cantidad,
+                           diferencia=cantidad - (inv_sistema if inv_sistema is not None else 0))
+            self._actualizar(posicion, cambios)
+            return 'sumado', posicion
+        self._actualizar(posicion, registro)
+        return 'reemplazado', posicion
+
+    def posiciones_de(self, id_pallet):
+        """Posiciones de los registros de un pallet (ID normalizado), en orden"""
+        return list(self._por_id.get(normalizar_id(id_pallet), ()))
+
+    def ids_contados(self):
+        """IDs normalizados presentes en el conteo (vista, sin copiar)"""
+        return self._por_id.keys()
+
+    def contiene(self, id_pallet):
+        """True si el pallet ya está en el conteo (O(1))"""
+        return normalizar_id(id_pallet) in self._por_id
+
+    def _reindexar(self):
+        self._por_id = {}
+        for i, id_pallet in enumerate(self.columna('id_pallet')):
+            self._por_id.setdefault(normalizar_id(id_pallet), []).append(i)
+
+    def _agregar(self, registro):
+        if self._n == self.capacidad:
+            self._reservar(self.capacidad * 2)
+        i = self._n
+        for nombre in self.columnas:
+            self._asignar(nombre, i, registro.get(nombre))
+        self._claves[i] = self._siguiente_clave
+        self._siguiente_clave += 1
+        self._n += 1
+        self.version += 1
+        self._por_id.setdefault(normalizar_id(self._datos['id_pallet'][i]), []).append(i)
+        self.estadisticas.agregar(*self._valores_estadisticos(i))
+        self._categorizar(i, nuevo=True)
+        if self._cobertura is not None:
+            self._cobertura.marcar([self._datos['id_pallet'][i]])
+        if self._indice_texto is not None:
+            self._indice_texto.agregar(int(self._claves[i]), self._valores_texto(i))
+        return i
+
+    def _valores_texto(self, i):
+        return [self._datos[nombre][i] for nombre in self.COLUMNAS_BUSQUEDA if nombre in self._datos]
+
+    def _valores_estadisticos(self, posiciones):
+        return (self._datos['diferencia'][posiciones], np.isnan(self._datos['inv_sistema'][posiciones]))
+
+    def _categorizar(self, i, nuevo=False):
+        """Recalcula la categoría de conciliación del registro `i` y los totales por categoría"""
+        if np.isnan(self._datos['inv_sistema'][i]):
+            categoria = 2
+        else:
+            categoria = 0 if self._datos['diferencia'][i] == 0 else 1
+        if not nuevo:
+            self._por_categoria[self._categorias[i]] -= 1
+        self._por_categoria[categoria] += 1
+        self._categorias[i] = categoria
+
+    def actualizar(self, i, cambios):
+        """Modifica campos de un registro existente"""
+        i = self._posicion(i)
+        self._registrar('actualizar', {'posicion': i, 'cambios': cambios})
+        self._actualizar(i, cambios)
+
+    def _actualizar(self, i, cambios):
+        self.version += 1
+        self.estadisticas.quitar(*self._valores_estadisticos(i))
+        clave_anterior = normalizar_id(self._datos['id_pallet'][i])
+        for nombre, valor in cambios.items():
+            if nombre in self._datos:
+                self._asignar(nombre, i, valor)
+        self.estadisticas.agregar(*self._valores_estadisticos(i))
+        self._categorizar(i)
+        if self._indice_texto is not None and any(nombre in self.COLUMNAS_BUSQUEDA for nombre in cambios):
+            self._indice_texto.actualizar(int(self._claves[i]), self._valores_texto(i))
+
+        clave = normalizar_id(self._datos['id_pallet'][i])
+        if clave != clave_anterior:
+            if self._cobertura is not None:
+                self._cobertura.desmarcar([clave_anterior])
+                self._cobertura.marcar([clave])
+            self._por_id[clave_anterior].remove(i)
+            if not self._por_id[clave_anterior]:
+                del self._por_id[clave_anterior]
+            bisect.insort(self._por_id.setdefault(clave, []), i)
+
+    def eliminar_donde(self, mascara):
+        """Elimina los registros marcados en `mascara` (O(n), para ediciones puntuales)"""
+        mascara = np.asarray(mascara, dtype=bool)
+        self._registrar('eliminar', {'posiciones': np.flatnonzero(mascara).tolist()})
+        self._eliminar_donde(mascara)
+
+    def _eliminar_donde(self, mascara):
+        self.version += 1
+        self.estadisticas.quitar(*self._valores_estadisticos(np.flatnonzero(mascara)))
+        self._por_categoria -= np.bincount(
+            self._categorias[:self._n][mascara], minlength=len(CATEGORIAS_CONCILIACION)
+        )
+        if self._cobertura is not None:
+            self._cobertura.desmarcar(self._datos['id_pallet'][:self._n][mascara])
+        if self._indice_texto is not None:
+            for clave in self._claves[:self._n][mascara].tolist():
+                self._indice_texto.quitar(clave)
+        conservar = ~mascara
+        restantes = int(conservar.sum())
+        for nombre, datos in self._datos.items():
+            datos[:restantes] = datos[:self._n][conservar]
+            datos[restantes:self._n] = _nulo(self.columnas[nombre])
+        self._claves[:restantes] = self._claves[:self._n][conservar]
+        self._categorias[:restantes] = self._categorias[:self._n][conservar]
+        self._n = restantes
+        self._reindexar()
+
+    def eliminar(self, i):
+        """Elimina el registro en la posición `i`"""
+        mascara = np.zeros(self._n, dtype=bool)
+        mascara[self._posicion(i)] = True
+        self.eliminar_donde(mascara)
+
+    def limpiar(self):
+        """Vacía el conteo y libera la memoria reservada"""
+        self._registrar('limpiar', {})
+        self._limpiar()
+
+    def _limpiar(self):
+        self.version += 1
+        self.estadisticas.reiniciar()
+        self._por_categoria[:] = 0
+        self._por_id = {}
+        self._indice_texto = None
+        if self._cobertura is not None:
+            self._cobertura.reiniciar()
+        self._n = 0
+        self._datos = {}
+        self._reservar(self.CAPACIDAD_INICIAL)
+
+    def _posicion(self, i):
+        i = int(i)
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(f"Registro {i} fuera de rango")
+        return i
+
+    def columna(self, nombre):
+        """Vista (sin copia) de una columna con los registros actuales"""
+        return self._datos[nombre][:self._n]
+
+    def registro(self, i):
+        """Registro como diccionario con valores Python nativos"""
+        i = self._posicion(i)
+        resultado = {}
+        for nombre, tipo in self.columnas.items():
+            valor = self._datos[nombre][i]
+            if tipo == ENTERO_NULO:
+                valor = None if np.isnan(valor) else int(valor)
+            elif isinstance(valor, np.datetime64):
+                valor = None if np.isnat(valor) else pd.Timestamp(valor).to_pydatetime()
+            elif isinstance(valor, np.generic):
+                valor = valor.item()
+            resultado[nombre] = valor
+        return resultado
+
+    def filtrar(self, texto):
+        """Posiciones (en orden) de los registros con `texto` en algún campo de búsqueda
+
+        Usa el índice de trigramas, sin distinguir mayúsculas.
+        """
+        texto = str(texto or '').strip()
+        if not texto:
+            return np.arange(self._n)
+        if self._indice_texto is None:
+            self._indice_texto = IndiceTrigramas.construir(
+                self._claves[:self._n],
+                [self.columna(nombre) for nombre in self.COLUMNAS_BUSQUEDA if nombre in self._datos]
+            )
+        claves = np.sort(np.asarray(self._indice_texto.buscar(texto), dtype=np.int64))
+        return np.searchsorted(self._claves[:self._n], claves)
+
+    def ordenar(self, posiciones, nombre, descendente=False):
+        """Las posiciones ordenadas por una columna (estable, nulos al final)"""
+        if nombre not in self._datos:
+            raise KeyError(f"Columna desconocida: {nombre}")
+        valores = pd.Series(self._datos[nombre][posiciones])
+        orden = valores.sort_values(ascending=not descendente, kind='stable', na_position='last').index
+        return np.asarray(posiciones)[orden.to_numpy()]
+
+    def totales_categoria(self):
+        """Cantidad de registros por categoría de conciliación (O(1))"""
+        return dict(zip(CATEGORIAS_CONCILIACION, self._por_categoria.tolist()))
+
+    def posiciones_categoria(self, categoria):
+        """Posiciones (en orden) de los registros de una categoría de conciliación"""
+        codigo = CATEGORIAS_CONCILIACION.index(categoria)
+        if not self._por_categoria[codigo]:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self._categorias[:self._n] == codigo)
+
+    def vista_categoria(self, categoria, columnas=None):
+        """DataFrame (copia) con los registros de una categoría, en orden y con las columnas pedidas"""
+        posiciones = self.posiciones_categoria(categoria)
+        return pd.DataFrame({nombre: self.columna(nombre)[posiciones] for nombre in (columnas or self.columnas)})
+
+    def cobertura_de(self, indice):
+        """Cobertura del inventario `indice` por este conteo (None sin inventario)
+
+        La primera vez (o al cambiar el inventario) marca todos los IDs del conteo
+        de una pasada; desde ahí cada alta, edición y baja la mantiene.
+        """
+        if indice is None:
+            return None
+        if self._cobertura is None or self._cobertura.indice is not indice:
+            self._cobertura = CoberturaInventario(indice, self.columna('id_pallet'))
+        return self._cobertura
+
+    def registros(self):
+        """Lista de diccionarios (para respuestas JSON)"""
+        return list(self)
+
+    def exportar(self, formato, filas_por_tanda=FILAS_POR_TANDA_EXPORTACION):
+        """Generador de trozos de bytes con el conteo en CSV, JSON Lines o Parquet
+
+        Toma vistas de las columnas al llamarlo: lo que se agregue mientras se
+        consume el generador no entra.
+        """
+        columnas = {nombre: self.columna(nombre) for nombre in self.columnas}
+        return exportar_columnas(columnas, self.columnas, formato, filas_por_tanda)
+
+    def a_dataframe(self):
+        """DataFrame que referencia los arreglos del conteo sin copiarlos
+
+        Es una vista de solo lectura para cálculos y reportes: tomarla de nuevo
+        después de agregar o editar registros.
+        """
+        return pd.DataFrame({
+            nombre: pd.Series(self.columna(nombre), dtype=self.columna(nombre).dtype, copy=False)
+            for nombre in self.columnas
+        }, copy=False)
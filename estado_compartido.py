@@ -0,0 +1,184 @@
+"""Estado compartido y durable sobre SQLite
+
+Guarda los eventos del conteo (altas, limpiezas, ediciones, recálculos) en una
+bitácora con secuencia creciente. Es un write-ahead log: el evento queda en
+disco antes de aplicarse en memoria, y al arrancar se reproduce para
+reconstruir el conteo. Cada worker aplica los eventos nuevos sobre su copia en
+memoria, así todos ven el mismo conteo en el mismo orden. Los eventos llevan un
+`canal` para separar, por ejemplo, las sesiones de Streamlit.
+
+Las escrituras se confirman en grupo: un hilo escritor junta los eventos que
+llegan mientras se hace el fsync anterior y los confirma en una sola
+transacción, así la latencia se mantiene baja con cientos de escaneos por
+segundo. También guarda el estado de los jobs de carga para que cualquier
+worker pueda responder por ellos.
+"""
+import json
+import os
+import sqlite3
+import threading
+
+
+class _Pendiente:
+    """Evento en espera de ser confirmado por el hilo escritor"""
+
+    __slots__ = ('tipo', 'datos', 'canal', 'listo', 'seq', 'error')
+
+    def __init__(self, tipo, datos, canal):
+        self.tipo = tipo
+        self.datos = datos
+        self.canal = canal
+        self.listo = threading.Event()
+        self.seq = None
+        self.error = None
+
+
+class EstadoCompartido:
+    """Bitácora de eventos del conteo y jobs de carga, durable y multi-proceso"""
+
+    MAX_LOTE = 500
+    # Eventos que una limpieza deja obsoletos; los de configuración (política) se conservan
+    EVENTOS_CONTEO = ('alta', 'actualizar', 'eliminar', 'sistema', 'limpiar')
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._conexion = None
+        self._lock = threading.Lock()
+        self._cola = []
+        self._hay_cola = threading.Condition(threading.Lock())
+        self._escritor = None
+
+    def _abrir(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.ruta)), exist_ok=True)
+        conexion = sqlite3.connect(self.ruta, timeout=30, check_same_thread=False, isolation_level=None)
+        conexion.execute('PRAGMA journal_mode=WAL')
+        conexion.execute('PRAGMA synchronous=FULL')
+        return conexion
+
+    def _conectar(self):
+        # Conexión perezosa: cada proceso worker abre la suya después del fork
+        if self._conexion is None:
+            conexion = self._abrir()
+            conexion.execute(
+                'CREATE TABLE IF NOT EXISTS eventos ('
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, tipo TEXT NOT NULL, datos TEXT NOT NULL, canal TEXT NOT NULL DEFAULT '')"
+            )
+            columnas = [fila[1] for fila in conexion.execute('PRAGMA table_info(eventos)')]
+            if 'canal' not in columnas:
+                conexion.execute("ALTER TABLE eventos ADD COLUMN canal TEXT NOT NULL DEFAULT ''")
+            conexion.execute('CREATE INDEX IF NOT EXISTS eventos_canal ON eventos (canal, seq)')
+            conexion.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'orden INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE NOT NULL, datos TEXT NOT NULL)'
+            )
+            self._conexion = conexion
+        return self._conexion
+
+    def registrar(self, tipo, datos, canal=''):
+        """Agrega un evento a la bitácora, espera a que esté en disco y devuelve su secuencia"""
+        pendiente = _Pendiente(tipo, json.dumps(datos, default=str), canal)
+        with self._hay_cola:
+            if self._escritor is None or not self._escritor.is_alive():
+                with self._lock:
+                    self._conectar()
+                self._escritor = threading.Thread(target=self._escribir, name='bitacora-conteo', daemon=True)
+                self._escritor.start()
+            self._cola.append(pendiente)
+            self._hay_cola.notify()
+
+        pendiente.listo.wait()
+        if pendiente.error is not None:
+            raise pendiente.error
+        return pendiente.seq
+
+    def _escribir(self):
+        """Hilo escritor: confirma en una transacción todo lo que se acumuló en la cola"""
+        conexion = self._abrir()
+        while True:
+            with self._hay_cola:
+                while not self._cola:
+                    self._hay_cola.wait()
+                lote, self._cola = self._cola[:self.MAX_LOTE], self._cola[self.MAX_LOTE:]
+
+            try:
+                conexion.execute('BEGIN IMMEDIATE')
+                for pendiente in lote:
+                    pendiente.seq = self._insertar(conexion, pendiente.tipo, pendiente.datos, pendiente.canal)
+                conexion.execute('COMMIT')
+            except Exception as e:
+                if conexion.in_transaction:
+                    conexion.execute('ROLLBACK')
+                for pendiente in lote:
+                    pendiente.error = e
+
+            for pendiente in lote:
+                pendiente.listo.set()
+
+    def _insertar(self, conexion, tipo, datos, canal):
+        seq = conexion.execute(
+            'INSERT INTO eventos (tipo, datos, canal) VALUES (?, ?, ?)', (tipo, datos, canal)
+        ).lastrowid
+        if tipo == 'limpiar':
+            # Lo anterior a una limpieza ya no hace falta para reconstruir el canal
+            conexion.execute(
+                'DELETE FROM eventos WHERE canal = ? AND seq < ? AND tipo IN (%s)'
+                % ', '.join('?' * len(self.EVENTOS_CONTEO)),
+                (canal, seq, *self.EVENTOS_CONTEO)
+            )
+        return seq
+
+    def registrar_lote(self, eventos, canal=''):
+        """Registra [(tipo, datos)] en una sola transacción (todos o ninguno) y devuelve sus secuencias"""
+        filas = [(tipo, json.dumps(datos, default=str)) for tipo, datos in eventos]
+        with self._lock:
+            conexion = self._conectar()
+            conexion.execute('BEGIN IMMEDIATE')
+            try:
+                seqs = [self._insertar(conexion, tipo, datos, canal) for tipo, datos in filas]
+                conexion.execute('COMMIT')
+            except Exception:
+                conexion.execute('ROLLBACK')
+                raise
+        return seqs
+
+    def eventos_desde(self, seq, canal=''):
+        """Eventos del canal con secuencia mayor a `seq`, en orden: [(seq, tipo, datos)]"""
+        with self._lock:
+            filas = self._conectar().execute(
+                'SELECT seq, tipo, datos FROM eventos WHERE canal = ? AND seq > ? ORDER BY seq', (canal, seq)
+            ).fetchall()
+        return [(s, tipo, json.loads(datos)) for s, tipo, datos in filas]
+
+    def ids_registrados(self, canal=''):
+        """IDs de pallet (sin normalizar) de las altas y ediciones del canal, sin reproducir la bitácora"""
+        with self._lock:
+            filas = self._conectar().execute(
+                "SELECT DISTINCT coalesce(json_extract(datos, '$.id_pallet'), json_extract(datos, '$.cambios.id_pallet')) "
+                "FROM eventos WHERE canal = ? AND tipo IN ('alta', 'actualizar')", (canal,)
+            ).fetchall()
+        return [id_pallet for id_pallet, in filas if id_pallet is not None]
+
+    def canales(self):
+        """Canales con eventos registrados"""
+        with self._lock:
+            filas = self._conectar().execute('SELECT DISTINCT canal FROM eventos').fetchall()
+        return [canal for canal, in filas]
+
+    def guardar_job(self, job, maximo=None):
+        """Inserta o actualiza el estado de un job; conserva solo los `maximo` más recientes"""
+        with self._lock:
+            conexion = self._conectar()
+            conexion.execute(
+                'INSERT INTO jobs (id, datos) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET datos = excluded.datos',
+                (job['id'], json.dumps(job, default=str))
+            )
+            if maximo:
+                conexion.execute(
+                    'DELETE FROM jobs WHERE orden <= (SELECT MAX(orden) FROM jobs) - ?', (maximo,)
+                )
+
+    def obtener_job(self, job_id):
+        """Estado de un job registrado por cualquier worker, o None"""
+        with self._lock:
+            fila = self._conectar().execute('SELECT datos FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(fila[0]) if fila else None
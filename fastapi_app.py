@@ -1,10 +1,20 @@
 from fastapi import FastAPI, Request, Form, UploadFile, File
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import pandas as pd
+from starlette.concurrency import run_in_threadpool
+import numpy as np
+import asyncio
 import json
-import io
+import itertools
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import plotly.express as px
 import plotly.graph_objects as go
@@ -12,53 +22,80 @@ from plotly.utils import PlotlyJSONEncoder
 import plotly
 import uvicorn
 
+from inventario_core import (
+    CACHE_INVENTARIOS, COLUMNAS_REQUERIDAS, CacheInventarios, IndiceInventario, aplicar_delta, calcular_delta,
+    leer_inventario, normalizar_id, preparar_inventario
+)
+from estado_compartido import EstadoCompartido
+from conteo_columnar import COLUMNAS_CONTEO, FORMATOS_EXPORTACION, POLITICAS_DUPLICADO, ConteoColumnar
+from reportes import GestorReportes, escribir_datos_conteo, escribir_excel_conteo, guardar_columnas
+
 app = FastAPI(title="Visor de Inventario Pro - FastAPI")
+logger = logging.getLogger(__name__)
 
 # Configurar templates y archivos estáticos
 templates = Jinja2Templates(directory="templates")
 
-# Variables globales para el estado de la aplicación
+# Variables globales para el estado de la aplicación; el conteo vive en cada sesión
 app_state = {
-    'inventario_sistema': None,
-    'conteo_fisico': [],
-    'session_stats': {
-        'start_time': datetime.now(),
-        'total_processed': 0
-    }
+    'indice_inventario': None,
+    'version_inventario': 0,
+    'marca_snapshot': None
 }
+MAX_RESULTADOS = 10000
+MAX_PALLETS_LOTE = 5000
+# Cada cuánto el canal de eventos revisa la bitácora, y cada cuánto manda un latido
+INTERVALO_EVENTOS = 0.5
+LATIDO_EVENTOS = 15
+MAX_FILAS_PAGINA = 500
+MEDIA_TYPE_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Las cargas de inventario se procesan en hilos para no bloquear el event loop
+executor_cargas = ThreadPoolExecutor(max_workers=2, thread_name_prefix='carga-inventario')
+lock_cargas = threading.Lock()
+lock_snapshot = threading.Lock()
+lock_delta = threading.Lock()
+contador_versiones = itertools.count(1)
+MAX_JOBS = 50
+
+# Snapshot del inventario en el volumen ./data para arranques en caliente
+DATA_DIR = os.environ.get('INVENTARIO_DATA_DIR', 'data')
+SNAPSHOT_DIR = os.path.join(DATA_DIR, 'inventario_snapshot')
+
+# Conteo y jobs compartidos entre workers (uvicorn --workers N) a través de SQLite.
+# La bitácora del conteo es un write-ahead log: al arrancar se reproduce completa
+ESTADO = EstadoCompartido(os.path.join(DATA_DIR, 'estado.db'))
+
+# Reportes generados en un pool de procesos y guardados por sesión + versión del conteo:
+# sin escaneos nuevos, una segunda descarga sirve el mismo archivo
+REPORTES = GestorReportes(os.path.join(DATA_DIR, 'reportes'), int(os.environ.get('REPORTES_PROCESOS', '2')))
+FORMATOS_REPORTE = [*FORMATOS_EXPORTACION, 'xlsx']
+PATRON_REPORTE = re.compile(r'[A-Za-z0-9_-]+-\d+-[0-9a-f]+\.(%s)' % '|'.join(FORMATOS_REPORTE))
+
+# Sesiones de conteo con nombre (?sesion=pasillo-3, se recuerda en una cookie): cada una
+# tiene su conteo, estadísticas y lock, y todas consultan el mismo inventario. Una sesión
+# sin uso por SESION_TTL segundos se saca de memoria; su canal en la bitácora queda en
+# disco y se reproduce la próxima vez que alguien la abra
+SESION_PRINCIPAL = 'principal'
+SESION_TTL = int(os.environ.get('SESION_TTL_SEGUNDOS', '1800'))
+COOKIE_SESION = 'sesion_conteo'
+PATRON_SESION = re.compile(r'[A-Za-z0-9_-]{1,64}')
+SESIONES = {}
+lock_sesiones = threading.Lock()
 
 class InventarioManager:
     """Clase para manejar la lógica del inventario"""
     
     @staticmethod
-    def cargar_inventario(archivo_bytes):
-        """Carga y procesa el archivo de inventario"""
+    def cargar_inventario(archivo_bytes, nombre=None, progreso=None):
+        """Carga y procesa el archivo de inventario (XLSX, CSV o Parquet)"""
         try:
-            df = pd.read_excel(io.BytesIO(archivo_bytes), dtype=str, engine='openpyxl')
-            
-            # Limpiar y normalizar
-            df = df.dropna(how='all')
-            df.columns = [str(c).strip() for c in df.columns]
-            
-            # Validar columnas requeridas
-            required_cols = ['Id de pallet', 'Inventario físico']
-            if not all(col in df.columns for col in required_cols):
-                return None, f"Faltan columnas requeridas: {required_cols}"
-            
-            # Crear columnas opcionales
-            optional_cols = {
-                'Almacén': 'Almacén General',
-                'Código de artículo': 'N/A',
-                'Nombre del producto': 'Producto sin nombre'
-            }
+            df = leer_inventario(archivo_bytes, nombre, progreso)
             
-            for col, default_val in optional_cols.items():
-                if col not in df.columns:
-                    df[col] = default_val
-            
-            # Procesar datos
-            df['Inventario físico'] = pd.to_numeric(df['Inventario físico'], errors='coerce').fillna(0).astype(int)
-            df['Id de pallet'] = df['Id de pallet'].astype(str).str.strip()
+            # Limpiar, normalizar y validar columnas requeridas
+            df, faltantes, _ = preparar_inventario(df)
+            if faltantes:
+                return None, f"Faltan columnas requeridas: {COLUMNAS_REQUERIDAS}"
             
             return df, "Archivo cargado exitosamente"
             
@@ -66,26 +103,90 @@ class InventarioManager:
             return None, f"Error al cargar archivo: {str(e)}"
     
     @staticmethod
-    def buscar_pallet(id_pallet, df_inventario):
-        """Busca información del pallet en el inventario"""
-        if df_inventario is None or not id_pallet:
+    def buscar_pallet(id_pallet, indice_inventario):
+        """Busca información del pallet usando el índice del inventario"""
+        if indice_inventario is None or not id_pallet:
             return None
         
-        id_clean = str(id_pallet).strip().upper()
-        mask = df_inventario['Id de pallet'].astype(str).str.strip().str.upper() == id_clean
-        matches = df_inventario[mask]
-        
-        if not matches.empty:
-            match = matches.iloc[0]
+        info = indice_inventario.buscar(id_pallet)
+        if not info['found']:
+            info['suggestions'] = [
+                {'id_pallet': s['id_pallet'], 'almacen': s['almacen'], 'inv_sistema': s['inv_sistema']}
+                for s in indice_inventario.similares(id_pallet)
+            ]
+        return info
+    
+    @staticmethod
+    def campos_inventario(pallet_info):
+        """Campos del registro de conteo que salen solo del inventario (sin la diferencia)"""
+        if pallet_info and pallet_info['found']:
             return {
-                'found': True,
-                'almacen': str(match.get('Almacén', 'N/A')).strip(),
-                'codigo': str(match.get('Código de artículo', 'N/A')).strip(),
-                'nombre': str(match.get('Nombre del producto', 'N/A')).strip(),
-                'inv_sistema': int(float(match.get('Inventario físico', 0)))
+                'codigo_articulo': pallet_info['codigo'],
+                'nombre_producto': pallet_info['nombre'],
+                'almacen': pallet_info['almacen'],
+                'inv_sistema': pallet_info['inv_sistema'],
+                'found_in_system': True
             }
+        return {
+            'codigo_articulo': 'N/A',
+            'nombre_producto': 'N/A',
+            'almacen': 'N/A',
+            'inv_sistema': None,
+            'found_in_system': False
+        }
+    
+    @staticmethod
+    def datos_sistema(cantidad_contada, pallet_info):
+        """Campos del registro de conteo que dependen del inventario del sistema"""
+        campos = InventarioManager.campos_inventario(pallet_info)
+        inv_sistema = campos['inv_sistema']
+        campos['diferencia'] = cantidad_contada - (inv_sistema if inv_sistema is not None else 0)
+        return campos
+    
+    @staticmethod
+    def datos_sistema_lote(cantidades, ids, indice_inventario):
+        """Como datos_sistema para muchos pallets, conciliados en una pasada vectorizada"""
+        cantidades = np.asarray(cantidades, dtype=np.int64)
+        if indice_inventario is None:
+            posiciones = np.full(len(ids), -1, dtype=np.int64)
+        else:
+            posiciones = indice_inventario.posiciones_lote(ids)
+        encontrados = posiciones >= 0
+        pos = posiciones[encontrados]
+        
+        inv_sistema = np.zeros(len(ids), dtype=np.int64)
+        codigo = np.full(len(ids), 'N/A', dtype=object)
+        nombre = codigo.copy()
+        almacen = codigo.copy()
+        if len(pos):
+            inv_sistema[encontrados] = indice_inventario.inv_sistema[pos]
+            codigo[encontrados] = indice_inventario.codigo[pos]
+            nombre[encontrados] = indice_inventario.nombre[pos]
+            almacen[encontrados] = indice_inventario.almacen[pos]
+        diferencias = cantidades - inv_sistema
         
-        return {'found': False}
+        return [
+            {
+                'codigo_articulo': c, 'nombre_producto': n, 'almacen': a,
+                'inv_sistema': inv if encontrado else None,
+                'diferencia': dif, 'found_in_system': encontrado
+            }
+            for c, n, a, inv, dif, encontrado in zip(
+                codigo.tolist(), nombre.tolist(), almacen.tolist(),
+                inv_sistema.tolist(), diferencias.tolist(), encontrados.tolist()
+            )
+        ]
+    
+    @staticmethod
+    def estado_diferencia(encontrado, cantidad_contada, diferencia):
+        """Mensaje y tipo de estado para el resultado de un pallet contado"""
+        if not encontrado:
+            return f"❓ No encontrado - {cantidad_contada} unidades", "info"
+        if diferencia == 0:
+            return f"✅ Cantidad exacta ({cantidad_contada})", "success"
+        if diferencia > 0:
+            return f"🔼 Sobrante de {diferencia} unidades", "warning"
+        return f"🔽 Faltante de {abs(diferencia)} unidades", "error"
     
     @staticmethod
     def calcular_estadisticas(conteo_fisico):
@@ -96,24 +197,34 @@ class InventarioManager:
                 'faltantes': 0, 'no_encontrados': 0, 'precision': 0
             }
         
-        df = pd.DataFrame(conteo_fisico)
-        total = len(df)
-        exactos = len(df[df['diferencia'] == 0])
-        sobrantes = len(df[df['diferencia'] > 0])
-        faltantes = len(df[df['diferencia'] < 0])
-        no_encontrados = len(df[df['inv_sistema'].isna()])
-        precision = (exactos / total * 100) if total > 0 else 0
-        
+        # Acumulador mantenido por el conteo en cada alta/edición/baja: O(1)
+        acumulado = conteo_fisico.estadisticas
         return {
-            'total': total, 'exactos': exactos, 'sobrantes': sobrantes,
-            'faltantes': faltantes, 'no_encontrados': no_encontrados,
-            'precision': round(precision, 2)
+            'total': acumulado.total, 'exactos': acumulado.exactos, 'sobrantes': acumulado.sobrantes,
+            'faltantes': acumulado.faltantes, 'no_encontrados': acumulado.no_encontrados,
+            'precision': round(acumulado.precision, 2)
         }
 
+@app.on_event("startup")
+async def restaurar_inventario():
+    """Reabre el último inventario persistido (memory-map, sin re-parsear) y la sesión principal"""
+    try:
+        indice = inventario_actual()
+        if indice is not None:
+            logger.info("Inventario restaurado desde snapshot: %s pallets", f"{len(indice):,}")
+    except Exception:
+        logger.warning("No se pudo restaurar el snapshot del inventario", exc_info=True)
+    obtener_sesion(SESION_PRINCIPAL)
+
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """Página principal"""
-    stats = InventarioManager.calcular_estadisticas(app_state['conteo_fisico'])
+    try:
+        sesion = sesion_de(request)
+    except ValueError as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=400)
+    conteo = sesion.conteo
+    stats = InventarioManager.calcular_estadisticas(conteo)
     
     # Crear gráficos
     charts = {}
@@ -152,149 +263,871 @@ async def home(request: Request):
         fig_gauge.update_layout(height=400)
         charts['gauge'] = json.dumps(fig_gauge, cls=PlotlyJSONEncoder)
     
-    return templates.TemplateResponse("index.html", {
+    response = templates.TemplateResponse("index.html", {
         "request": request,
         "stats": stats,
         "charts": charts,
-        "conteo_data": app_state['conteo_fisico'],
-        "archivo_cargado": app_state['inventario_sistema'] is not None
+        "archivo_cargado": inventario_actual() is not None,
+        "politicas_duplicado": POLITICAS_DUPLICADO,
+        "politica_duplicados": sesion.politica_duplicados,
+        "sesion": sesion.nombre,
+        "seq": sesion.seq
     })
+    # Las peticiones siguientes del navegador (fetch) quedan en la misma sesión
+    response.set_cookie(COOKIE_SESION, sesion.nombre, samesite='lax')
+    return response
+
+def nuevo_job():
+    """Registra un job de carga y descarta los más antiguos"""
+    job = {
+        'id': uuid.uuid4().hex,
+        'status': 'pending',
+        'progress': 0.0,
+        'rows': 0,
+        'records': None,
+        'message': 'En cola',
+        'created': datetime.now().isoformat()
+    }
+    ESTADO.guardar_job(job, MAX_JOBS)
+    return job
+
+def actualizar_job(job, cambios):
+    """Actualiza el job y lo publica para que cualquier worker pueda informarlo"""
+    job.update(cambios)
+    ESTADO.guardar_job(job)
+
+def publicar_inventario(indice, version, preparar=None):
+    """Reemplaza el inventario activo de forma atómica; una carga vieja no pisa a una nueva
+    
+    `preparar`, si se pasa, corre bajo el mismo lock una vez aceptada la versión y
+    antes del reemplazo: quien lee el inventario nuevo ya ve el conteo ajustado.
+    """
+    with lock_cargas:
+        if version < app_state['version_inventario']:
+            return False
+        if preparar is not None:
+            preparar()
+        app_state.update({'indice_inventario': indice, 'version_inventario': version})
+        return True
+
+def guardar_snapshot(indice):
+    """Persiste el inventario publicado para recuperarlo al reiniciar y compartirlo con los demás workers"""
+    try:
+        with lock_snapshot:
+            if indice is app_state['indice_inventario']:
+                app_state['marca_snapshot'] = indice.guardar_snapshot(SNAPSHOT_DIR)
+    except Exception:
+        logger.warning("No se pudo guardar el snapshot del inventario", exc_info=True)
+
+def inventario_actual():
+    """Índice activo; si otro worker publicó un snapshot más nuevo se reabre por memory-map"""
+    marca = IndiceInventario.marca_snapshot(SNAPSHOT_DIR)
+    if marca is not None and marca != app_state['marca_snapshot']:
+        with lock_snapshot:
+            if marca != app_state['marca_snapshot']:
+                indice = IndiceInventario.desde_snapshot(SNAPSHOT_DIR)
+                if indice is not None:
+                    with lock_cargas:
+                        app_state['indice_inventario'] = indice
+                    app_state['marca_snapshot'] = indice.marca
+    return app_state['indice_inventario']
+
+class SesionConteo:
+    """Conteo de una sesión en memoria, al día con su canal de la bitácora compartida"""
+    
+    def __init__(self, nombre):
+        self.nombre = nombre
+        # La sesión principal usa el canal por defecto, donde estaba el conteo único
+        self.canal = '' if nombre == SESION_PRINCIPAL else f'sesion:{nombre}'
+        self.conteo = ConteoColumnar({**COLUMNAS_CONTEO, 'found_in_system': bool})
+        self.stats = {'start_time': datetime.now(), 'total_processed': 0}
+        self.politica_duplicados = 'ambos'
+        self.seq = 0
+        # Últimos eventos aplicados (seq -> (tipo, resultado)): el resultado de cada alta
+        # para el worker que la registró, y lo que cambió para el canal de eventos
+        self.cambios = {}
+        self.seq_descartado = 0
+        self.lock = threading.Lock()
+        self.ultimo_uso = time.monotonic()
+    
+    def registrar(self, tipo, datos):
+        """Registra un evento en el canal de la sesión y devuelve su secuencia"""
+        return ESTADO.registrar(tipo, datos, self.canal)
+    
+    def aplicar_evento(self, tipo, datos):
+        """Aplica un evento de la bitácora compartida sobre el conteo en memoria"""
+        if tipo == 'politica':
+            self.politica_duplicados = datos['politica']
+            return None
+        if tipo == 'sistema':
+            # El evento trae solo los campos del inventario por pallet: cada registro
+            # recalcula la diferencia con su propia cantidad (puede haber varios por pallet)
+            actualizadas = []
+            cantidades = self.conteo.columna('cantidad_contada')
+            for clave, campos in datos.items():
+                inv_sistema = campos.get('inv_sistema')
+                for i in self.conteo.posiciones_de(clave):
+                    diferencia = int(cantidades[i]) - (inv_sistema if inv_sistema is not None else 0)
+                    cambios = dict(campos, diferencia=diferencia)
+                    self.conteo.aplicar_evento('actualizar', {'posicion': i, 'cambios': cambios})
+                    actualizadas.append(i)
+            return actualizadas
+        
+        resultado = self.conteo.aplicar_evento(tipo, datos)
+        if tipo == 'alta':
+            self.stats['total_processed'] += 1
+        elif tipo == 'limpiar':
+            self.stats['total_processed'] = 0
+        return resultado
+    
+    def sincronizar(self):
+        """Pone al día el conteo con los eventos de la sesión registrados por cualquier worker"""
+        with self.lock:
+            for seq, tipo, datos in ESTADO.eventos_desde(self.seq, self.canal):
+                # La política de duplicados se resuelve al aplicar el evento; se guarda el
+                # resultado para que el worker que registró el alta pueda informarlo
+                self.cambios[seq] = (tipo, self.aplicar_evento(tipo, datos))
+                self.seq = seq
+                while len(self.cambios) > MAX_RESULTADOS:
+                    self.seq_descartado = next(iter(self.cambios))
+                    del self.cambios[self.seq_descartado]
+        return self.conteo
+    
+    def resultado_alta(self, seq):
+        """(accion, posicion) con que se aplicó el alta registrada con `seq`"""
+        _, resultado = self.cambios.get(seq, ('alta', None))
+        return resultado or ('agregado', None)
+    
+    def cambios_desde(self, seq):
+        """Lo que cambió después de `seq`, para la página: filas nuevas o modificadas y estadísticas
+        
+        None si no hay nada nuevo; {'recargar': True} si los cambios ya no se conservan.
+        Recorre solo los eventos posteriores a `seq`, no el conteo completo.
+        """
+        with self.lock:
+            if seq >= self.seq:
+                return None
+            if seq < self.seq_descartado:
+                return {'seq': self.seq, 'recargar': True}
+            
+            nuevos = []
+            for s, cambio in reversed(self.cambios.items()):
+                if s <= seq:
+                    break
+                nuevos.append(cambio)
+            
+            filas = {}
+            limpiar = False
+            for tipo, resultado in reversed(nuevos):
+                if tipo == 'alta' and resultado[0] != 'rechazado':
+                    filas[resultado[1]] = None
+                elif tipo == 'sistema':
+                    filas.update(dict.fromkeys(resultado))
+                elif tipo == 'limpiar':
+                    filas, limpiar = {}, True
+                elif tipo in ('actualizar', 'eliminar'):
+                    # Las posiciones pueden haberse corrido: más simple redibujar
+                    return {'seq': self.seq, 'recargar': True}
+            
+            return {
+                'seq': self.seq,
+                'limpiar': limpiar,
+                'filas': [dict(self.conteo[posicion], posicion=posicion) for posicion in sorted(filas)],
+                'stats': InventarioManager.calcular_estadisticas(self.conteo),
+                'politica': self.politica_duplicados
+            }
+
+def obtener_sesion(nombre):
+    """Sesión activa con ese nombre (se crea o reconstruye si hace falta); expulsa las inactivas"""
+    if not PATRON_SESION.fullmatch(nombre or ''):
+        raise ValueError("Nombre de sesión no válido: use letras, números, guion o guion bajo")
+    
+    ahora = time.monotonic()
+    with lock_sesiones:
+        for clave, sesion in list(SESIONES.items()):
+            if clave != nombre and ahora - sesion.ultimo_uso > SESION_TTL:
+                del SESIONES[clave]
+        sesion = SESIONES.get(nombre)
+        if sesion is None:
+            sesion = SESIONES[nombre] = SesionConteo(nombre)
+        sesion.ultimo_uso = ahora
+    sesion.sincronizar()
+    return sesion
+
+def sesion_de(request):
+    """Sesión pedida por ?sesion= o recordada en la cookie; la principal si no hay ninguna"""
+    nombre = request.query_params.get('sesion') or request.cookies.get(COOKIE_SESION) or SESION_PRINCIPAL
+    return obtener_sesion(nombre.strip())
+
+def sesiones_registradas():
+    """Nombres de todas las sesiones con eventos en la bitácora, estén o no en memoria"""
+    return sorted(
+        SESION_PRINCIPAL if canal == '' else canal[len('sesion:'):]
+        for canal in ESTADO.canales() if canal == '' or canal.startswith('sesion:')
+    )
+
+def recalcular_conteo(indice, ids_afectados):
+    """Actualiza en todas las sesiones solo los registros cuyos pallets cambiaron en el inventario"""
+    actualizados = 0
+    for nombre in sesiones_registradas():
+        sesion = SESIONES.get(nombre)
+        if sesion is None:
+            # Sesión expulsada: se reconstruye aparte (sin volver a dejarla en memoria)
+            # solo si su bitácora tiene algún pallet afectado
+            sesion = SesionConteo(nombre)
+            if ids_afectados.isdisjoint(normalizar_id(i) for i in ESTADO.ids_registrados(sesion.canal)):
+                continue
+        conteo = sesion.sincronizar()
+        # Bajo el lock de la sesión: un alta concurrente no cambia los IDs mientras se recorren.
+        # Se recorre el lado más chico: IDs cambiados o IDs contados
+        with sesion.lock:
+            contados = conteo.ids_contados()
+            if len(ids_afectados) <= len(contados):
+                claves = [clave for clave in ids_afectados if clave in contados]
+            else:
+                claves = [clave for clave in contados if clave in ids_afectados]
+            actualizados += sum(len(conteo.posiciones_de(clave)) for clave in claves)
+        cambios = {clave: InventarioManager.campos_inventario(indice.buscar(clave)) for clave in claves}
+        if cambios:
+            sesion.registrar('sistema', cambios)
+            sesion.sincronizar()
+    return actualizados
+
+def aplicar_carga_delta(job, df, version):
+    """Aplica el archivo como delta sobre el inventario activo y ajusta el conteo afectado"""
+    with lock_delta:
+        base = inventario_actual()
+        actualizar_job(job, {'progress': 0.9, 'message': 'Calculando cambios'})
+        cambios = calcular_delta(base, df)
+        indice = aplicar_delta(base, df, cambios)
+        
+        afectados = set(cambios['insertados']) | set(cambios['actualizados']) | set(cambios['eliminados'])
+        resumen = {
+            'insertados': len(cambios['insertados']),
+            'actualizados': len(cambios['actualizados']),
+            'eliminados': len(cambios['eliminados']),
+            'conteos_recalculados': 0
+        }
+        
+        def recalcular():
+            # El conteo se ajusta antes de publicar: nadie ve el inventario nuevo con diferencias viejas
+            if afectados:
+                resumen['conteos_recalculados'] = recalcular_conteo(indice, afectados)
+        
+        if not publicar_inventario(indice, version, recalcular):
+            return "Carga descartada: ya hay un inventario más reciente", None
+    guardar_snapshot(indice)
+    return "Delta aplicado exitosamente", resumen
+
+def procesar_carga(job, contents, nombre, huella, version, delta=False):
+    """Trabajo en segundo plano: parsea, indexa y publica el inventario"""
+    def progreso(leidas, total):
+        actualizar_job(job, {
+            'rows': leidas,
+            'progress': round(0.9 * min(leidas / total, 1.0), 3) if total else 0.0
+        })
+    
+    try:
+        actualizar_job(job, {'status': 'running', 'message': 'Leyendo archivo'})
+        en_cache = CACHE_INVENTARIOS.obtener(huella) if delta else None
+        if en_cache is not None:
+            df, message = en_cache[0], "Archivo cargado desde caché"
+        else:
+            df, message = InventarioManager.cargar_inventario(contents, nombre, progreso)
+        if df is None:
+            actualizar_job(job, {'status': 'error', 'message': message})
+            return
+        
+        if delta:
+            message, resumen = aplicar_carga_delta(job, df, version)
+            actualizar_job(job, {'status': 'done', 'progress': 1.0, 'message': message,
+                                 'records': len(inventario_actual()), 'delta': resumen})
+            return
+        
+        actualizar_job(job, {'progress': 0.9, 'message': 'Construyendo índice'})
+        indice = IndiceInventario(df)
+        CACHE_INVENTARIOS.guardar(huella, df, indice)
+        
+        if publicar_inventario(indice, version):
+            guardar_snapshot(indice)
+        else:
+            message = "Carga descartada: ya hay un inventario más reciente"
+        actualizar_job(job, {'status': 'done', 'progress': 1.0, 'message': message, 'records': len(indice)})
+        
+    except Exception as e:
+        actualizar_job(job, {'status': 'error', 'message': f"Error procesando archivo: {str(e)}"})
 
 @app.post("/upload_inventory")
-async def upload_inventory(file: UploadFile = File(...)):
-    """Endpoint para cargar archivo de inventario"""
+async def upload_inventory(file: UploadFile = File(...), delta: bool = Form(False)):
+    """Endpoint para cargar archivo de inventario; el procesamiento corre en segundo plano
+    
+    Con delta=true el archivo se compara contra el inventario activo y solo se
+    aplican las altas, cambios y bajas, conservando el conteo en curso.
+    """
     try:
         contents = await file.read()
-        df, message = InventarioManager.cargar_inventario(contents)
+        job = nuevo_job()
+        version = next(contador_versiones)
+        huella = CacheInventarios.huella(contents)
         
-        if df is not None:
-            app_state['inventario_sistema'] = df
-            return {"success": True, "message": message, "records": len(df)}
-        else:
-            return {"success": False, "message": message}
+        if delta and inventario_actual() is not None:
+            executor_cargas.submit(procesar_carga, job, contents, file.filename, huella, version, True)
+            return {"success": True, "job_id": job['id'], "status": job['status'],
+                    "message": "Archivo recibido, aplicando delta en segundo plano", "cached": False}
+        
+        # Un archivo idéntico ya procesado se sirve desde la caché
+        en_cache = CACHE_INVENTARIOS.obtener(huella)
+        if en_cache is not None:
+            _, indice = en_cache
+            publicar_inventario(indice, version)
+            executor_cargas.submit(guardar_snapshot, indice)
+            actualizar_job(job, {'status': 'done', 'progress': 1.0, 'message': "Archivo cargado desde caché", 'records': len(indice)})
+            return {"success": True, "job_id": job['id'], "status": "done",
+                    "message": job['message'], "records": len(indice), "cached": True}
+        
+        executor_cargas.submit(procesar_carga, job, contents, file.filename, huella, version)
+        return {"success": True, "job_id": job['id'], "status": job['status'],
+                "message": "Archivo recibido, procesando en segundo plano", "cached": False}
             
     except Exception as e:
         return {"success": False, "message": f"Error procesando archivo: {str(e)}"}
 
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Consultar el progreso de una carga en segundo plano"""
+    job = ESTADO.obtener_job(job_id)
+    if job is None:
+        return JSONResponse({"success": False, "message": "Job no encontrado"}, status_code=404)
+    return job
+
 @app.post("/search_pallet")
 async def search_pallet(id_pallet: str = Form(...)):
     """Buscar información de un pallet"""
-    info = InventarioManager.buscar_pallet(id_pallet, app_state['inventario_sistema'])
+    info = InventarioManager.buscar_pallet(id_pallet, inventario_actual())
     return JSONResponse(info if info else {"found": False})
 
+@app.post("/search_pallets")
+async def search_pallets(request: Request):
+    """Buscar muchos pallets en una sola petición (arreglo JSON o un ID por línea)"""
+    indice = inventario_actual()
+    if indice is None:
+        return {"success": False, "message": "No hay inventario cargado"}
+    
+    try:
+        body = await request.body()
+        if 'json' in request.headers.get('content-type', ''):
+            payload = json.loads(body)
+            ids = payload.get('ids', []) if isinstance(payload, dict) else payload
+        else:
+            ids = body.decode('utf-8').splitlines()
+        
+        ids = [i for i in ids if str(i).strip()]
+        results = indice.buscar_lote(ids)
+        found = sum(1 for r in results if r['found'])
+        
+        return {
+            "success": True,
+            "total": len(results),
+            "found": found,
+            "not_found": len(results) - found,
+            "results": results
+        }
+        
+    except Exception as e:
+        return {"success": False, "message": f"Error procesando lote: {str(e)}"}
+
+@app.get("/suggest_pallet")
+async def suggest_pallet(prefix: str = "", limit: int = 10):
+    """Sugerir pallets cuyo ID empieza con el prefijo digitado"""
+    indice = inventario_actual()
+    if indice is None:
+        return {"suggestions": []}
+    
+    limit = max(1, min(limit, 50))
+    return {"suggestions": indice.sugerir(prefix, limit)}
+
 @app.post("/add_pallet")
 async def add_pallet(
+    request: Request,
     numero_tablilla: str = Form(...),
     id_pallet: str = Form(...),
-    cantidad_contada: int = Form(...)
+    cantidad_contada: int = Form(...),
+    politica_duplicados: str = Form(None)
 ):
-    """Agregar pallet al conteo"""
+    """Agregar pallet al conteo
+    
+    Si el pallet ya fue contado se aplica `politica_duplicados` (o la política
+    vigente de la sesión): ambos, rechazar, reemplazar o sumar.
+    """
     try:
-        # Buscar información del pallet
-        pallet_info = InventarioManager.buscar_pallet(id_pallet, app_state['inventario_sistema'])
+        sesion = sesion_de(request)
+        politica = politica_duplicados or sesion.politica_duplicados
+        if politica not in POLITICAS_DUPLICADO:
+            return {"success": False, "message": f"Política de duplicados no válida: {politica}"}
         
-        if pallet_info and pallet_info['found']:
-            diferencia = cantidad_contada - pallet_info['inv_sistema']
-            inv_sistema = pallet_info['inv_sistema']
-            almacen = pallet_info['almacen']
-            codigo = pallet_info['codigo']
-            nombre = pallet_info['nombre']
-        else:
-            diferencia = cantidad_contada
-            inv_sistema = None
-            almacen = 'N/A'
-            codigo = 'N/A'
-            nombre = 'N/A'
+        # Buscar información del pallet
+        pallet_info = InventarioManager.buscar_pallet(id_pallet, inventario_actual())
+        datos = InventarioManager.datos_sistema(cantidad_contada, pallet_info)
+        diferencia = datos['diferencia']
         
         # Crear nuevo registro
         nuevo_item = {
             'numero_tablilla': numero_tablilla,
             'id_pallet': str(id_pallet).strip(),
-            'codigo_articulo': codigo,
-            'nombre_producto': nombre,
-            'almacen': almacen,
+            'codigo_articulo': datos['codigo_articulo'],
+            'nombre_producto': datos['nombre_producto'],
+            'almacen': datos['almacen'],
             'cantidad_contada': cantidad_contada,
-            'inv_sistema': inv_sistema,
+            'inv_sistema': datos['inv_sistema'],
             'diferencia': diferencia,
             'timestamp': datetime.now().isoformat(),
-            'found_in_system': pallet_info['found'] if pallet_info else False
+            'found_in_system': datos['found_in_system']
         }
         
-        # Agregar al conteo
-        app_state['conteo_fisico'].append(nuevo_item)
-        app_state['session_stats']['total_processed'] += 1
+        # Agregar al conteo de la sesión y traer lo que hayan registrado otros workers
+        # El fsync del grupo se espera fuera del event loop para que otras altas entren al mismo lote
+        seq = await run_in_threadpool(sesion.registrar, 'alta', dict(nuevo_item, politica=politica))
+        conteo = sesion.sincronizar()
+        accion, posicion = sesion.resultado_alta(seq)
+        
+        if accion == 'rechazado':
+            return {
+                "success": False,
+                "message": f"⚠️ {id_pallet}: ya fue contado, duplicado rechazado",
+                "status_type": "warning",
+                "stats": InventarioManager.calcular_estadisticas(conteo)
+            }
+        if accion == 'sumado':
+            cantidad_contada = conteo[posicion]['cantidad_contada']
+            diferencia = conteo[posicion]['diferencia']
         
         # Determinar mensaje de estado
-        if pallet_info and pallet_info['found']:
-            if diferencia == 0:
-                status_msg = f"✅ Cantidad exacta ({cantidad_contada})"
-                status_type = "success"
-            elif diferencia > 0:
-                status_msg = f"🔼 Sobrante de {diferencia} unidades"
-                status_type = "warning"
-            else:
-                status_msg = f"🔽 Faltante de {abs(diferencia)} unidades"
-                status_type = "error"
-        else:
-            status_msg = f"❓ No encontrado - {cantidad_contada} unidades"
-            status_type = "info"
+        status_msg, status_type = InventarioManager.estado_diferencia(
+            datos['found_in_system'], cantidad_contada, diferencia
+        )
+        if pallet_info and pallet_info.get('suggestions'):
+            status_msg += f" (¿Quisiste decir {pallet_info['suggestions'][0]['id_pallet']}?)"
+        
+        if accion == 'sumado':
+            status_msg = f"➕ Sumado al registro anterior, total {cantidad_contada} - {status_msg}"
+        elif accion == 'reemplazado':
+            status_msg = f"🔄 Reemplaza al registro anterior - {status_msg}"
         
         return {
             "success": True,
             "message": f"{id_pallet}: {status_msg}",
             "status_type": status_type,
-            "stats": InventarioManager.calcular_estadisticas(app_state['conteo_fisico'])
+            "action": accion,
+            "stats": InventarioManager.calcular_estadisticas(conteo)
         }
         
     except Exception as e:
         return {"success": False, "message": f"Error agregando pallet: {str(e)}"}
 
-@app.post("/clear_all")
-async def clear_all():
-    """Limpiar todos los datos"""
-    app_state['conteo_fisico'] = []
-    app_state['session_stats']['total_processed'] = 0
-    return {"success": True, "message": "Datos limpiados"}
+def cantidad_entera(valor):
+    """Cantidad contada como entero; ValueError si no lo es exactamente (2.7, 'abc', true)"""
+    if isinstance(valor, bool):
+        raise ValueError(f"cantidad_contada debe ser un número entero: {valor}")
+    if isinstance(valor, int):
+        return valor
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    if isinstance(valor, str) and re.fullmatch(r'\s*[+-]?\d+\s*', valor):
+        return int(valor)
+    raise ValueError(f"cantidad_contada debe ser un número entero: {valor}")
 
-@app.get("/export_excel")
-async def export_excel():
-    """Generar reporte Excel"""
-    if not app_state['conteo_fisico']:
-        return {"success": False, "message": "No hay datos para exportar"}
+@app.post("/add_pallets")
+async def add_pallets(request: Request):
+    """Agregar muchos pallets en una sola petición (escaneos acumulados sin conexión)
     
+    Recibe un arreglo JSON de {numero_tablilla, id_pallet, cantidad_contada}, o
+    {"items": [...], "politica_duplicados": ...}. Los pallets se concilian contra
+    el inventario en una pasada y se registran en una sola transacción, en el
+    orden recibido. Devuelve el estado de cada uno y las estadísticas actualizadas;
+    si algún pallet es inválido responde 422 indicando cuál y no registra ninguno.
+    """
     try:
-        df = pd.DataFrame(app_state['conteo_fisico'])
+        sesion = sesion_de(request)
+        payload = await request.json()
+        items = payload.get('items', []) if isinstance(payload, dict) else payload
+        politica = (payload.get('politica_duplicados') if isinstance(payload, dict) else None) \
+            or sesion.politica_duplicados
+        if politica not in POLITICAS_DUPLICADO:
+            return {"success": False, "message": f"Política de duplicados no válida: {politica}"}
+        if not isinstance(items, list):
+            return {"success": False, "message": "Se esperaba un arreglo de pallets"}
+        if len(items) > MAX_PALLETS_LOTE:
+            return {"success": False, "message": f"Máximo {MAX_PALLETS_LOTE} pallets por lote"}
         
-        # Crear archivo Excel en memoria
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            # Hoja principal
-            df.to_excel(writer, sheet_name='Conteo Completo', index=False)
-            
-            # Hoja de resumen
-            stats = InventarioManager.calcular_estadisticas(app_state['conteo_fisico'])
-            resumen_data = {
-                'Métrica': ['Total Pallets', 'Exactos', 'Sobrantes', 'Faltantes', 'No Encontrados', 'Precisión (%)'],
-                'Valor': [stats['total'], stats['exactos'], stats['sobrantes'], 
-                         stats['faltantes'], stats['no_encontrados'], stats['precision']]
-            }
-            pd.DataFrame(resumen_data).to_excel(writer, sheet_name='Resumen', index=False)
+        # Validar todo el lote antes de registrar: un pallet inválido rechaza el lote entero
+        results = []
+        validos = []
+        errores = []
+        for fila, item in enumerate(items, 1):
+            try:
+                id_pallet = str(item['id_pallet']).strip()
+                if not id_pallet:
+                    raise ValueError("id_pallet vacío")
+                resultado = {'id_pallet': id_pallet, 'success': False}
+                validos.append((resultado, str(item['numero_tablilla']).strip(), id_pallet,
+                                cantidad_entera(item['cantidad_contada'])))
+                results.append(resultado)
+            except KeyError as e:
+                errores.append({'fila': fila, 'message': f"Falta el campo {e.args[0]}"})
+            except (TypeError, ValueError) as e:
+                errores.append({'fila': fila, 'message': str(e)})
+        if errores:
+            primero = errores[0]
+            return JSONResponse({"success": False, "errors": errores,
+                                 "message": f"Pallet #{primero['fila']} inválido: {primero['message']}"},
+                                status_code=422)
         
-        output.seek(0)
+        datos_lote = InventarioManager.datos_sistema_lote(
+            [cantidad for *_, cantidad in validos], [id_pallet for _, _, id_pallet, _ in validos],
+            inventario_actual()
+        )
+        timestamp = datetime.now().isoformat()
+        altas = [
+            ('alta', {'numero_tablilla': numero_tablilla, 'id_pallet': id_pallet,
+                      'cantidad_contada': cantidad, **datos, 'timestamp': timestamp, 'politica': politica})
+            for (_, numero_tablilla, id_pallet, cantidad), datos in zip(validos, datos_lote)
+        ]
+        seqs = await run_in_threadpool(ESTADO.registrar_lote, altas, sesion.canal) if altas else []
+        conteo = sesion.sincronizar()
         
-        # Retornar archivo como respuesta
-        from fastapi.responses import StreamingResponse
+        for (resultado, _, id_pallet, cantidad), datos, seq in zip(validos, datos_lote, seqs):
+            accion, posicion = sesion.resultado_alta(seq)
+            diferencia = datos['diferencia']
+            if accion == 'sumado':
+                cantidad = conteo[posicion]['cantidad_contada']
+                diferencia = conteo[posicion]['diferencia']
+            resultado.update({'success': accion != 'rechazado', 'action': accion,
+                              'found': datos['found_in_system'], 'diferencia': diferencia})
+            if accion == 'rechazado':
+                resultado.update({'message': f"⚠️ {id_pallet}: ya fue contado, duplicado rechazado",
+                                  'status_type': "warning"})
+                continue
+            status_msg, resultado['status_type'] = InventarioManager.estado_diferencia(
+                datos['found_in_system'], cantidad, diferencia
+            )
+            resultado['message'] = f"{id_pallet}: {status_msg}"
         
-        filename = f"Inventario_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        agregados = sum(1 for r in results if r['success'])
+        return {
+            "success": True,
+            "total": len(results),
+            "added": agregados,
+            "failed": len(results) - agregados,
+            "results": results,
+            "stats": InventarioManager.calcular_estadisticas(conteo)
+        }
         
-        return StreamingResponse(
-            io.BytesIO(output.read()),
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+    except Exception as e:
+        return {"success": False, "message": f"Error agregando pallets: {str(e)}"}
+
+@app.post("/duplicate_policy")
+async def duplicate_policy(request: Request, politica: str = Form(...)):
+    """Cambiar la política de duplicados de la sesión (ambos, rechazar, reemplazar, sumar)"""
+    if politica not in POLITICAS_DUPLICADO:
+        return {"success": False, "message": f"Política no válida. Opciones: {list(POLITICAS_DUPLICADO)}"}
+    try:
+        sesion = sesion_de(request)
+    except ValueError as e:
+        return {"success": False, "message": str(e)}
+    await run_in_threadpool(sesion.registrar, 'politica', {'politica': politica})
+    sesion.sincronizar()
+    return {"success": True, "politica": politica, "message": f"Duplicados: {POLITICAS_DUPLICADO[politica]}"}
+
+@app.post("/clear_all")
+async def clear_all(request: Request):
+    """Limpiar el conteo de la sesión; las demás sesiones no se tocan"""
+    try:
+        sesion = sesion_de(request)
+    except ValueError as e:
+        return {"success": False, "message": str(e)}
+    await run_in_threadpool(sesion.registrar, 'limpiar', {})
+    sesion.sincronizar()
+    return {"success": True, "message": f"Datos de la sesión {sesion.nombre} limpiados"}
+
+@app.get("/counts")
+async def counts(request: Request, offset: int = 0, limit: int = 50, sort: str = "", filter: str = ""):
+    """Una ventana del conteo de la sesión para la tabla virtualizada
+    
+    `sort` es el nombre de una columna (con '-' adelante para orden descendente) y
+    `filter` un texto a buscar en ID, tablilla, código, producto y almacén. Sin
+    orden ni filtro la ventana se toma directo por posición.
+    """
+    def ventana_conteo():
+        sesion = sesion_de(request)
+        conteo = sesion.conteo
+        inicio = max(offset, 0)
+        tamano = max(1, min(limit, MAX_FILAS_PAGINA))
+        
+        with sesion.lock:
+            if sort or filter:
+                posiciones = conteo.filtrar(filter) if filter else np.arange(len(conteo))
+                if sort:
+                    posiciones = conteo.ordenar(posiciones, sort.lstrip('-'), sort.startswith('-'))
+                filtrados = len(posiciones)
+                ventana = posiciones[inicio:inicio + tamano].tolist()
+            else:
+                filtrados = len(conteo)
+                ventana = range(inicio, min(inicio + tamano, filtrados))
+            rows = [dict(conteo[posicion], posicion=posicion) for posicion in ventana]
+        
+        return {
+            "success": True,
+            "total": len(conteo),
+            "filtered": filtrados,
+            "offset": inicio,
+            "limit": tamano,
+            "seq": sesion.seq,
+            "rows": rows
+        }
+    
+    try:
+        # El lock de la sesión (y el índice de trigramas que arma el primer filtro) bloquean:
+        # se esperan en el pool de hilos para no frenar el event loop
+        return await run_in_threadpool(ventana_conteo)
+    except KeyError as e:
+        return JSONResponse({"success": False, "message": str(e.args[0])}, status_code=400)
+    except Exception as e:
+        return {"success": False, "message": f"Error consultando el conteo: {str(e)}"}
+
+@app.get("/pending")
+async def pending(request: Request, offset: int = 0, limit: int = 50, almacen: str = ""):
+    """Pallets del inventario que la sesión todavía no contó, con la cobertura por almacén
+
+    Sale del mapa de filas contadas que el conteo mantiene en cada escaneo: no se
+    cruza el inventario con el conteo en cada consulta.
+    """
+    indice = inventario_actual()
+    if indice is None:
+        return {"success": False, "message": "No hay inventario cargado"}
+
+    def ventana_pendientes():
+        sesion = sesion_de(request)
+        inicio = max(offset, 0)
+        tamano = max(1, min(limit, MAX_FILAS_PAGINA))
+
+        with sesion.lock:
+            cobertura = sesion.conteo.cobertura_de(indice)
+            posiciones = cobertura.pendientes(almacen or None)
+            ventana = cobertura.vista_pendientes(posiciones[inicio:inicio + tamano])
+            resumen = cobertura.resumen()
+            almacenes = cobertura.cobertura_por_almacen()
+
+        return {
+            "success": True,
+            "resumen": resumen,
+            "almacenes": almacenes.to_dict('records'),
+            "filtered": len(posiciones),
+            "offset": inicio,
+            "limit": tamano,
+            "seq": sesion.seq,
+            "rows": ventana.to_dict('records')
+        }
+
+    try:
+        # El lock de la sesión (y armar la cobertura la primera vez) bloquean: fuera del event loop
+        return await run_in_threadpool(ventana_pendientes)
+    except Exception as e:
+        return {"success": False, "message": f"Error consultando pendientes: {str(e)}"}
+
+@app.get("/events")
+async def events(request: Request, desde: int = 0):
+    """Canal SSE de la sesión: envía solo las filas nuevas o cambiadas y las estadísticas
+    
+    La página se actualiza sin recargar. Se revisa la bitácora compartida, así
+    que también llegan los pallets registrados por otros workers o pestañas.
+    """
+    try:
+        sesion = sesion_de(request)
+    except ValueError as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=400)
+    
+    # Al reconectar, el navegador informa el último evento recibido
+    ultimo = int(request.headers.get('last-event-id') or desde)
+    
+    async def flujo():
+        nonlocal ultimo
+        latido = time.monotonic()
+        while not await request.is_disconnected():
+            sesion.ultimo_uso = time.monotonic()
+            await run_in_threadpool(sesion.sincronizar)
+            mensaje = sesion.cambios_desde(ultimo)
+            if mensaje is not None:
+                ultimo = mensaje['seq']
+                latido = time.monotonic()
+                yield f"id: {ultimo}\ndata: {json.dumps(mensaje, default=str)}\n\n"
+            elif time.monotonic() - latido > LATIDO_EVENTOS:
+                latido = time.monotonic()
+                yield ": latido\n\n"
+            await asyncio.sleep(INTERVALO_EVENTOS)
+    
+    return StreamingResponse(flujo(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/sessions")
+async def sessions():
+    """Sesiones de conteo registradas; las que están en memoria informan su avance"""
+    ahora = time.monotonic()
+    resultado = []
+    for nombre in sesiones_registradas():
+        sesion = SESIONES.get(nombre)
+        resultado.append({
+            'nombre': nombre,
+            'en_memoria': sesion is not None,
+            'total': len(sesion.conteo) if sesion else None,
+            'inactiva_segundos': round(ahora - sesion.ultimo_uso) if sesion else None
+        })
+    return {"sessions": resultado, "ttl_segundos": SESION_TTL}
+
+def solicitar_reporte(sesion, formato):
+    """Encola el reporte de la sesión en el pool de procesos, o reutiliza el de la misma versión del conteo
+    
+    La clave lleva la secuencia de la sesión y el inventario activo (del que salen
+    los pendientes): si cambia alguno se genera otro; sin cambios, repetir la
+    descarga no cuesta nada. Devuelve (clave, futuro).
+    
+    El conteo no se copia en memoria: bajo el lock de la sesión se vuelca como
+    snapshot .npy al directorio de reportes, el proceso hijo lo abre desde ahí y
+    la carpeta se borra cuando el pedido termina (o se cancela). Bloquea: desde
+    los handlers se llama con run_in_threadpool.
+    """
+    indice = inventario_actual()
+    with sesion.lock:
+        inventario = indice.identificador[:12] if indice is not None else '0'
+        clave = f"{sesion.nombre}-{sesion.seq}-{inventario}.{formato}"
+        futuro = REPORTES.buscar(clave)
+        if futuro is not None:
+            return clave, futuro
+        
+        # Snapshot: el proceso hijo recibe el conteo de este momento, no lo que se agregue después
+        conteo = sesion.conteo
+        tipos = dict(conteo.columnas)
+        columnas = guardar_columnas({nombre: conteo.columna(nombre) for nombre in conteo.columnas},
+                                    REPORTES.directorio)
+        if formato == 'xlsx':
+            stats = InventarioManager.calcular_estadisticas(conteo)
+            cobertura = conteo.cobertura_de(indice)
+            # Bajo el lock solo las posiciones; los datos del inventario se leen después
+            posiciones_pendientes = cobertura.pendientes() if cobertura else None
+            almacenes = cobertura.cobertura_por_almacen() if cobertura else None
+    
+    if formato == 'xlsx':
+        # El índice no cambia una vez publicado: la vista de pendientes se arma sin el lock
+        pendientes = cobertura.vista_pendientes(posiciones_pendientes) if cobertura else None
+        futuro = REPORTES.solicitar(clave, escribir_excel_conteo, columnas, tipos, stats,
+                                    pendientes, almacenes, grupo=(sesion.nombre, formato))
+    else:
+        futuro = REPORTES.solicitar(clave, escribir_datos_conteo, columnas, tipos, formato,
+                                    grupo=(sesion.nombre, formato))
+    futuro.add_done_callback(lambda f: shutil.rmtree(columnas, ignore_errors=True))
+    
+    # El estado queda en SQLite para que cualquier worker pueda informarlo
+    job = {'id': clave, 'tipo': 'reporte', 'status': 'running', 'message': 'Generando reporte',
+           'created': datetime.now().isoformat()}
+    ESTADO.guardar_job(job, MAX_JOBS)
+    futuro.add_done_callback(lambda f: actualizar_job(job, estado_futuro(f)))
+    return clave, futuro
+
+def estado_futuro(futuro):
+    """Cambios del job de un reporte terminado (o cancelado)"""
+    if futuro.cancelled():
+        return {'status': 'cancelled', 'message': 'Reemplazado por un reporte más nuevo'}
+    if futuro.exception() is not None:
+        return {'status': 'error', 'message': f"Error generando reporte: {futuro.exception()}"}
+    return {'status': 'done', 'message': 'Reporte listo'}
+
+def respuesta_reporte(ruta, sesion_nombre, formato):
+    """Descarga del archivo ya generado"""
+    media_type = MEDIA_TYPE_XLSX if formato == 'xlsx' else FORMATOS_EXPORTACION[formato][1]
+    filename = f"Inventario_{sesion_nombre}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato}"
+    return FileResponse(ruta, media_type=media_type, filename=filename)
+
+@app.post("/reports")
+async def reports(request: Request, format: str = "xlsx"):
+    """Pedir un reporte en segundo plano; se consulta en /reports/{job_id}"""
+    if format not in FORMATOS_REPORTE:
+        return JSONResponse({"success": False, "message": f"Formato no válido. Opciones: {FORMATOS_REPORTE}"},
+                            status_code=400)
+    try:
+        sesion = sesion_de(request)
+    except ValueError as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=400)
+    if not sesion.conteo:
+        return {"success": False, "message": "No hay datos para exportar"}
+    
+    clave, _ = await run_in_threadpool(solicitar_reporte, sesion, format)
+    return {"success": True, "job_id": clave, "status": REPORTES.estado(clave),
+            "download_url": f"/reports/{clave}/download"}
+
+@app.get("/reports/{job_id}")
+async def report_status(job_id: str):
+    """Estado de un reporte: pending, running, done, error o cancelled"""
+    if not PATRON_REPORTE.fullmatch(job_id):
+        return JSONResponse({"success": False, "message": "Reporte no encontrado"}, status_code=404)
+    estado = REPORTES.estado(job_id)
+    job = ESTADO.obtener_job(job_id) or {'id': job_id}
+    if estado is not None:
+        job['status'] = estado
+    elif 'status' not in job:
+        return JSONResponse({"success": False, "message": "Reporte no encontrado"}, status_code=404)
+    job['download_url'] = f"/reports/{job_id}/download" if job['status'] == 'done' else None
+    return job
+
+@app.get("/reports/{job_id}/download")
+async def report_download(job_id: str):
+    """Descargar un reporte ya generado"""
+    if not PATRON_REPORTE.fullmatch(job_id) or not os.path.exists(REPORTES.ruta(job_id)):
+        return JSONResponse({"success": False, "message": "Reporte no encontrado o todavía en curso"},
+                            status_code=404)
+    sesion_nombre, formato = job_id.rsplit('-', 2)[0], job_id.rsplit('.', 1)[1]
+    return respuesta_reporte(REPORTES.ruta(job_id), sesion_nombre, formato)
+
+@app.get("/export_excel")
+async def export_excel(request: Request):
+    """Generar reporte Excel del conteo de la sesión"""
+    return await export(request, 'xlsx')
+
+@app.get("/export")
+async def export(request: Request, format: str = "csv"):
+    """Exportar el conteo de la sesión en CSV, Parquet, JSON Lines o XLSX
+    
+    El archivo se genera en el pool de procesos sin bloquear el event loop, y se
+    reutiliza mientras el conteo no cambie.
+    """
+    if format not in FORMATOS_REPORTE:
+        return JSONResponse({"success": False, "message": f"Formato no válido. Opciones: {FORMATOS_REPORTE}"},
+                            status_code=400)
+    try:
+        sesion = sesion_de(request)
+    except ValueError as e:
+        return {"success": False, "message": str(e)}
+    if not sesion.conteo:
+        return {"success": False, "message": "No hay datos para exportar"}
+    
+    try:
+        _, futuro = await run_in_threadpool(solicitar_reporte, sesion, format)
+        while True:
+            try:
+                ruta = await asyncio.wrap_future(futuro)
+                break
+            except asyncio.CancelledError:
+                # Un pedido más nuevo de la sesión lo reemplazó antes de empezar: se espera ese
+                if not futuro.cancelled():
+                    raise
+                _, futuro = await run_in_threadpool(solicitar_reporte, sesion, format)
+        return respuesta_reporte(ruta, sesion.nombre, format)
         
     except Exception as e:
-        return {"success": False, "message": f"Error generando Excel: {str(e)}"}
+        return {"success": False, "message": f"Error exportando: {str(e)}"}
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Con varios workers el inventario se comparte por memory-map y el conteo por SQLite
+    workers = int(os.environ.get('UVICORN_WORKERS', '1'))
+    if workers > 1:
+        uvicorn.run("fastapi_app:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,844 @@
+"""Estructuras compartidas para búsqueda de pallets en el inventario del sistema"""
+import copy
+import hashlib
+import io
+import json
+import os
+import shutil
+import uuid
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+from lector_excel import leer_columnas_excel
+
+COLUMNAS_REQUERIDAS = ['Id de pallet', 'Inventario físico']
+COLUMNAS_OPCIONALES = {
+    'Almacén': 'Almacén General',
+    'Código de artículo': 'N/A',
+    'Nombre del producto': 'Producto sin nombre'
+}
+
+
+FORMATOS_INVENTARIO = ['xlsx', 'csv', 'parquet']
+
+
+def leer_excel_inventario(archivo, progreso=None):
+    """Lee del Excel solo las columnas que usa el inventario, en streaming"""
+    return leer_columnas_excel(
+        archivo, COLUMNAS_REQUERIDAS + list(COLUMNAS_OPCIONALES),
+        requeridas=COLUMNAS_REQUERIDAS, progreso=progreso
+    )
+
+
+def detectar_formato(contenido, nombre=None):
+    """Detecta el formato por extensión y, si no hay, por la firma del archivo"""
+    extension = os.path.splitext(str(nombre or ''))[1].lstrip('.').lower()
+    if extension in FORMATOS_INVENTARIO:
+        return extension
+    if contenido[:4] == b'PAR1':
+        return 'parquet'
+    if contenido[:2] == b'PK':
+        return 'xlsx'
+    return 'csv'
+
+
+def _columnas_a_leer(encabezados):
+    """Encabezados del archivo que usa el inventario, o None si falta alguno requerido"""
+    columnas = set(COLUMNAS_REQUERIDAS) | set(COLUMNAS_OPCIONALES)
+    leer = [c for c in encabezados if str(c).strip() in columnas]
+    presentes = {str(c).strip() for c in leer}
+    if not all(col in presentes for col in COLUMNAS_REQUERIDAS):
+        return None
+    return leer
+
+
+def _leer_csv_inventario(contenido):
+    try:
+        texto_inicio = contenido[:4096].decode('utf-8-sig')
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        texto_inicio = contenido[:4096].decode('latin-1')
+        encoding = 'latin-1'
+
+    # Los exportes del WMS pueden venir con ';' o tabulador según la configuración regional
+    encabezado = texto_inicio.splitlines()[0] if texto_inicio else ''
+    separador = max([',', ';', '\t', '|'], key=encabezado.count)
+
+    opciones = dict(sep=separador, dtype=str, encoding=encoding, engine='c')
+    encabezados = pd.read_csv(io.BytesIO(contenido), nrows=0, **opciones).columns
+    leer = _columnas_a_leer(encabezados)
+    if leer is None:
+        # Faltan columnas requeridas: devolver los encabezados para reportarlo
+        return pd.DataFrame(columns=encabezados)
+    return pd.read_csv(io.BytesIO(contenido), usecols=leer, **opciones)
+
+
+def _leer_parquet_inventario(contenido):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Para leer archivos Parquet instala pyarrow (pip install pyarrow)")
+
+    archivo = pq.ParquetFile(io.BytesIO(contenido))
+    encabezados = archivo.schema_arrow.names
+    leer = _columnas_a_leer(encabezados)
+    if leer is None:
+        return pd.DataFrame(columns=encabezados)
+    return archivo.read(columns=leer).to_pandas()
+
+
+def leer_inventario(archivo, nombre=None, progreso=None):
+    """Lee un inventario en XLSX, CSV o Parquet con el lector más rápido para cada formato"""
+    if hasattr(archivo, 'read'):
+        if hasattr(archivo, 'seek'):
+            archivo.seek(0)
+        nombre = nombre or getattr(archivo, 'name', None)
+        archivo = archivo.read()
+
+    formato = detectar_formato(archivo, nombre)
+    if formato == 'xlsx':
+        return leer_excel_inventario(archivo, progreso)
+
+    df = _leer_parquet_inventario(archivo) if formato == 'parquet' else _leer_csv_inventario(archivo)
+    if progreso is not None:
+        progreso(len(df), len(df))
+    return df
+
+
+def preparar_inventario(df):
+    """Limpia y valida un inventario leído; devuelve (df, columnas_faltantes, columnas_creadas)"""
+    df = df.dropna(how='all')
+    df.columns = [str(c).strip() for c in df.columns]
+
+    faltantes = [col for col in COLUMNAS_REQUERIDAS if col not in df.columns]
+    if faltantes:
+        return df, faltantes, []
+
+    creadas = []
+    for col, default_val in COLUMNAS_OPCIONALES.items():
+        if col not in df.columns:
+            df[col] = default_val
+            creadas.append(col)
+
+    df['Inventario físico'] = pd.to_numeric(df['Inventario físico'], errors='coerce').fillna(0).astype(int)
+    df['Id de pallet'] = df['Id de pallet'].astype(str).str.strip()
+
+    return df, [], creadas
+
+
+def normalizar_id(id_pallet):
+    """Normaliza un ID de pallet para comparaciones (sin espacios, mayúsculas)"""
+    return str(id_pallet).strip().upper()
+
+
+def normalizar_ids(ids):
+    """Versión vectorizada de normalizar_id para una colección de IDs"""
+    return pd.Series(list(ids), dtype=object).astype(str).str.strip().str.upper()
+
+
+def distancia_edicion(a, b, maximo=None):
+    """Distancia de Levenshtein; corta en cuanto supera `maximo`"""
+    if len(a) < len(b):
+        a, b = b, a
+    if maximo is not None and len(a) - len(b) > maximo:
+        return maximo + 1
+
+    anterior = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        for j, cb in enumerate(b, 1):
+            actual.append(min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + (ca != cb)))
+        if maximo is not None and min(actual) > maximo:
+            return maximo + 1
+        anterior = actual
+    return anterior[-1]
+
+
+class IndiceDifuso:
+    """Índice invertido de trigramas para sugerir IDs parecidos ("¿quisiste decir?")
+
+    Las listas de filas por trigrama se guardan ordenadas en arreglos NumPy, así
+    una consulta solo toca las filas que comparten trigramas con el ID buscado
+    y la distancia de edición exacta se calcula sobre unos pocos candidatos.
+    """
+
+    MARCA_INICIO = 1
+    MARCA_FIN = 2
+    MAX_CANDIDATOS = 64
+
+    def __init__(self, ids):
+        self.ids = ids
+        gramas, filas = self._trigramas(ids)
+        orden = np.argsort(gramas, kind='stable')
+        self.gramas = gramas[orden]
+        self.filas = filas[orden]
+        self.tope_frecuencia = self._tope(len(ids)) if len(self.gramas) else 0
+
+    @staticmethod
+    def _tope(n):
+        # Trigramas presentes en demasiados IDs no discriminan y solo cuestan tiempo
+        return max(1000, n // 20)
+
+    @classmethod
+    def _trigramas(cls, ids):
+        """(trigramas, fila) de cada ID, sin ordenar"""
+        n = len(ids)
+        ancho = ids.dtype.itemsize // 4 if n else 0
+        if n == 0 or ancho == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)
+
+        # Matriz de puntos de código con marcas de inicio y fin de ID
+        matriz = np.zeros((n, ancho + 2), dtype=np.int64)
+        matriz[:, 0] = cls.MARCA_INICIO
+        matriz[:, 1:ancho + 1] = ids.view(np.uint32).reshape(n, ancho)
+        matriz[np.arange(n), np.char.str_len(ids) + 1] = cls.MARCA_FIN
+
+        gramas = (matriz[:, :-2] << 42) | (matriz[:, 1:-1] << 21) | matriz[:, 2:]
+        validos = matriz[:, 2:] != 0
+        return gramas[validos], np.nonzero(validos)[0].astype(np.int32)
+
+    def con_cambios(self, ids, borradas, puntos, claves):
+        """Copia del índice para el arreglo `ids` que resulta de quitar las filas `borradas`
+        (ordenadas, del arreglo anterior) e insertar `claves` en `puntos` (como np.insert)
+
+        Solo se calculan los trigramas de las claves nuevas; las listas existentes
+        se filtran y se corren sin volver a ordenarse.
+        """
+        gramas, filas = self.gramas, self.filas
+        if len(borradas):
+            quedan = ~np.isin(filas, borradas)
+            gramas = gramas[quedan]
+            filas = filas[quedan]
+            filas = filas - np.searchsorted(borradas, filas).astype(np.int32)
+        if len(claves):
+            filas = filas + np.searchsorted(puntos, filas, side='right').astype(np.int32)
+            nuevas_gramas, nuevas_filas = self._trigramas(claves)
+            finales = (np.asarray(puntos) + np.arange(len(claves))).astype(np.int32)
+            orden = np.argsort(nuevas_gramas, kind='stable')
+            nuevas_gramas = nuevas_gramas[orden]
+            nuevas_filas = finales[nuevas_filas[orden]]
+            insercion = np.searchsorted(gramas, nuevas_gramas, side='right')
+            gramas = np.insert(gramas, insercion, nuevas_gramas)
+            filas = np.insert(filas, insercion, nuevas_filas)
+
+        nuevo = IndiceDifuso.__new__(IndiceDifuso)
+        nuevo.ids = ids
+        nuevo.gramas = gramas
+        nuevo.filas = filas
+        nuevo.tope_frecuencia = self._tope(len(ids)) if len(gramas) else 0
+        return nuevo
+
+    def _gramas_consulta(self, texto):
+        codigos = [self.MARCA_INICIO] + [ord(c) for c in texto] + [self.MARCA_FIN]
+        return np.unique([
+            (codigos[i] << 42) | (codigos[i + 1] << 21) | codigos[i + 2]
+            for i in range(len(codigos) - 2)
+        ])
+
+    def similares(self, id_normalizado, limite=3, distancia_max=2):
+        """Devuelve [(fila, distancia)] de los IDs más cercanos al ID dado"""
+        if not id_normalizado or len(self.gramas) == 0:
+            return []
+
+        gramas = self._gramas_consulta(id_normalizado)
+        inicios = np.searchsorted(self.gramas, gramas, side='left')
+        fines = np.searchsorted(self.gramas, gramas, side='right')
+        tamanos = fines - inicios
+        utiles = (tamanos > 0) & (tamanos <= self.tope_frecuencia)
+        if not utiles.any():
+            utiles = tamanos > 0
+        if not utiles.any():
+            return []
+
+        candidatos = np.concatenate([
+            self.filas[i:f] for i, f in zip(inicios[utiles], fines[utiles])
+        ])
+        filas, compartidos = np.unique(candidatos, return_counts=True)
+        if len(filas) > self.MAX_CANDIDATOS:
+            mejores = np.argpartition(-compartidos, self.MAX_CANDIDATOS)[:self.MAX_CANDIDATOS]
+            filas = filas[mejores]
+
+        resultados = []
+        for fila in filas.tolist():
+            distancia = distancia_edicion(id_normalizado, str(self.ids[fila]), distancia_max)
+            if 0 < distancia <= distancia_max:
+                resultados.append((distancia, str(self.ids[fila]), fila))
+        resultados.sort()
+        return [(fila, distancia) for distancia, _, fila in resultados[:limite]]
+
+
+class ColumnaTexto:
+    """Columna de texto como bytes UTF-8 contiguos más offsets, apta para memory-map"""
+
+    def __init__(self, datos, offsets):
+        self.datos = datos
+        self.offsets = offsets
+
+    @classmethod
+    def desde_valores(cls, valores):
+        codificados = [str(v).encode('utf-8') for v in valores]
+        offsets = np.zeros(len(codificados) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in codificados], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(codificados), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, pos):
+        if isinstance(pos, (int, np.integer)):
+            return self.datos[self.offsets[pos]:self.offsets[pos + 1]].tobytes().decode('utf-8')
+        pos = np.asarray(pos)
+        if len(pos) > len(self) // 4:
+            # Muchas filas: decodificar la columna completa de una pasada sale más barato
+            return self.to_numpy()[pos]
+        return np.array([self[p] for p in np.asarray(pos).tolist()], dtype=object)
+
+    def to_numpy(self):
+        texto = self.datos.tobytes()
+        limites = self.offsets.tolist()
+        return np.array([texto[a:b].decode('utf-8') for a, b in zip(limites[:-1], limites[1:])], dtype=object)
+
+
+class IndiceInventario:
+    """Índice hash ID normalizado -> posición de fila, construido una vez por carga"""
+
+    ARCHIVOS_SNAPSHOT = ['ids_ordenados', 'posiciones_ordenadas', 'inv_sistema', 'gramas', 'filas']
+    COLUMNAS_SNAPSHOT = {
+        'id_pallet': 'Id de pallet',
+        'almacen': 'Almacén',
+        'codigo': 'Código de artículo',
+        'nombre': 'Nombre del producto'
+    }
+
+    def __init__(self, df_inventario):
+        self._df = df_inventario
+        self.marca = None
+        # Identifica este inventario (p. ej. en la clave de un reporte); viaja en el snapshot
+        self.identificador = uuid.uuid4().hex
+        self._almacenes = None
+        # Filas dadas de baja por un delta: siguen en los arreglos (las posiciones no se corren)
+        # pero ya no están indexadas; aplicar_delta compacta cuando son demasiadas
+        self.eliminadas = 0
+
+        ids = df_inventario['Id de pallet'].astype(str).str.strip().str.upper()
+        # Igual que matches.iloc[0]: ante IDs duplicados gana la primera fila
+        primeros = ~ids.duplicated(keep='first')
+        posiciones = np.flatnonzero(primeros.to_numpy())
+        self.posiciones = dict(zip(ids[primeros].tolist(), posiciones.tolist()))
+
+        # Arreglo ordenado de IDs para búsqueda por prefijo con bisección
+        ids_unicos = ids[primeros].to_numpy(dtype=str)
+        orden = np.argsort(ids_unicos, kind='stable')
+        self.ids_ordenados = ids_unicos[orden]
+        self.posiciones_ordenadas = posiciones[orden]
+        self.difuso = IndiceDifuso(self.ids_ordenados)
+
+        # Columnas ya limpias para armar el resultado sin tocar el DataFrame
+        self.id_pallet = df_inventario['Id de pallet'].astype(str).str.strip().to_numpy(dtype=object)
+        self.almacen = self._columna_texto(df_inventario, 'Almacén')
+        self.codigo = self._columna_texto(df_inventario, 'Código de artículo')
+        self.nombre = self._columna_texto(df_inventario, 'Nombre del producto')
+        self.inv_sistema = pd.to_numeric(
+            df_inventario['Inventario físico'], errors='coerce'
+        ).fillna(0).astype(np.int64).to_numpy()
+
+    @staticmethod
+    def _columna_texto(df, columna):
+        if columna not in df.columns:
+            return np.full(len(df), 'N/A', dtype=object)
+        return np.array([str(v).strip() for v in df[columna]], dtype=object)
+
+    @property
+    def df(self):
+        """DataFrame del inventario; tras abrir un snapshot o aplicar un delta se materializa al primer uso"""
+        if self._df is None:
+            # Con bajas solo quedan las filas indexadas, en su orden original
+            filas = np.sort(np.asarray(self.posiciones_ordenadas)) if self.eliminadas else slice(None)
+            datos = {}
+            for atributo, columna in self.COLUMNAS_SNAPSHOT.items():
+                valores = getattr(self, atributo)
+                datos[columna] = (valores.to_numpy() if isinstance(valores, ColumnaTexto) else valores)[filas]
+            datos['Inventario físico'] = np.asarray(self.inv_sistema)[filas]
+            self._df = pd.DataFrame(datos)
+        return self._df
+
+    def __len__(self):
+        return len(self.inv_sistema) - self.eliminadas
+
+    @property
+    def total_filas(self):
+        """Filas de los arreglos por posición, incluidas las dadas de baja"""
+        return len(self.inv_sistema)
+
+    def codigos_almacen(self):
+        """(código por fila, nombres de almacén) para agrupar por almacén con bincount; se calcula una vez"""
+        if self._almacenes is None:
+            almacen = self.almacen.to_numpy() if isinstance(self.almacen, ColumnaTexto) else self.almacen
+            codigos, nombres = pd.factorize(almacen, sort=True)
+            self._almacenes = (codigos, np.asarray(nombres, dtype=object))
+        return self._almacenes
+
+    def posicion(self, id_pallet):
+        """Devuelve la posición de fila del pallet o None si no existe"""
+        if not id_pallet:
+            return None
+        clave = normalizar_id(id_pallet)
+        if self.posiciones is not None:
+            return self.posiciones.get(clave)
+
+        # Índice abierto desde snapshot: bisección sobre el arreglo ordenado
+        i = int(np.searchsorted(self.ids_ordenados, clave))
+        if i < len(self.ids_ordenados) and self.ids_ordenados[i] == clave:
+            return int(self.posiciones_ordenadas[i])
+        return None
+
+    def info_fila(self, pos):
+        """Arma el diccionario de resultado para una posición de fila"""
+        return {
+            'found': True,
+            'almacen': self.almacen[pos],
+            'codigo': self.codigo[pos],
+            'nombre': self.nombre[pos],
+            'inv_sistema': int(self.inv_sistema[pos])
+        }
+
+    def buscar(self, id_pallet):
+        """Busca un pallet en O(1); mismo formato que InventarioManager.buscar_pallet"""
+        pos = self.posicion(id_pallet)
+        if pos is None:
+            return {'found': False}
+        return self.info_fila(pos)
+
+    def posiciones_lote(self, ids):
+        """Posiciones de fila para muchos IDs a la vez (-1 si no existe)"""
+        claves = normalizar_ids(ids).to_numpy(dtype=str)
+        if len(self.ids_ordenados) == 0 or len(claves) == 0:
+            return np.full(len(claves), -1, dtype=np.int64)
+
+        i = np.minimum(np.searchsorted(self.ids_ordenados, claves), len(self.ids_ordenados) - 1)
+        encontrados = self.ids_ordenados[i] == claves
+        return np.where(encontrados, self.posiciones_ordenadas[i], -1).astype(np.int64)
+
+    def buscar_lote(self, ids):
+        """Busca muchos pallets en una sola pasada vectorizada"""
+        ids = list(ids)
+        posiciones = self.posiciones_lote(ids)
+        encontrados = posiciones >= 0
+        pos = posiciones[encontrados]
+
+        # Reunir las columnas de todas las filas encontradas de una vez
+        columnas = zip(self.almacen[pos], self.codigo[pos], self.nombre[pos], self.inv_sistema[pos].tolist())
+        resultados = [{'id_pallet': str(id_pallet).strip(), 'found': False} for id_pallet in ids]
+        for i, (almacen, codigo, nombre, inv_sistema) in zip(np.flatnonzero(encontrados).tolist(), columnas):
+            resultados[i].update({
+                'found': True, 'almacen': almacen, 'codigo': codigo,
+                'nombre': nombre, 'inv_sistema': inv_sistema
+            })
+        return resultados
+
+    def sugerir(self, prefijo, limite=10):
+        """Devuelve hasta `limite` pallets cuyo ID normalizado empieza con `prefijo`"""
+        prefijo = normalizar_id(prefijo) if prefijo else ''
+        if not prefijo or limite <= 0:
+            return []
+
+        inicio = np.searchsorted(self.ids_ordenados, prefijo, side='left')
+        fin = np.searchsorted(self.ids_ordenados, prefijo + '\U0010ffff', side='left')
+        fin = min(fin, inicio + limite)
+
+        sugerencias = []
+        for pos in self.posiciones_ordenadas[inicio:fin]:
+            info = self.info_fila(pos)
+            info['id_pallet'] = self.id_pallet[pos]
+            sugerencias.append(info)
+        return sugerencias
+
+    def similares(self, id_pallet, limite=3):
+        """Devuelve los pallets con ID más parecido a uno no encontrado"""
+        if not id_pallet:
+            return []
+
+        sugerencias = []
+        for fila, distancia in self.difuso.similares(normalizar_id(id_pallet), limite):
+            pos = self.posiciones_ordenadas[fila]
+            info = self.info_fila(pos)
+            info['id_pallet'] = self.id_pallet[pos]
+            info['distancia'] = distancia
+            sugerencias.append(info)
+        return sugerencias
+
+    def con_cambios(self, posiciones, actualizadas, insertadas, eliminados):
+        """Copia del índice con un delta aplicado; el original (compartido) no se toca
+
+        Las filas `posiciones` toman los valores de `actualizadas` (mismo orden),
+        `insertadas` se agregan al final y las claves de `eliminados` dejan de
+        estar indexadas. El hash, el arreglo ordenado y los trigramas se parchean
+        solo para las claves que entran y salen.
+        """
+        nuevo = copy.copy(self)
+        nuevo._df = None
+        nuevo.marca = None
+        nuevo.identificador = uuid.uuid4().hex
+        nuevo._almacenes = None
+
+        # Columnas por fila: parche de las actualizadas y altas al final
+        columnas = dict(self.COLUMNAS_SNAPSHOT, inv_sistema='Inventario físico')
+        for atributo, columna in columnas.items():
+            valores = getattr(self, atributo)
+            valores = valores.to_numpy() if isinstance(valores, ColumnaTexto) else np.array(valores)
+            if atributo != 'id_pallet' and columna in actualizadas.columns and len(posiciones):
+                valores[posiciones] = self._valores_columna(actualizadas, columna, atributo)
+            agregados = self._valores_columna(insertadas, columna, atributo)
+            setattr(nuevo, atributo, np.concatenate([valores, agregados]))
+
+        # Bajas: fuera del hash y del arreglo ordenado; la fila queda en los arreglos
+        claves_baja = np.asarray(eliminados, dtype=str)
+        borradas = np.searchsorted(self.ids_ordenados, claves_baja) if len(claves_baja) else np.empty(0, dtype=np.int64)
+        if len(borradas):
+            validas = borradas < len(self.ids_ordenados)
+            validas[validas] = self.ids_ordenados[borradas[validas]] == claves_baja[validas]
+            borradas = np.unique(borradas[validas])
+        ids = np.delete(self.ids_ordenados, borradas)
+        posiciones_ordenadas = np.delete(self.posiciones_ordenadas, borradas)
+        nuevo.eliminadas = self.eliminadas + len(borradas)
+
+        # Altas: a continuación de las filas existentes, insertadas en orden en el arreglo
+        claves = insertadas['Id de pallet'].astype(str).str.strip().str.upper().to_numpy(dtype=str)
+        filas = np.arange(self.total_filas, self.total_filas + len(claves), dtype=np.int64)
+        orden = np.argsort(claves, kind='stable')
+        claves, filas = claves[orden], filas[orden]
+        ancho = max(ids.dtype.itemsize, claves.dtype.itemsize, 4) // 4
+        ids = ids.astype(f'<U{ancho}', copy=False)
+        puntos = np.searchsorted(ids, claves)
+        nuevo.ids_ordenados = np.insert(ids, puntos, claves)
+        nuevo.posiciones_ordenadas = np.insert(posiciones_ordenadas, puntos, filas)
+        nuevo.difuso = self.difuso.con_cambios(nuevo.ids_ordenados, borradas, puntos, claves)
+
+        if self.posiciones is not None:
+            nuevo.posiciones = dict(self.posiciones)
+            for clave in claves_baja.tolist():
+                nuevo.posiciones.pop(clave, None)
+            nuevo.posiciones.update(zip(claves.tolist(), filas.tolist()))
+        return nuevo
+
+    @staticmethod
+    def _valores_columna(df, columna, atributo):
+        """Valores de `columna` de df listos para el arreglo del atributo (texto limpio o enteros)"""
+        if atributo == 'inv_sistema':
+            return pd.to_numeric(df[columna], errors='coerce').fillna(0).astype(np.int64).to_numpy()
+        if columna not in df.columns:
+            return np.full(len(df), 'N/A', dtype=object)
+        return np.array([str(v).strip() for v in df[columna]], dtype=object)
+
+    def memoria_estimada(self):
+        """Bytes aproximados que ocupa el índice (sin contar el DataFrame)"""
+        numericos = (self.ids_ordenados.nbytes + self.posiciones_ordenadas.nbytes + self.inv_sistema.nbytes
+                     + self.difuso.gramas.nbytes + self.difuso.filas.nbytes)
+        # Columnas de texto y diccionario: estimación por entrada
+        return numericos + len(self) * 4 * 64 + len(self.posiciones or ()) * 100
+
+    def guardar_snapshot(self, directorio):
+        """Persiste el índice como arreglos .npy; el reemplazo del snapshot anterior es atómico"""
+        padre = os.path.dirname(os.path.abspath(directorio))
+        os.makedirs(padre, exist_ok=True)
+        temporal = os.path.join(padre, f".snapshot-{uuid.uuid4().hex}")
+        os.makedirs(temporal)
+
+        arreglos = {
+            'ids_ordenados': self.ids_ordenados,
+            'posiciones_ordenadas': self.posiciones_ordenadas,
+            'inv_sistema': self.inv_sistema,
+            'gramas': self.difuso.gramas,
+            'filas': self.difuso.filas
+        }
+        for atributo in self.COLUMNAS_SNAPSHOT:
+            columna = getattr(self, atributo)
+            if not isinstance(columna, ColumnaTexto):
+                columna = ColumnaTexto.desde_valores(columna)
+            arreglos[f'{atributo}_datos'] = columna.datos
+            arreglos[f'{atributo}_offsets'] = columna.offsets
+        for nombre, arreglo in arreglos.items():
+            np.save(os.path.join(temporal, f'{nombre}.npy'), np.asarray(arreglo))
+
+        with open(os.path.join(temporal, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'formato': 1,
+                'filas': len(self),
+                'tope_frecuencia': self.difuso.tope_frecuencia,
+                'eliminadas': self.eliminadas,
+                'identificador': self.identificador,
+                'creado': datetime.now().isoformat()
+            }, f)
+
+        with bloqueo_snapshot(directorio, exclusivo=True):
+            anterior = None
+            if os.path.exists(directorio):
+                anterior = f"{temporal}-anterior"
+                os.replace(directorio, anterior)
+            os.replace(temporal, directorio)
+            self.marca = self.marca_snapshot(directorio)
+        if anterior:
+            shutil.rmtree(anterior, ignore_errors=True)
+        return self.marca
+
+    @staticmethod
+    def marca_snapshot(directorio):
+        """Identifica la versión del snapshot en disco (barato: un stat); None si no hay"""
+        try:
+            estado = os.stat(os.path.join(directorio, 'meta.json'))
+        except OSError:
+            return None
+        return (estado.st_ino, estado.st_mtime_ns)
+
+    @classmethod
+    def desde_snapshot(cls, directorio):
+        """Abre un snapshot con memory-map (sin copiar datos); None si no existe
+
+        Los arreglos quedan en el page cache del sistema operativo, así que varios
+        procesos que abren el mismo snapshot comparten la memoria sin copiarla.
+        """
+        with bloqueo_snapshot(directorio, exclusivo=False):
+            return cls._abrir_snapshot(directorio)
+
+    @classmethod
+    def _abrir_snapshot(cls, directorio):
+        ruta_meta = os.path.join(directorio, 'meta.json')
+        if not os.path.exists(ruta_meta):
+            return None
+        with open(ruta_meta, encoding='utf-8') as f:
+            meta = json.load(f)
+
+        def abrir(nombre):
+            return np.load(os.path.join(directorio, f'{nombre}.npy'), mmap_mode='r')
+
+        indice = cls.__new__(cls)
+        indice.marca = cls.marca_snapshot(directorio)
+        indice.identificador = meta.get('identificador') or uuid.uuid4().hex
+        indice._df = None
+        indice._almacenes = None
+        indice.eliminadas = meta.get('eliminadas', 0)
+        indice.posiciones = None
+        indice.ids_ordenados = abrir('ids_ordenados')
+        indice.posiciones_ordenadas = abrir('posiciones_ordenadas')
+        indice.inv_sistema = abrir('inv_sistema')
+        for atributo in cls.COLUMNAS_SNAPSHOT:
+            setattr(indice, atributo, ColumnaTexto(abrir(f'{atributo}_datos'), abrir(f'{atributo}_offsets')))
+
+        difuso = IndiceDifuso.__new__(IndiceDifuso)
+        difuso.ids = indice.ids_ordenados
+        difuso.gramas = abrir('gramas')
+        difuso.filas = abrir('filas')
+        difuso.tope_frecuencia = meta['tope_frecuencia']
+        indice.difuso = difuso
+        return indice
+
+
+class CoberturaInventario:
+    """Qué pallets del inventario ya se contaron: un contador por fila, marcado en cada escaneo
+
+    La fila cuenta como contada mientras algún registro del conteo la referencie,
+    así una baja o una edición del ID la devuelve a pendientes. Los pendientes y
+    la cobertura por almacén salen de operaciones vectorizadas sobre el arreglo,
+    sin cruzar el inventario con el conteo en cada consulta.
+    """
+
+    def __init__(self, indice, ids=()):
+        self.indice = indice
+        self.referencias = np.zeros(indice.total_filas, dtype=np.int32)
+        # Con IDs repetidos solo cuenta la primera fila, la misma que devuelve la búsqueda;
+        # las filas dadas de baja por un delta tampoco están indexadas
+        self.filas_pallet = np.zeros(indice.total_filas, dtype=bool)
+        self.filas_pallet[np.asarray(indice.posiciones_ordenadas)] = True
+        self.marcar(ids)
+
+    def marcar(self, ids, cantidad=1):
+        """Suma `cantidad` referencias a las filas de los IDs (los que no están en el inventario se ignoran)"""
+        ids = list(ids)
+        if not ids:
+            return
+        posiciones = self.indice.posiciones_lote(ids)
+        np.add.at(self.referencias, posiciones[posiciones >= 0], cantidad)
+
+    def desmarcar(self, ids):
+        self.marcar(ids, -1)
+
+    def reiniciar(self):
+        self.referencias[:] = 0
+
+    def contados(self):
+        """Máscara de filas (pallets) ya contadas"""
+        return self.filas_pallet & (self.referencias > 0)
+
+    def pendientes(self, almacen=None):
+        """Posiciones de fila de los pallets sin contar, opcionalmente de un almacén"""
+        mascara = self.filas_pallet & (self.referencias == 0)
+        if almacen is not None:
+            codigos, nombres = self.indice.codigos_almacen()
+            encontrado = np.flatnonzero(nombres == almacen)
+            if not len(encontrado):
+                return np.empty(0, dtype=np.int64)
+            mascara &= codigos == encontrado[0]
+        return np.flatnonzero(mascara)
+
+    def resumen(self):
+        """Totales del inventario: pallets, contados, pendientes y cobertura (%)"""
+        total = int(self.filas_pallet.sum())
+        contados = int(self.contados().sum())
+        return {
+            'total': total,
+            'contados': contados,
+            'pendientes': total - contados,
+            'cobertura': round(contados / total * 100, 2) if total else 0
+        }
+
+    def cobertura_por_almacen(self):
+        """DataFrame con pallets totales, contados, pendientes y cobertura (%) de cada almacén"""
+        codigos, nombres = self.indice.codigos_almacen()
+        total = np.bincount(codigos, weights=self.filas_pallet, minlength=len(nombres)).astype(np.int64)
+        contados = np.bincount(codigos, weights=self.contados(), minlength=len(nombres)).astype(np.int64)
+        cobertura = np.divide(contados * 100, total, out=np.zeros(len(nombres)), where=total > 0)
+        return pd.DataFrame({
+            'almacen': nombres,
+            'total': total,
+            'contados': contados,
+            'pendientes': total - contados,
+            'cobertura': np.round(cobertura, 2)
+        })
+
+    def vista_pendientes(self, posiciones=None):
+        """DataFrame con los datos de sistema de los pallets pendientes (o de `posiciones`)"""
+        if posiciones is None:
+            posiciones = self.pendientes()
+        return pd.DataFrame({
+            'id_pallet': self.indice.id_pallet[posiciones],
+            'almacen': self.indice.almacen[posiciones],
+            'codigo_articulo': self.indice.codigo[posiciones],
+            'nombre_producto': self.indice.nombre[posiciones],
+            'inv_sistema': np.asarray(self.indice.inv_sistema)[posiciones]
+        })
+
+
+@contextmanager
+def bloqueo_snapshot(directorio, exclusivo):
+    """Bloqueo entre procesos sobre el snapshot: exclusivo para escribir, compartido para abrir"""
+    if fcntl is None:
+        yield
+        return
+    padre = os.path.dirname(os.path.abspath(directorio))
+    os.makedirs(padre, exist_ok=True)
+    with open(os.path.join(padre, f".{os.path.basename(directorio)}.lock"), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusivo else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+CAMPOS_DELTA = ['Inventario físico', 'Almacén', 'Código de artículo', 'Nombre del producto']
+# Bajas acumuladas a partir de las cuales aplicar_delta compacta el inventario (reconstruye el índice)
+FRACCION_COMPACTAR = 0.25
+MIN_BAJAS_COMPACTAR = 1000
+
+
+def _tabla_comparable(df):
+    """Primera fila por ID normalizado con los campos que definen un cambio"""
+    tabla = pd.DataFrame({
+        col: df[col].astype(str).str.strip().to_numpy() if col in df.columns else 'N/A'
+        for col in CAMPOS_DELTA[1:]
+    })
+    tabla.insert(0, 'Inventario físico', pd.to_numeric(
+        df['Inventario físico'], errors='coerce'
+    ).fillna(0).astype(np.int64).to_numpy())
+    tabla['fila'] = np.arange(len(df))
+    tabla.index = df['Id de pallet'].astype(str).str.strip().str.upper().to_numpy()
+    return tabla[~tabla.index.duplicated(keep='first')]
+
+
+def calcular_delta(indice, df_nuevo):
+    """Compara el inventario indexado con uno nuevo por ID de pallet normalizado"""
+    viejo = _tabla_comparable(indice.df)
+    nuevo = _tabla_comparable(df_nuevo)
+
+    comunes = viejo.index.intersection(nuevo.index)
+    distintos = (viejo.loc[comunes, CAMPOS_DELTA] != nuevo.loc[comunes, CAMPOS_DELTA]).any(axis=1)
+    return {
+        'insertados': nuevo.index.difference(viejo.index),
+        'actualizados': comunes[distintos.to_numpy()],
+        'eliminados': viejo.index.difference(nuevo.index),
+        'filas_nuevas': nuevo['fila']
+    }
+
+
+def aplicar_delta(indice, df_nuevo, delta):
+    """Aplica un delta sobre el inventario indexado y devuelve el índice resultante
+
+    Solo se tocan las filas del delta: las actualizadas se parchean en sitio, las
+    altas se agregan al final (las posiciones existentes no se corren) y las bajas
+    dejan de estar indexadas sin mover el resto. Cuando las bajas acumuladas
+    superan FRACCION_COMPACTAR de las filas se compacta reconstruyendo el índice.
+    """
+    filas_nuevas = delta['filas_nuevas']
+    destino = indice.posiciones_lote(delta['actualizados'])
+    actualizadas = df_nuevo.iloc[filas_nuevas.loc[delta['actualizados']].to_numpy()]
+    insertadas = df_nuevo.iloc[np.sort(filas_nuevas.loc[delta['insertados']].to_numpy())]
+    nuevo = indice.con_cambios(destino, actualizadas, insertadas, delta['eliminados'])
+
+    if nuevo.eliminadas >= MIN_BAJAS_COMPACTAR and nuevo.eliminadas > FRACCION_COMPACTAR * nuevo.total_filas:
+        return IndiceInventario(nuevo.df.reset_index(drop=True))
+    return nuevo
+
+
+class CacheInventarios:
+    """Caché LRU de inventarios ya procesados, indexada por el SHA-256 del archivo
+
+    Los DataFrames e índices guardados se comparten entre cargas y no deben
+    modificarse en sitio.
+    """
+
+    def __init__(self, limite_bytes):
+        self.limite_bytes = limite_bytes
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.memoria_usada = 0
+
+    @staticmethod
+    def huella(contenido):
+        return hashlib.sha256(contenido).hexdigest()
+
+    def obtener(self, huella):
+        """Devuelve (df, indice) si el archivo ya fue procesado, o None"""
+        with self._lock:
+            entrada = self._entradas.get(huella)
+            if entrada is None:
+                return None
+            self._entradas.move_to_end(huella)
+            return entrada[0], entrada[1]
+
+    def guardar(self, huella, df, indice):
+        tamano = int(df.memory_usage(deep=True).sum()) + indice.memoria_estimada()
+        with self._lock:
+            if huella in self._entradas:
+                self.memoria_usada -= self._entradas.pop(huella)[2]
+            if tamano > self.limite_bytes:
+                return
+            self._entradas[huella] = (df, indice, tamano)
+            self.memoria_usada += tamano
+            while self.memoria_usada > self.limite_bytes:
+                _, (_, _, liberado) = self._entradas.popitem(last=False)
+                self.memoria_usada -= liberado
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+CACHE_INVENTARIOS = CacheInventarios(int(os.environ.get('INVENTARIO_CACHE_MB', '512')) * 1024 * 1024)
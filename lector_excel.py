@@ -0,0 +1,246 @@
+"""Lector en streaming de hojas .xlsx para inventarios grandes
+
+Lee directamente el XML de la primera hoja por bloques, extrae solo las
+columnas pedidas y llena buffers preasignados. Si la hoja no trae las
+referencias de celda que necesita el lector rápido, usa openpyxl en modo
+read_only como respaldo.
+"""
+import html
+import io
+import posixpath
+import re
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+TAMANO_BLOQUE = 8 << 20
+
+_RE_FILA = re.compile(rb'<row\b[^>]*>(.*?)</row>', re.S)
+_RE_CELDA_CUALQUIERA = re.compile(rb'<c r="([A-Z]+)(\d+)"([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+_RE_VALOR = re.compile(rb'<v>([^<]*)</v>')
+_RE_TEXTO = re.compile(rb'<t(?:\s[^>]*)?>([^<]*)</t>')
+_RE_TIPO = re.compile(rb'\bt="(\w+)"')
+_RE_DIMENSION = re.compile(rb'<dimension ref="[A-Z]+\d+(?::[A-Z]+(\d+))?"')
+_RE_SI = re.compile(rb'<si>(.*?)</si>|<si/>', re.S)
+_RE_RPH = re.compile(rb'<rPh\b.*?</rPh>', re.S)
+_RE_HOJA = re.compile(rb'<sheet\b[^>]*?r:id="([^"]+)"')
+_RE_RELACION = re.compile(rb'<Relationship\b[^>]*?>')
+
+
+def _decodificar(valor):
+    texto = valor.decode('utf-8')
+    return html.unescape(texto) if '&' in texto else texto
+
+
+def _texto_rico(contenido):
+    """Concatena los <t> de un string compartido o en línea (texto enriquecido)"""
+    if b'<rPh' in contenido:
+        contenido = _RE_RPH.sub(b'', contenido)
+    return ''.join(_decodificar(t) for t in _RE_TEXTO.findall(contenido))
+
+
+def _numero_como_texto(valor):
+    """Convierte un número de celda a texto igual que pandas con dtype=str"""
+    texto = valor.decode('ascii')
+    if '.' not in texto and 'E' not in texto and 'e' not in texto:
+        return texto
+    numero = float(texto)
+    return str(int(numero)) if numero.is_integer() else repr(numero)
+
+
+def _valor_celda(atributos, contenido, compartidas):
+    tipo = _RE_TIPO.search(atributos)
+    tipo = tipo.group(1) if tipo else b'n'
+    if tipo == b'inlineStr':
+        return _texto_rico(contenido) if contenido else np.nan
+
+    valor = _RE_VALOR.search(contenido) if contenido else None
+    if valor is None:
+        return np.nan
+    valor = valor.group(1)
+
+    if tipo == b's':
+        return compartidas[int(valor)]
+    if tipo == b'n':
+        return _numero_como_texto(valor) if valor else np.nan
+    if tipo == b'b':
+        return 'True' if valor == b'1' else 'False'
+    if tipo == b'e':
+        return np.nan
+    return _decodificar(valor)
+
+
+def _valor_openpyxl(valor):
+    if valor is None:
+        return np.nan
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def _ruta_primera_hoja(libro):
+    with libro.open('xl/workbook.xml') as f:
+        id_hoja = _RE_HOJA.search(f.read()).group(1)
+    with libro.open('xl/_rels/workbook.xml.rels') as f:
+        for relacion in _RE_RELACION.findall(f.read()):
+            if f'Id="{id_hoja.decode()}"'.encode() in relacion:
+                destino = re.search(rb'Target="([^"]+)"', relacion).group(1).decode()
+                if destino.startswith('/'):
+                    return destino.lstrip('/')
+                return posixpath.normpath(posixpath.join('xl', destino))
+    raise ValueError("No se encontró la primera hoja del libro")
+
+
+def _leer_compartidas(libro):
+    if 'xl/sharedStrings.xml' not in libro.namelist():
+        return []
+    with libro.open('xl/sharedStrings.xml') as f:
+        contenido = f.read()
+    return [_texto_rico(si) if si else '' for si in _RE_SI.findall(contenido)]
+
+
+class _Buffers:
+    """Columnas preasignadas que crecen por duplicación si la estimación se queda corta"""
+
+    def __init__(self, nombres, estimado):
+        self.nombres = nombres
+        self.columnas = [np.full(max(estimado, 1), np.nan, dtype=object) for _ in nombres]
+        self.filas = 0
+
+    def nueva_fila(self):
+        if self.filas == len(self.columnas[0]):
+            self.columnas = [
+                np.concatenate([c, np.full(len(c), np.nan, dtype=object)]) for c in self.columnas
+            ]
+        self.filas += 1
+        return self.filas - 1
+
+    def a_dataframe(self):
+        return pd.DataFrame({n: c[:self.filas] for n, c in zip(self.nombres, self.columnas)})
+
+
+def _leer_rapido(libro, columnas, requeridas, progreso):
+    """Lector principal sobre el XML de la hoja
+
+    Devuelve None si no reconoce la estructura (sin filas, encabezado
+    incompleto o ninguna fila de datos) para que openpyxl confirme el resultado.
+    """
+    compartidas = _leer_compartidas(libro)
+
+    with libro.open(_ruta_primera_hoja(libro)) as hoja:
+        datos = b''
+        fila_encabezado = None
+        while fila_encabezado is None:
+            bloque = hoja.read(TAMANO_BLOQUE)
+            datos += bloque
+            fila_encabezado = _RE_FILA.search(datos)
+            if not bloque:
+                break
+        if fila_encabezado is None:
+            return None
+
+        celdas = _RE_CELDA_CUALQUIERA.findall(fila_encabezado.group(1))
+        if not celdas and b'<c' in fila_encabezado.group(1):
+            return None
+
+        encabezado = {}
+        for letra, _, atributos, contenido in celdas:
+            valor = _valor_celda(atributos, contenido, compartidas)
+            if isinstance(valor, str):
+                encabezado.setdefault(valor.strip(), letra.decode())
+        if any(col not in encabezado for col in requeridas):
+            return None
+
+        presentes = [col for col in columnas if col in encabezado]
+        letras = {encabezado[col].encode(): i for i, col in enumerate(presentes)}
+        patron = re.compile(
+            rb'<c r="(' + b'|'.join(letras) + rb')(\d+)"([^>]*?)(?:/>|>(.*?)</c>)', re.S
+        )
+
+        dimension = _RE_DIMENSION.search(datos)
+        estimado = int(dimension.group(1)) if dimension and dimension.group(1) else 0
+        buffers = _Buffers(presentes, estimado)
+
+        datos = datos[fila_encabezado.end():]
+        fila_actual = None
+        posicion = -1
+        while True:
+            bloque = hoja.read(TAMANO_BLOQUE)
+            datos += bloque
+            corte = len(datos) if not bloque else datos.rfind(b'</row>') + len(b'</row>')
+            if corte < len(b'</row>'):
+                continue
+
+            for letra, fila, atributos, contenido in patron.findall(datos, 0, corte):
+                if fila != fila_actual:
+                    fila_actual = fila
+                    posicion = buffers.nueva_fila()
+                buffers.columnas[letras[letra]][posicion] = _valor_celda(atributos, contenido, compartidas)
+
+            datos = datos[corte:]
+            if progreso is not None:
+                progreso(buffers.filas, max(estimado - 1, buffers.filas))
+            if not bloque:
+                break
+
+    if not buffers.filas:
+        return None
+    return buffers.a_dataframe()
+
+
+def _leer_openpyxl(archivo, columnas, requeridas, progreso):
+    """Respaldo con openpyxl en modo read_only, fila por fila"""
+    import openpyxl
+
+    libro = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        hoja = libro.worksheets[0]
+        filas = hoja.iter_rows(values_only=True)
+        encabezado = [str(c).strip() if c is not None else '' for c in next(filas, ())]
+        if any(col not in encabezado for col in requeridas):
+            return pd.DataFrame(columns=[c for c in encabezado if c])
+
+        presentes = [col for col in columnas if col in encabezado]
+        indices = [encabezado.index(col) for col in presentes]
+        estimado = (hoja.max_row or 1) - 1
+        buffers = _Buffers(presentes, estimado)
+
+        for fila in filas:
+            valores = [fila[i] if i < len(fila) else None for i in indices]
+            if all(v is None for v in valores):
+                continue
+            posicion = buffers.nueva_fila()
+            for columna, valor in zip(buffers.columnas, valores):
+                columna[posicion] = _valor_openpyxl(valor)
+            if progreso is not None and buffers.filas % 10000 == 0:
+                progreso(buffers.filas, max(estimado, buffers.filas))
+
+        if progreso is not None:
+            progreso(buffers.filas, buffers.filas)
+        return buffers.a_dataframe()
+    finally:
+        libro.close()
+
+
+def leer_columnas_excel(archivo, columnas, requeridas=(), progreso=None):
+    """Lee solo `columnas` de la primera hoja de un .xlsx como texto
+
+    `archivo` puede ser bytes, una ruta o un objeto tipo archivo. `progreso`,
+    si se pasa, se llama como progreso(filas_leidas, filas_estimadas). Si falta
+    alguna columna de `requeridas` se devuelve un DataFrame vacío con los
+    encabezados del archivo para que quien llama pueda reportarlo.
+    """
+    if isinstance(archivo, (bytes, bytearray)):
+        archivo = io.BytesIO(archivo)
+    if hasattr(archivo, 'seek'):
+        archivo.seek(0)
+
+    with zipfile.ZipFile(archivo) as libro:
+        df = _leer_rapido(libro, list(columnas), list(requeridas), progreso)
+
+    if df is None:
+        if hasattr(archivo, 'seek'):
+            archivo.seek(0)
+        df = _leer_openpyxl(archivo, list(columnas), list(requeridas), progreso)
+    return df
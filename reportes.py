@@ -0,0 +1,393 @@
+"""Reportes del conteo generados en segundo plano
+
+Armar un libro Excel de varias hojas tarda segundos con conteos grandes, y
+hacerlo dentro de la petición bloqueaba la rerun de Streamlit o el event loop de
+FastAPI. `GestorReportes` los manda a un pool de procesos acotado y deja cada
+resultado en disco bajo una clave que incluye la versión del conteo: pedir otra
+vez el mismo reporte sin escaneos nuevos devuelve el archivo ya generado.
+
+Las funciones `escribir_*` corren en el proceso hijo: reciben datos (no el
+estado de la app) y escriben el archivo en `destino`.
+"""
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+from conteo_columnar import ENTERO_NULO, exportar_columnas
+
+FILAS_POR_TANDA_EXCEL = 5000
+# Filas de datos que entran en una hoja de Excel (sin el encabezado)
+MAX_FILAS_HOJA = 1048575
+# Segundos tras los cuales una carpeta de columnas sin pedido en curso se da por abandonada
+ANTIGUEDAD_SNAPSHOT_ABANDONADO = 3600
+# Segundos que un reporte terminado queda en disco para descargarse (desde que se generó o reutilizó)
+VIGENCIA_REPORTES = 3600
+
+# Hojas de cobertura del inventario: columnas de `CoberturaInventario` y sus encabezados
+ENCABEZADOS_PENDIENTES = ['ID Pallet', 'Almacén', 'Código', 'Producto', 'Sistema']
+ENCABEZADOS_COBERTURA = ['Almacén', 'Pallets', 'Contados', 'Pendientes', 'Cobertura (%)']
+
+
+def guardar_columnas(columnas, directorio):
+    """Guarda las columnas como arreglos .npy en una carpeta nueva de `directorio` y devuelve su ruta
+
+    np.save escribe desde el buffer de cada arreglo sin copiarlo: quien tiene el
+    conteo bloqueado lo vuelca a disco y al pool solo viaja la ruta, en lugar de
+    una copia en memoria que además se serializa entera para el proceso hijo.
+    """
+    carpeta = os.path.join(directorio, f".columnas-{uuid.uuid4().hex}")
+    os.makedirs(carpeta)
+    for nombre, arreglo in columnas.items():
+        np.save(os.path.join(carpeta, f'{nombre}.npy'), arreglo)
+    return carpeta
+
+
+def abrir_columnas(carpeta, nombres):
+    """Columnas guardadas con `guardar_columnas`; las numéricas se abren con memory-map"""
+    columnas = {}
+    for nombre in nombres:
+        ruta = os.path.join(carpeta, f'{nombre}.npy')
+        try:
+            columnas[nombre] = np.load(ruta, mmap_mode='r')
+        except ValueError:
+            # Columnas de texto: objetos de Python, no admiten memory-map
+            columnas[nombre] = np.load(ruta, allow_pickle=True)
+    return columnas
+
+
+def escribir_excel_conteo(columnas, tipos, stats, pendientes, almacenes, destino):
+    """Escribe el reporte del conteo con xlsxwriter en modo constant_memory
+
+    Las filas salen por tandas directo de las columnas del conteo, sin armar un
+    DataFrame, así la memoria no crece con el tamaño del reporte. Con inventario
+    cargado agrega los pallets pendientes y la cobertura por almacén. `columnas`
+    es un dict de arreglos o la carpeta de `guardar_columnas`.
+    """
+    if isinstance(columnas, str):
+        columnas = abrir_columnas(columnas, tipos)
+    libro = xlsxwriter.Workbook(destino, {'constant_memory': True})
+    encabezado = libro.add_format({'bold': True, 'border': 1})
+
+    # Hoja principal
+    hoja = libro.add_worksheet('Conteo Completo')
+    hoja.write_row(0, 0, list(columnas), encabezado)
+    total = len(next(iter(columnas.values()))) if columnas else 0
+    fila = 1
+    for inicio in range(0, total, FILAS_POR_TANDA_EXCEL):
+        tanda = []
+        for nombre, valores in columnas.items():
+            valores = valores[inicio:inicio + FILAS_POR_TANDA_EXCEL].tolist()
+            if tipos[nombre] == ENTERO_NULO:
+                valores = [None if v != v else int(v) for v in valores]
+            tanda.append(valores)
+        for valores in zip(*tanda):
+            hoja.write_row(fila, 0, valores)
+            fila += 1
+
+    # Hoja de resumen
+    resumen = libro.add_worksheet('Resumen')
+    resumen.write_row(0, 0, ['Métrica', 'Valor'], encabezado)
+    metricas = [
+        ('Total Pallets', stats['total']), ('Exactos', stats['exactos']), ('Sobrantes', stats['sobrantes']),
+        ('Faltantes', stats['faltantes']), ('No Encontrados', stats['no_encontrados']),
+        ('Precisión (%)', stats['precision'])
+    ]
+    for i, metrica in enumerate(metricas, start=1):
+        resumen.write_row(i, 0, metrica)
+
+    if almacenes is not None:
+        _escribir_hoja(libro, 'Cobertura por Almacén', almacenes, ENCABEZADOS_COBERTURA, encabezado)
+    if pendientes is not None:
+        _escribir_hoja(libro, 'Pendientes', pendientes, ENCABEZADOS_PENDIENTES, encabezado)
+
+    libro.close()
+
+
+def _escribir_hoja(libro, nombre, df, encabezados, formato_encabezado):
+    """Hoja con las filas de un DataFrame, escritas por columnas ya convertidas a listas"""
+    hoja = libro.add_worksheet(nombre)
+    hoja.write_row(0, 0, encabezados, formato_encabezado)
+    df = df.iloc[:MAX_FILAS_HOJA]
+    for fila, valores in enumerate(zip(*(df[c].tolist() for c in df.columns)), start=1):
+        hoja.write_row(fila, 0, valores)
+
+
+def escribir_datos_conteo(columnas, tipos, formato, destino):
+    """Escribe el conteo en CSV, Parquet o JSON Lines (`columnas` como en escribir_excel_conteo)"""
+    if isinstance(columnas, str):
+        columnas = abrir_columnas(columnas, tipos)
+    with open(destino, 'wb') as archivo:
+        for trozo in exportar_columnas(columnas, tipos, formato):
+            archivo.write(trozo)
+
+
+# Hojas del reporte de conciliación: categoría -> (hoja, columnas del conteo, encabezados)
+HOJAS_CONCILIACION = {
+    'discrepancia': ('Discrepancias',
+                     ['numero_tablilla', 'id_pallet', 'almacen', 'codigo_articulo', 'nombre_producto',
+                      'cantidad_contada', 'inv_sistema', 'diferencia'],
+                     ['Tablilla', 'ID Pallet', 'Almacén', 'Código', 'Producto', 'Contado', 'Sistema', 'Diferencia']),
+    'exacto': ('Cantidades Exactas',
+               ['numero_tablilla', 'id_pallet', 'almacen', 'codigo_articulo', 'nombre_producto', 'cantidad_contada'],
+               ['Tablilla', 'ID Pallet', 'Almacén', 'Código', 'Producto', 'Cantidad']),
+    'no_encontrado': ('No Encontrados',
+                      ['numero_tablilla', 'id_pallet', 'almacen', 'cantidad_contada'],
+                      ['Tablilla', 'ID Pallet', 'Almacén', 'Cantidad'])
+}
+
+
+def vistas_conciliacion(conteo):
+    """Registros de cada hoja, tomados de las categorías que el conteo mantiene en cada escaneo
+
+    Corre en el proceso de la app: no cruza con el inventario, así el costo
+    depende del tamaño del conteo y no del inventario.
+    """
+    return {
+        categoria: conteo.vista_categoria(categoria, columnas)
+        for categoria, (_, columnas, _) in HOJAS_CONCILIACION.items()
+    }
+
+
+def escribir_reporte_reconciliacion(vistas, sobrantes, faltantes, pendientes, almacenes, destino):
+    """Reporte de conteo contra sistema: resumen, discrepancias, exactos, no encontrados y pendientes"""
+    exactos = len(vistas['exacto'])
+    encontrados = exactos + len(vistas['discrepancia'])
+
+    with pd.ExcelWriter(destino, engine='openpyxl') as writer:
+        # Hoja de resumen ejecutivo
+        resumen_data = {
+            'Métrica': [
+                'Fecha del Reporte',
+                'Total Pallets Digitados',
+                'Pallets Encontrados en Sistema',
+                'Pallets con Cantidad Exacta',
+                'Pallets con Diferencias',
+                'Pallets NO Encontrados en Sistema',
+                'Precisión del Inventario (%)',
+                'Total Sobrantes',
+                'Total Faltantes'
+            ],
+            'Valor': [
+                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                encontrados + len(vistas['no_encontrado']),
+                encontrados,
+                exactos,
+                len(vistas['discrepancia']),
+                len(vistas['no_encontrado']),
+                round((exactos / encontrados * 100) if encontrados > 0 else 0, 2),
+                sobrantes,
+                faltantes
+            ]
+        }
+        df_resumen = pd.DataFrame(resumen_data)
+        df_resumen.to_excel(writer, sheet_name='Resumen Ejecutivo', index=False)
+
+        # Una hoja por categoría, solo si tiene registros
+        for categoria, (hoja, _, encabezados) in HOJAS_CONCILIACION.items():
+            vista = vistas[categoria]
+            if not vista.empty:
+                vista.columns = encabezados
+                vista.to_excel(writer, sheet_name=hoja, index=False)
+
+        _hojas_cobertura(writer, pendientes, almacenes)
+
+
+def _hojas_cobertura(writer, pendientes, almacenes):
+    """Cobertura por almacén y pallets pendientes (sin inventario cargado llegan en None)"""
+    if almacenes is not None:
+        almacenes.set_axis(ENCABEZADOS_COBERTURA, axis=1).to_excel(
+            writer, sheet_name='Cobertura por Almacén', index=False
+        )
+    if pendientes is not None:
+        pendientes.iloc[:MAX_FILAS_HOJA].set_axis(ENCABEZADOS_PENDIENTES, axis=1).to_excel(
+            writer, sheet_name='Pendientes', index=False
+        )
+
+
+def escribir_reporte_analisis(df_conteo, stats, inicio_sesion, pendientes, almacenes, destino):
+    """Reporte con análisis ejecutivo (KPIs de la sesión), los datos completos del conteo y los pendientes"""
+    with pd.ExcelWriter(destino, engine='xlsxwriter') as writer:
+        workbook = writer.book
+
+        # Formatos profesionales mejorados
+        title_format = workbook.add_format({
+            'bold': True, 'font_size': 18, 'font_color': '#2c3e50',
+            'align': 'center', 'bg_color': '#ecf0f1', 'border': 1
+        })
+
+        header_format = workbook.add_format({
+            'bold': True, 'bg_color': '#3498db', 'font_color': 'white',
+            'border': 1, 'align': 'center', 'font_size': 12
+        })
+
+        # Hoja de resumen ejecutivo mejorado
+        resumen_data = {
+            'KPI': [
+                'Fecha del Análisis', 'Hora de Inicio', 'Duración de Sesión (min)',
+                'Total Pallets Procesados', 'Pallets con Cantidad Exacta',
+                'Pallets con Sobrantes', 'Pallets con Faltantes',
+                'Pallets NO Encontrados', 'Precisión del Inventario (%)',
+                'Eficiencia de Conteo (%)', 'Varianza Total', 'Diferencia Promedio'
+            ],
+            'Valor': [
+                datetime.now().strftime("%Y-%m-%d"),
+                inicio_sesion.strftime("%H:%M:%S"),
+                round((datetime.now() - inicio_sesion).total_seconds() / 60, 1),
+                stats['total'], stats['exactos'], stats['sobrantes'],
+                stats['faltantes'], stats['no_encontrados'],
+                round(stats['precision'], 2), round(stats['efficiency'], 2),
+                round(stats['total_variance'], 2), round(stats['avg_difference'], 2)
+            ]
+        }
+
+        df_resumen = pd.DataFrame(resumen_data)
+        df_resumen.to_excel(writer, sheet_name='Resumen Ejecutivo', index=False, startrow=2)
+
+        ws_resumen = writer.sheets['Resumen Ejecutivo']
+        ws_resumen.write('A1', 'ANÁLISIS EJECUTIVO DE INVENTARIO FÍSICO', title_format)
+        ws_resumen.set_column('A:A', 35)
+        ws_resumen.set_column('B:B', 20)
+
+        # Hoja de datos completos
+        df_conteo.to_excel(writer, sheet_name='Datos Completos', index=False)
+        ws_datos = writer.sheets['Datos Completos']
+
+        # Aplicar formato a headers
+        for col_num, value in enumerate(df_conteo.columns.values):
+            ws_datos.write(0, col_num, value, header_format)
+
+        _hojas_cobertura(writer, pendientes, almacenes)
+
+
+def _generar(funcion, destino, argumentos):
+    """Corre en el proceso hijo: escribe a un temporal y lo publica con un rename atómico"""
+    # Conserva la extensión: pandas elige el formato por ella
+    raiz, extension = os.path.splitext(destino)
+    temporal = f"{raiz}.tmp-{os.getpid()}{extension}"
+    try:
+        funcion(*argumentos, temporal)
+        os.replace(temporal, destino)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return destino
+
+
+class GestorReportes:
+    """Pool de procesos acotado para reportes, con los resultados cacheados en disco por clave
+
+    La clave (p. ej. sesión + versión del conteo + formato) es también el nombre
+    del archivo, así cualquier worker o proceso que comparta el directorio
+    encuentra un reporte ya generado. Un reporte se borra recién cuando pasa
+    `vigencia` segundos sin generarse ni reutilizarse: uno que el cliente ya ve
+    terminado no desaparece antes de que alcance a descargarlo.
+    """
+
+    def __init__(self, directorio, max_procesos=2, vigencia=VIGENCIA_REPORTES):
+        self.directorio = directorio
+        self.max_procesos = max_procesos
+        self.vigencia = vigencia
+        self._pool = None
+        self._lock = threading.RLock()
+        self._futuros = {}
+        self._grupos = {}
+
+    def _ejecutor(self):
+        # Perezoso y con 'spawn': los hijos no heredan hilos ni conexiones del servidor
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_procesos, mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._pool
+
+    def ruta(self, clave):
+        return os.path.join(self.directorio, clave)
+
+    def buscar(self, clave):
+        """Future del reporte si ya está en disco o en curso; None si hay que pedirlo"""
+        ruta = self.ruta(clave)
+        with self._lock:
+            futuro = self._futuros.get(clave)
+            if futuro is not None and not futuro.cancelled():
+                if not futuro.done() or futuro.exception() is None:
+                    return futuro
+            try:
+                # Reutilizarlo renueva su vigencia
+                os.utime(ruta)
+            except OSError:
+                return None
+            futuro = Future()
+            futuro.set_result(ruta)
+            return futuro
+
+    def solicitar(self, clave, funcion, *argumentos, grupo=None):
+        """Encola el reporte (si no está ya hecho o en curso) y devuelve un Future con su ruta
+
+        Al pedir una clave nueva de un `grupo` (p. ej. una sesión) se cancela el
+        pedido anterior del grupo si todavía no empezó: quedó viejo.
+        """
+        with self._lock:
+            futuro = self.buscar(clave)
+            if futuro is not None:
+                return futuro
+
+            if grupo is not None:
+                anterior = self._grupos.get(grupo)
+                if anterior is not None and anterior != clave:
+                    pendiente = self._futuros.get(anterior)
+                    if pendiente is not None and pendiente.cancel():
+                        del self._futuros[anterior]
+
+            os.makedirs(self.directorio, exist_ok=True)
+            futuro = self._ejecutor().submit(_generar, funcion, self.ruta(clave), argumentos)
+            self._futuros[clave] = futuro
+            if grupo is not None:
+                self._grupos[grupo] = clave
+            futuro.add_done_callback(lambda f, clave=clave: self._terminado(clave, f))
+        return futuro
+
+    def estado(self, clave):
+        """'done', 'running', 'pending', 'error' o None si el reporte no existe"""
+        with self._lock:
+            futuro = self._futuros.get(clave)
+            if futuro is not None and not futuro.cancelled():
+                if not futuro.done():
+                    return 'running' if futuro.running() else 'pending'
+                if futuro.exception() is not None:
+                    return 'error'
+        return 'done' if os.path.exists(self.ruta(clave)) else None
+
+    def _terminado(self, clave, futuro):
+        with self._lock:
+            # Los errores se conservan para informarlos; un nuevo pedido los reintenta
+            if self._futuros.get(clave) is futuro and not futuro.cancelled() and futuro.exception() is None:
+                del self._futuros[clave]
+        self._podar()
+
+    def _podar(self):
+        """Borra los reportes vencidos y los snapshots abandonados"""
+        try:
+            entradas = list(os.scandir(self.directorio))
+        except FileNotFoundError:
+            return
+        ahora = time.time()
+        for entrada in entradas:
+            try:
+                antiguedad = ahora - entrada.stat().st_mtime
+                # Carpetas de guardar_columnas que quedaron de un proceso que terminó a mitad de un pedido
+                if entrada.name.startswith('.columnas-') and entrada.is_dir():
+                    if antiguedad > ANTIGUEDAD_SNAPSHOT_ABANDONADO:
+                        shutil.rmtree(entrada.path, ignore_errors=True)
+                elif entrada.is_file() and '.tmp-' not in entrada.name and antiguedad > self.vigencia:
+                    os.remove(entrada.path)
+            except OSError:
+                pass
@@ -0,0 +1,54 @@
+"""Alta de pallets por lote en /add_pallets"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('INVENTARIO_DATA_DIR', tempfile.mkdtemp(prefix='inventario-test-'))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import fastapi_app  # noqa: E402
+
+
+@pytest.fixture
+def cliente():
+    return TestClient(fastapi_app.app)
+
+
+def lote(cliente, sesion, items):
+    return cliente.post('/add_pallets', params={'sesion': sesion}, json={'items': items})
+
+
+def test_lote_valido(cliente):
+    respuesta = lote(cliente, 'lote-valido', [
+        {'numero_tablilla': '1', 'id_pallet': 'L1', 'cantidad_contada': 3},
+        {'numero_tablilla': '1', 'id_pallet': 'L2', 'cantidad_contada': '4'},
+        {'numero_tablilla': '1', 'id_pallet': 'L3', 'cantidad_contada': 5.0}
+    ])
+    assert respuesta.status_code == 200
+    assert respuesta.json()['added'] == 3
+    assert fastapi_app.obtener_sesion('lote-valido').conteo.columna('cantidad_contada').tolist() == [3, 4, 5]
+
+
+@pytest.mark.parametrize('cantidad', [2.7, '2.7', 'abc', True, None])
+def test_cantidad_no_entera_rechaza_el_lote(cliente, cantidad):
+    sesion = f'lote-invalido-{abs(hash(repr(cantidad)))}'
+    respuesta = lote(cliente, sesion, [
+        {'numero_tablilla': '1', 'id_pallet': 'L1', 'cantidad_contada': 3},
+        {'numero_tablilla': '1', 'id_pallet': 'L2', 'cantidad_contada': cantidad}
+    ])
+    assert respuesta.status_code == 422
+    cuerpo = respuesta.json()
+    assert cuerpo['message'].startswith('Pallet #2 inválido')
+    assert [error['fila'] for error in cuerpo['errors']] == [2]
+    assert len(fastapi_app.obtener_sesion(sesion).conteo) == 0
+
+
+def test_campos_faltantes(cliente):
+    respuesta = lote(cliente, 'lote-incompleto', [{'numero_tablilla': '1', 'cantidad_contada': 1},
+                                                  {'numero_tablilla': '1', 'id_pallet': ' ', 'cantidad_contada': 1}])
+    assert respuesta.status_code == 422
+    assert [error['fila'] for error in respuesta.json()['errors']] == [1, 2]
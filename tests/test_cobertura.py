@@ -0,0 +1,68 @@
+"""Cobertura del inventario: referencias por fila mantenidas en cada cambio del conteo"""
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conteo_columnar import ConteoColumnar  # noqa: E402
+from inventario_core import IndiceInventario  # noqa: E402
+
+
+def indice():
+    return IndiceInventario(pd.DataFrame({
+        'Id de pallet': ['P1', 'P2', 'P3', 'p1', 'P4'],
+        'Inventario físico': [1, 2, 3, 9, 4],
+        'Almacén': ['A', 'A', 'B', 'A', 'B'],
+        'Código de artículo': 'C',
+        'Nombre del producto': 'N'
+    }))
+
+
+def pendientes(cobertura):
+    return cobertura.vista_pendientes()['id_pallet'].tolist()
+
+
+def test_referencias_por_registro():
+    conteo = ConteoColumnar()
+    cobertura = conteo.cobertura_de(indice())
+    # La fila repetida de P1 no cuenta como pallet aparte
+    assert cobertura.resumen() == {'total': 4, 'contados': 0, 'pendientes': 4, 'cobertura': 0}
+
+    conteo.agregar({'id_pallet': ' p1 ', 'cantidad_contada': 1})
+    conteo.agregar({'id_pallet': 'P1', 'cantidad_contada': 1}, politica='ambos')
+    conteo.agregar({'id_pallet': 'NOPE', 'cantidad_contada': 1})
+    assert pendientes(cobertura) == ['P2', 'P3', 'P4']
+
+    # Con dos registros de P1, borrar uno no lo devuelve a pendientes
+    conteo.eliminar(0)
+    assert pendientes(cobertura) == ['P2', 'P3', 'P4']
+    conteo.eliminar(conteo.posiciones_de('P1')[0])
+    assert pendientes(cobertura) == ['P1', 'P2', 'P3', 'P4']
+
+
+def test_edicion_de_id_y_limpieza():
+    conteo = ConteoColumnar()
+    conteo.agregar({'id_pallet': 'P2', 'cantidad_contada': 1})
+    cobertura = conteo.cobertura_de(indice())
+    assert pendientes(cobertura) == ['P1', 'P3', 'P4']
+
+    conteo.actualizar(0, {'id_pallet': 'P3'})
+    assert pendientes(cobertura) == ['P1', 'P2', 'P4']
+    por_almacen = cobertura.cobertura_por_almacen().set_index('almacen')
+    assert por_almacen.loc['A', ['total', 'contados', 'pendientes']].tolist() == [2, 0, 2]
+    assert por_almacen.loc['B', ['total', 'contados', 'cobertura']].tolist() == [2, 1, 50.0]
+    assert cobertura.pendientes('B').tolist() == [4]
+
+    conteo.limpiar()
+    assert cobertura.resumen()['contados'] == 0
+
+
+def test_cobertura_nueva_al_cambiar_el_inventario():
+    conteo = ConteoColumnar()
+    conteo.agregar({'id_pallet': 'P4', 'cantidad_contada': 1})
+    primera = conteo.cobertura_de(indice())
+    segunda = conteo.cobertura_de(indice())
+    assert segunda is not primera
+    assert pendientes(segunda) == ['P1', 'P2', 'P3']
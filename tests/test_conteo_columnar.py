@@ -0,0 +1,125 @@
+"""Conteo columnar: políticas de duplicados, estadísticas acumuladas y búsqueda"""
+import os
+import random
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conteo_columnar import ConteoColumnar  # noqa: E402
+
+
+def escaneo(id_pallet, cantidad, inv_sistema=10, tablilla='T1', hora='08:00'):
+    return {'numero_tablilla': tablilla, 'id_pallet': id_pallet, 'cantidad_contada': cantidad,
+            'inv_sistema': inv_sistema, 'diferencia': cantidad - inv_sistema, 'almacen': 'A',
+            'timestamp': hora}
+
+
+def conteo_con_primer_escaneo():
+    conteo = ConteoColumnar()
+    conteo.agregar(escaneo('P1', 4))
+    return conteo
+
+
+def test_politica_ambos():
+    conteo = conteo_con_primer_escaneo()
+    assert conteo.agregar(escaneo(' p1', 3, tablilla='T2'), 'ambos') == ('agregado', 1)
+    assert conteo.posiciones_de('P1') == [0, 1]
+    assert conteo.columna('diferencia').tolist() == [-6, -7]
+
+
+def test_politica_rechazar():
+    conteo = conteo_con_primer_escaneo()
+    assert conteo.agregar(escaneo('P1', 3), 'rechazar') == ('rechazado', 0)
+    assert len(conteo) == 1
+    assert conteo[0]['cantidad_contada'] == 4
+
+
+def test_politica_reemplazar():
+    conteo = conteo_con_primer_escaneo()
+    assert conteo.agregar(escaneo('P1 ', 3, tablilla='T2', hora='09:00'), 'reemplazar') == ('reemplazado', 0)
+    assert len(conteo) == 1
+    registro = conteo[0]
+    assert (registro['numero_tablilla'], registro['cantidad_contada'], registro['timestamp']) == ('T2', 3, '09:00')
+    assert registro['diferencia'] == -7
+
+
+def test_politica_sumar_conserva_el_primer_escaneo():
+    conteo = conteo_con_primer_escaneo()
+    nuevo = dict(escaneo(' p1 ', 3, inv_sistema=12, tablilla='T2', hora='09:00'), almacen='B')
+    assert conteo.agregar(nuevo, 'sumar') == ('sumado', 0)
+    registro = conteo[0]
+    # Identidad del primer escaneo; cantidad sumada y datos de inventario del último
+    assert (registro['id_pallet'], registro['numero_tablilla'], registro['timestamp']) == ('P1', 'T1', '08:00')
+    assert (registro['cantidad_contada'], registro['inv_sistema'], registro['diferencia']) == (7, 12, -5)
+    assert registro['almacen'] == 'B'
+    assert conteo.estadisticas.total == 1 and conteo.estadisticas.faltantes == 1
+
+
+def test_politica_desconocida():
+    with pytest.raises(ValueError):
+        ConteoColumnar().agregar(escaneo('P1', 1), 'ignorar')
+
+
+def test_estadisticas_igual_que_pandas_tras_altas_ediciones_y_bajas():
+    aleatorio = random.Random(3)
+    conteo = ConteoColumnar()
+    for paso in range(600):
+        accion = aleatorio.random()
+        if accion < 0.6 or not len(conteo):
+            inv = None if aleatorio.random() < 0.1 else aleatorio.randrange(10)
+            cantidad = aleatorio.randrange(10)
+            conteo.agregar({'id_pallet': f'P{aleatorio.randrange(50)}', 'cantidad_contada': cantidad,
+                            'inv_sistema': inv, 'diferencia': cantidad - (inv or 0)},
+                           aleatorio.choice(['ambos', 'sumar', 'reemplazar', 'rechazar']))
+        elif accion < 0.8:
+            conteo.actualizar(aleatorio.randrange(len(conteo)), {'diferencia': aleatorio.randrange(-5, 5)})
+        elif accion < 0.97:
+            conteo.eliminar(aleatorio.randrange(len(conteo)))
+        else:
+            conteo.limpiar()
+
+        diferencias = pd.Series(conteo.columna('diferencia'))
+        stats = conteo.estadisticas
+        assert stats.total == len(conteo)
+        assert stats.exactos == int((diferencias == 0).sum())
+        assert stats.sobrantes == int((diferencias > 0).sum())
+        assert stats.faltantes == int((diferencias < 0).sum())
+        assert stats.no_encontrados == int(np.isnan(conteo.columna('inv_sistema')).sum())
+        if len(conteo) > 1:
+            assert stats.media == pytest.approx(diferencias.mean())
+            assert stats.varianza == pytest.approx(diferencias.var())
+
+
+def test_filtrar_igual_que_buscar_subcadenas():
+    aleatorio = random.Random(5)
+    nombres = ['Leche Entera', 'Café Molido', 'Azúcar', 'Harina de Trigo', None]
+    conteo = ConteoColumnar()
+
+    def esperado(texto):
+        texto = texto.lower()
+        return [i for i, registro in enumerate(conteo.registros())
+                if any(texto in str(registro[nombre]).lower()
+                       for nombre in ConteoColumnar.COLUMNAS_BUSQUEDA if registro[nombre] is not None)]
+
+    for paso in range(400):
+        accion = aleatorio.random()
+        if accion < 0.6 or not len(conteo):
+            conteo.agregar({'id_pallet': f'PLT{aleatorio.randrange(300):04d}', 'cantidad_contada': 1,
+                            'nombre_producto': aleatorio.choice(nombres), 'almacen': aleatorio.choice('ABC'),
+                            'numero_tablilla': f'T{aleatorio.randrange(20)}'},
+                           aleatorio.choice(['ambos', 'sumar', 'reemplazar']))
+        elif accion < 0.8:
+            conteo.actualizar(aleatorio.randrange(len(conteo)), {'nombre_producto': aleatorio.choice(nombres)})
+        elif accion < 0.98:
+            conteo.eliminar(aleatorio.randrange(len(conteo)))
+        else:
+            conteo.limpiar()
+
+        if paso % 20 == 0:
+            for texto in ['plt01', 'ca', 'café', 'TRIGO', 'T1', 'b', 'no existe']:
+                assert conteo.filtrar(texto).tolist() == esperado(texto)
+    assert conteo.filtrar('').tolist() == list(range(len(conteo)))
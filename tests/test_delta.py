@@ -0,0 +1,104 @@
+"""Delta del inventario: el índice parcheado responde igual que uno reconstruido"""
+import os
+import random
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import inventario_core  # noqa: E402
+from inventario_core import IndiceInventario, aplicar_delta, calcular_delta  # noqa: E402
+
+
+def inventario(filas):
+    return pd.DataFrame(filas, columns=['Id de pallet', 'Inventario físico', 'Almacén',
+                                        'Código de artículo', 'Nombre del producto'])
+
+
+def fila(id_pallet, cantidad, almacen='A'):
+    return [id_pallet, cantidad, almacen, f'ART-{id_pallet}', f'Producto {id_pallet}']
+
+
+def equivalentes(parcheado, reconstruido, consultas):
+    assert len(parcheado) == len(reconstruido)
+    assert parcheado.ids_ordenados.tolist() == reconstruido.ids_ordenados.tolist()
+    for consulta in consultas:
+        assert parcheado.buscar(consulta) == reconstruido.buscar(consulta)
+        assert parcheado.similares(consulta) == reconstruido.similares(consulta)
+        assert parcheado.sugerir(consulta[:3]) == reconstruido.sugerir(consulta[:3])
+
+
+def test_altas_bajas_y_cambios():
+    base = inventario([fila('P1', 10), fila('P2', 5), fila('P3', 7), fila('Q9', 1)])
+    nuevo = inventario([fila('P1', 10), fila('P2', 8, 'B'), fila('P4', 3), fila('PX12', 2)])
+    indice = IndiceInventario(base)
+
+    cambios = calcular_delta(indice, nuevo)
+    assert sorted(cambios['insertados']) == ['P4', 'PX12']
+    assert list(cambios['actualizados']) == ['P2']
+    assert sorted(cambios['eliminados']) == ['P3', 'Q9']
+
+    parcheado = aplicar_delta(indice, nuevo, cambios)
+    # Las filas existentes no se corren: las altas van al final
+    assert parcheado.posicion('P1') == indice.posicion('P1')
+    assert parcheado.posicion('P4') == 4
+    assert parcheado.eliminadas == 2
+    assert parcheado.buscar('p3') == {'found': False}
+    assert parcheado.buscar('P2')['almacen'] == 'B'
+    assert parcheado.df['Id de pallet'].tolist() == ['P1', 'P2', 'P4', 'PX12']
+    # El índice original, compartido con otros lectores, queda igual
+    assert indice.buscar('P3')['inv_sistema'] == 7
+
+    equivalentes(parcheado, IndiceInventario(nuevo), ['P1', 'P2', 'P3', 'P4', 'PX1', 'Q9', 'P'])
+
+
+def test_deltas_sucesivos_aleatorios():
+    aleatorio = random.Random(7)
+    actuales = {f'PLT{i:05d}': aleatorio.randrange(20) for i in range(300)}
+    indice = IndiceInventario(inventario([fila(i, c) for i, c in actuales.items()]))
+    for _ in range(15):
+        for id_pallet in aleatorio.sample(sorted(actuales), 20):
+            del actuales[id_pallet]
+        for id_pallet in aleatorio.sample(sorted(actuales), 20):
+            actuales[id_pallet] += 1
+        for _ in range(25):
+            actuales[f'N{aleatorio.randrange(10 ** 6):06d}'] = aleatorio.randrange(20)
+        nuevo = inventario([fila(i, c) for i, c in actuales.items()])
+        indice = aplicar_delta(indice, nuevo, calcular_delta(indice, nuevo))
+
+        consultas = aleatorio.sample(sorted(actuales), 10) + ['PLT0001X', 'N12345', 'ZZZ']
+        equivalentes(indice, IndiceInventario(nuevo), consultas)
+
+
+def test_compacta_con_muchas_bajas(monkeypatch):
+    monkeypatch.setattr(inventario_core, 'MIN_BAJAS_COMPACTAR', 2)
+    base = inventario([fila(f'P{i}', i) for i in range(10)])
+    indice = IndiceInventario(base)
+
+    pocas = inventario([fila(f'P{i}', i) for i in range(8)])
+    indice = aplicar_delta(indice, pocas, calcular_delta(indice, pocas))
+    assert indice.eliminadas == 2 and indice.total_filas == 10
+
+    muchas = inventario([fila(f'P{i}', i) for i in range(4)])
+    indice = aplicar_delta(indice, muchas, calcular_delta(indice, muchas))
+    assert indice.eliminadas == 0 and indice.total_filas == 4
+    assert indice.posicion('P3') == 3
+
+
+def test_delta_sobre_snapshot(tmp_path):
+    base = inventario([fila('P1', 1), fila('P2', 2), fila('P3', 3)])
+    IndiceInventario(base).guardar_snapshot(str(tmp_path / 'snap'))
+    abierto = IndiceInventario.desde_snapshot(str(tmp_path / 'snap'))
+
+    nuevo = inventario([fila('P1', 1), fila('P3', 4), fila('P5', 5)])
+    parcheado = aplicar_delta(abierto, nuevo, calcular_delta(abierto, nuevo))
+    equivalentes(parcheado, IndiceInventario(nuevo), ['P1', 'P2', 'P3', 'P5', 'P4'])
+
+    # Las bajas viajan en el snapshot
+    parcheado.guardar_snapshot(str(tmp_path / 'snap'))
+    reabierto = IndiceInventario.desde_snapshot(str(tmp_path / 'snap'))
+    assert len(reabierto) == 3
+    assert reabierto.df['Id de pallet'].tolist() == ['P1', 'P3', 'P5']
+    assert np.asarray(reabierto.inv_sistema).tolist() == [1, 2, 4, 5]
@@ -0,0 +1,81 @@
+"""Bitácora del conteo: reproducción al arrancar y compactación en las limpiezas"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conteo_columnar import ConteoColumnar  # noqa: E402
+from estado_compartido import EstadoCompartido  # noqa: E402
+
+
+def escaneo(id_pallet, cantidad, inv_sistema=10):
+    return {'numero_tablilla': 'T1', 'id_pallet': id_pallet, 'cantidad_contada': cantidad,
+            'inv_sistema': inv_sistema, 'diferencia': cantidad - inv_sistema, 'timestamp': '08:00'}
+
+
+def conteo_en(estado, canal=''):
+    return ConteoColumnar(bitacora=lambda tipo, datos: estado.registrar(tipo, datos, canal))
+
+
+def reproducir(estado, canal=''):
+    conteo = ConteoColumnar()
+    for _, tipo, datos in estado.eventos_desde(0, canal):
+        conteo.aplicar_evento(tipo, datos)
+    return conteo
+
+
+def test_reproducir_la_bitacora_reconstruye_el_conteo(tmp_path):
+    ruta = str(tmp_path / 'estado.db')
+    estado = EstadoCompartido(ruta)
+    conteo = conteo_en(estado)
+    conteo.agregar(escaneo('P1', 4))
+    conteo.agregar(escaneo('P2', 7))
+    conteo.agregar(escaneo('p1', 3), 'sumar')
+    conteo.actualizar(1, {'cantidad_contada': 8, 'diferencia': -2})
+    conteo.agregar(escaneo('P3', 1))
+    conteo.eliminar(0)
+
+    # Otra instancia (un worker nuevo o un reinicio) lee lo mismo desde disco
+    otro = EstadoCompartido(ruta)
+    eventos = otro.eventos_desde(0)
+    seqs = [seq for seq, _, _ in eventos]
+    assert seqs == sorted(seqs) and len(seqs) == 6
+    assert [tipo for _, tipo, _ in eventos] == ['alta', 'alta', 'alta', 'actualizar', 'alta', 'eliminar']
+    assert otro.eventos_desde(seqs[-1]) == []
+
+    reconstruido = reproducir(otro)
+    assert reconstruido.registros() == conteo.registros()
+    assert [r['id_pallet'] for r in reconstruido.registros()] == ['P2', 'P3']
+    assert reconstruido[0]['cantidad_contada'] == 8
+    assert sorted(otro.ids_registrados()) == ['P1', 'P2', 'P3', 'p1']
+
+
+def test_limpiar_compacta_solo_su_canal(tmp_path):
+    estado = EstadoCompartido(str(tmp_path / 'estado.db'))
+    pasillo = conteo_en(estado, 'pasillo-3')
+    otro = conteo_en(estado, 'pasillo-4')
+    pasillo.agregar(escaneo('P1', 4))
+    estado.registrar('politica', {'politica': 'sumar'}, 'pasillo-3')
+    otro.agregar(escaneo('P9', 2))
+    pasillo.agregar(escaneo('P2', 5))
+
+    pasillo.limpiar()
+    pasillo.agregar(escaneo('P3', 6))
+
+    assert [tipo for _, tipo, _ in estado.eventos_desde(0, 'pasillo-3')] == ['politica', 'limpiar', 'alta']
+    assert [tipo for _, tipo, _ in estado.eventos_desde(0, 'pasillo-4')] == ['alta']
+    assert [r['id_pallet'] for r in reproducir(estado, 'pasillo-3').registros()] == ['P3']
+    assert [r['id_pallet'] for r in reproducir(estado, 'pasillo-4').registros()] == ['P9']
+    assert sorted(estado.canales()) == ['pasillo-3', 'pasillo-4']
+
+
+def test_registrar_lote_es_todo_o_nada(tmp_path):
+    estado = EstadoCompartido(str(tmp_path / 'estado.db'))
+    seqs = estado.registrar_lote([('alta', escaneo('P1', 1)), ('alta', escaneo('P2', 2))])
+    assert len(seqs) == 2 and seqs[0] < seqs[1]
+
+    with pytest.raises(Exception):
+        estado.registrar_lote([('alta', escaneo('P3', 3)), (None, escaneo('P4', 4))])
+    assert [datos['id_pallet'] for _, _, datos in estado.eventos_desde(0)] == ['P1', 'P2']
@@ -0,0 +1,70 @@
+"""Lector en streaming de .xlsx y su respaldo con openpyxl"""
+import io
+import os
+import sys
+import zipfile
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lector_excel import leer_columnas_excel  # noqa: E402
+
+COLUMNAS = ['Id de pallet', 'Inventario físico']
+
+HOJA_CON_PREFIJO = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<x:worksheet xmlns:x="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<x:sheetData>'
+    '<x:row r="1">'
+    '<x:c r="A1" t="inlineStr"><x:is><x:t>Id de pallet</x:t></x:is></x:c>'
+    '<x:c r="B1" t="inlineStr"><x:is><x:t>Inventario físico</x:t></x:is></x:c>'
+    '</x:row>'
+    '<x:row r="2">'
+    '<x:c r="A2" t="inlineStr"><x:is><x:t>P1</x:t></x:is></x:c>'
+    '<x:c r="B2"><x:v>10</x:v></x:c>'
+    '</x:row>'
+    '<x:row r="3">'
+    '<x:c r="A3" t="inlineStr"><x:is><x:t>P2</x:t></x:is></x:c>'
+    '<x:c r="B3"><x:v>3</x:v></x:c>'
+    '</x:row>'
+    '</x:sheetData>'
+    '</x:worksheet>'
+)
+
+
+def libro_base():
+    salida = io.BytesIO()
+    pd.DataFrame({'Id de pallet': ['X'], 'Inventario físico': [0]}).to_excel(salida, index=False)
+    return salida.getvalue()
+
+
+def reemplazar_hoja(contenido, xml):
+    salida = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(contenido)) as origen, \
+            zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as destino:
+        for item in origen.infolist():
+            datos = origen.read(item.filename)
+            if item.filename == 'xl/worksheets/sheet1.xml':
+                datos = xml.encode('utf-8')
+            destino.writestr(item, datos)
+    return salida.getvalue()
+
+
+def test_lectura_rapida():
+    df = leer_columnas_excel(libro_base(), COLUMNAS, COLUMNAS)
+    assert df.to_dict('list') == {'Id de pallet': ['X'], 'Inventario físico': ['0']}
+
+
+def test_hoja_con_prefijo_de_namespace_usa_openpyxl():
+    contenido = reemplazar_hoja(libro_base(), HOJA_CON_PREFIJO)
+    df = leer_columnas_excel(contenido, COLUMNAS, COLUMNAS)
+    assert df.to_dict('list') == {'Id de pallet': ['P1', 'P2'], 'Inventario físico': ['10', '3']}
+
+
+def test_faltan_columnas_requeridas():
+    salida = io.BytesIO()
+    pd.DataFrame({'Otra': ['a']}).to_excel(salida, index=False)
+    df = leer_columnas_excel(salida.getvalue(), COLUMNAS, COLUMNAS)
+    assert df.empty
+    assert list(df.columns) == ['Otra']
@@ -0,0 +1,87 @@
+"""Recálculo del conteo al cargar un delta del inventario"""
+import io
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['INVENTARIO_DATA_DIR'] = tempfile.mkdtemp(prefix='inventario-test-')
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import fastapi_app  # noqa: E402
+
+
+def inventario_xlsx(cantidades):
+    df = pd.DataFrame({
+        'Id de pallet': list(cantidades),
+        'Inventario físico': list(cantidades.values()),
+        'Almacén': 'A-1',
+        'Código de artículo': 'ART',
+        'Nombre del producto': 'Producto'
+    })
+    salida = io.BytesIO()
+    df.to_excel(salida, index=False)
+    return salida.getvalue()
+
+
+def cargar(cliente, contenido, delta=False):
+    respuesta = cliente.post('/upload_inventory', files={'file': ('inventario.xlsx', contenido)},
+                             data={'delta': str(delta).lower()}).json()
+    while respuesta.get('status') in ('pending', 'running'):
+        time.sleep(0.05)
+        respuesta = cliente.get(f"/jobs/{respuesta.get('job_id') or respuesta['id']}").json()
+    assert respuesta['status'] == 'done', respuesta
+    return respuesta
+
+
+@pytest.fixture
+def cliente():
+    return TestClient(fastapi_app.app)
+
+
+def test_delta_recalcula_diferencia_de_cada_registro(cliente):
+    cargar(cliente, inventario_xlsx({'P1': 10, 'P2': 3}))
+    sesion = 'delta-duplicados'
+    cliente.post('/duplicate_policy', params={'sesion': sesion}, data={'politica': 'ambos'})
+    for cantidad in (5, 2):
+        cliente.post('/add_pallet', params={'sesion': sesion},
+                     data={'numero_tablilla': '1', 'id_pallet': 'P1', 'cantidad_contada': str(cantidad)})
+
+    cargar(cliente, inventario_xlsx({'P1': 4, 'P2': 3}), delta=True)
+
+    conteo = fastapi_app.obtener_sesion(sesion).conteo
+    assert conteo.columna('cantidad_contada').tolist() == [5, 2]
+    assert conteo.columna('inv_sistema').tolist() == [4, 4]
+    assert conteo.columna('diferencia').tolist() == [1, -2]
+    assert conteo.estadisticas.sobrantes == 1
+    assert conteo.estadisticas.faltantes == 1
+    assert conteo.totales_categoria()['discrepancia'] == 2
+
+
+def test_delta_solo_reconstruye_sesiones_con_pallets_afectados(cliente, monkeypatch):
+    cargar(cliente, inventario_xlsx({'R1': 10, 'R2': 3}))
+    for sesion, id_pallet in (('expulsada-r1', 'R1'), ('expulsada-r2', 'R2')):
+        cliente.post('/add_pallet', params={'sesion': sesion},
+                     data={'numero_tablilla': '1', 'id_pallet': id_pallet, 'cantidad_contada': '4'})
+        del fastapi_app.SESIONES[sesion]
+
+    reconstruidas = []
+    sincronizar = fastapi_app.SesionConteo.sincronizar
+
+    def registrar_reconstruccion(sesion):
+        reconstruidas.append(sesion.nombre)
+        return sincronizar(sesion)
+
+    monkeypatch.setattr(fastapi_app.SesionConteo, 'sincronizar', registrar_reconstruccion)
+    respuesta = cargar(cliente, inventario_xlsx({'R1': 6, 'R2': 3}), delta=True)
+    monkeypatch.undo()
+
+    assert 'expulsada-r1' in reconstruidas
+    assert 'expulsada-r2' not in reconstruidas
+    assert respuesta['delta']['conteos_recalculados'] == 1
+    assert fastapi_app.obtener_sesion('expulsada-r1').conteo.columna('diferencia').tolist() == [-2]
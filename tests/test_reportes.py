@@ -0,0 +1,92 @@
+"""Reportes en el pool de procesos: ciclo de vida del pedido, caché en disco y poda"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportes import (  # noqa: E402
+    GestorReportes, abrir_columnas, escribir_datos_conteo, guardar_columnas
+)
+
+TIPOS = {'id_pallet': object, 'cantidad_contada': np.int64}
+
+
+def columnas():
+    return {'id_pallet': np.array(['P1', 'P2'], dtype=object), 'cantidad_contada': np.array([3, 4])}
+
+
+@pytest.fixture
+def gestor(tmp_path):
+    gestor = GestorReportes(str(tmp_path / 'reportes'), max_procesos=1)
+    yield gestor
+    if gestor._pool is not None:
+        gestor._pool.shutdown()
+
+
+def test_pedido_terminado_y_reutilizado(gestor):
+    futuro = gestor.solicitar('s-1.csv', escribir_datos_conteo, columnas(), TIPOS, 'csv')
+    ruta = futuro.result(60)
+    assert gestor.estado('s-1.csv') == 'done'
+    assert pd.read_csv(ruta)['cantidad_contada'].tolist() == [3, 4]
+
+    # Otro gestor (otro worker) sobre el mismo directorio lo encuentra en disco
+    otro = GestorReportes(gestor.directorio)
+    reutilizado = otro.buscar('s-1.csv')
+    assert reutilizado.done() and reutilizado.result() == ruta
+    assert otro.buscar('s-2.csv') is None
+    assert otro.estado('s-2.csv') is None
+
+
+def test_error_se_informa_y_se_reintenta(gestor):
+    futuro = gestor.solicitar('s-1.xyz', escribir_datos_conteo, columnas(), TIPOS, 'xyz')
+    with pytest.raises(Exception):
+        futuro.result(60)
+    assert gestor.estado('s-1.xyz') == 'error'
+    assert not os.listdir(gestor.directorio)
+
+    # Un pedido nuevo con la misma clave vuelve a intentarlo
+    reintento = gestor.solicitar('s-1.xyz', escribir_datos_conteo, columnas(), TIPOS, 'csv')
+    assert reintento is not futuro
+    reintento.result(60)
+    assert gestor.estado('s-1.xyz') == 'done'
+
+
+def test_columnas_desde_snapshot(gestor):
+    carpeta = guardar_columnas(columnas(), gestor.directorio)
+    abiertas = abrir_columnas(carpeta, TIPOS)
+    assert abiertas['id_pallet'].tolist() == ['P1', 'P2']
+    assert isinstance(abiertas['cantidad_contada'], np.memmap)
+
+    ruta = gestor.solicitar('s-2.csv', escribir_datos_conteo, carpeta, TIPOS, 'csv').result(60)
+    assert pd.read_csv(ruta)['id_pallet'].tolist() == ['P1', 'P2']
+
+
+def test_poda_por_vigencia(gestor):
+    os.makedirs(gestor.directorio)
+    viejo, reutilizado, abandonada = (os.path.join(gestor.directorio, nombre)
+                                      for nombre in ('viejo.csv', 'reutilizado.csv', '.columnas-x'))
+    for ruta in (viejo, reutilizado):
+        with open(ruta, 'w') as archivo:
+            archivo.write('id\n')
+    os.makedirs(abandonada)
+    hace_dos_horas = time.time() - 7200
+    for ruta in (viejo, reutilizado, abandonada):
+        os.utime(ruta, (hace_dos_horas, hace_dos_horas))
+
+    # Muchos reportes recientes no desplazan a uno terminado que no venció
+    for i in range(30):
+        gestor.solicitar(f'r-{i}.csv', escribir_datos_conteo, columnas(), TIPOS, 'csv')
+    assert gestor.buscar('reutilizado.csv') is not None
+    gestor.solicitar('r-30.csv', escribir_datos_conteo, columnas(), TIPOS, 'csv').result(60)
+    gestor._podar()
+
+    restantes = set(os.listdir(gestor.directorio))
+    assert {f'r-{i}.csv' for i in range(31)} <= restantes
+    assert 'reutilizado.csv' in restantes
+    assert 'viejo.csv' not in restantes
+    assert '.columnas-x' not in restantes
@@ -0,0 +1,49 @@
+"""Sugerencias "¿quisiste decir?" sobre el índice de trigramas del inventario"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inventario_core import IndiceDifuso, IndiceInventario, distancia_edicion  # noqa: E402
+
+
+def indice(ids):
+    return IndiceInventario(pd.DataFrame({
+        'Id de pallet': ids,
+        'Inventario físico': range(len(ids)),
+        'Almacén': 'A',
+        'Código de artículo': 'C',
+        'Nombre del producto': 'N'
+    }))
+
+
+def test_distancia_edicion():
+    assert distancia_edicion('PLT001', 'PLT001') == 0
+    assert distancia_edicion('PLT001', 'PLT01') == 1
+    assert distancia_edicion('PLT001', 'PTL001') == 2
+    # Corta apenas supera el máximo
+    assert distancia_edicion('PLT001', 'XYZ999', maximo=2) == 3
+
+
+def test_sugiere_los_mas_cercanos_en_orden():
+    inventario = indice(['PLT001', 'PLT002', 'PLT010', 'ABC123', 'plt1000'])
+    sugerencias = inventario.similares(' plt00l ')
+    assert [(s['id_pallet'], s['distancia']) for s in sugerencias] == [('PLT001', 1), ('PLT002', 1), ('PLT010', 2)]
+    assert sugerencias[0]['inv_sistema'] == 0
+    assert [s['id_pallet'] for s in inventario.similares('PLT00', limite=1)] == ['PLT001']
+
+
+def test_sin_coincidencia_exacta_ni_lejanas():
+    inventario = indice(['PLT001', 'ABC123'])
+    # El ID exacto no es una sugerencia; uno muy distinto tampoco
+    assert [s['id_pallet'] for s in inventario.similares('PLT001')] == []
+    assert inventario.similares('ZZZZZZZZ') == []
+    assert inventario.similares('') == []
+
+
+def test_indice_vacio():
+    difuso = IndiceDifuso(np.array([], dtype=str))
+    assert difuso.similares('PLT001') == []
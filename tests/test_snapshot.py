@@ -0,0 +1,67 @@
+"""Snapshot del inventario: arreglos .npy abiertos con memory-map y bloqueo entre procesos"""
+import os
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inventario_core import ColumnaTexto, IndiceInventario, bloqueo_snapshot  # noqa: E402
+
+
+def inventario():
+    return pd.DataFrame({
+        'Id de pallet': ['P1', ' p2 ', 'Ñ3', 'P1'],
+        'Inventario físico': [5, '7', None, 9],
+        'Almacén': ['A', 'B', 'Almacén Ñ', 'A'],
+        'Código de artículo': ['C1', 'C2', 'C3', 'C4'],
+        'Nombre del producto': ['Uno', 'Dos', 'Tres', 'Cuatro']
+    })
+
+
+def test_snapshot_responde_igual_que_el_indice(tmp_path):
+    directorio = str(tmp_path / 'snapshot')
+    original = IndiceInventario(inventario())
+    marca = original.guardar_snapshot(directorio)
+
+    abierto = IndiceInventario.desde_snapshot(directorio)
+    assert abierto.marca == marca == IndiceInventario.marca_snapshot(directorio)
+    assert abierto.identificador == original.identificador
+    assert isinstance(abierto.inv_sistema, np.memmap)
+    assert isinstance(abierto.almacen, ColumnaTexto)
+    assert len(abierto) == len(original)
+    for consulta in ['p1', 'P2', 'ñ3', 'P9', '']:
+        assert abierto.buscar(consulta) == original.buscar(consulta)
+        assert abierto.similares(consulta) == original.similares(consulta)
+    assert abierto.sugerir('P') == original.sugerir('P')
+    assert abierto.df['Almacén'].tolist() == ['A', 'B', 'Almacén Ñ', 'A']
+
+
+def test_reemplazo_cambia_la_marca(tmp_path):
+    directorio = str(tmp_path / 'snapshot')
+    assert IndiceInventario.desde_snapshot(directorio) is None
+    assert IndiceInventario.marca_snapshot(directorio) is None
+
+    primera = IndiceInventario(inventario()).guardar_snapshot(directorio)
+    otro = IndiceInventario(inventario().iloc[:2])
+    segunda = otro.guardar_snapshot(directorio)
+    assert segunda != primera
+    assert len(IndiceInventario.desde_snapshot(directorio)) == 2
+    # Del snapshot anterior no queda nada al lado
+    assert sorted(os.listdir(tmp_path)) == ['.snapshot.lock', 'snapshot']
+
+
+def test_abrir_espera_a_que_termine_la_escritura(tmp_path):
+    directorio = str(tmp_path / 'snapshot')
+    IndiceInventario(inventario()).guardar_snapshot(directorio)
+    abiertos = []
+    lector = threading.Thread(target=lambda: abiertos.append(IndiceInventario.desde_snapshot(directorio)))
+
+    with bloqueo_snapshot(directorio, exclusivo=True):
+        lector.start()
+        lector.join(0.3)
+        assert lector.is_alive() and not abiertos
+    lector.join(5)
+    assert len(abiertos) == 1 and abiertos[0].buscar('P1')['inv_sistema'] == 5